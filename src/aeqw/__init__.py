@@ -1,3 +1,8 @@
-import pkg_resources
+try:
+    from importlib.metadata import version
+except ImportError:  # Before Python 3.8
+    import pkg_resources
 
-__version__ = pkg_resources.require("aeqw")[0].version
+    __version__ = pkg_resources.require("aeqw")[0].version
+else:
+    __version__ = version("aeqw")
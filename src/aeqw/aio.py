@@ -0,0 +1,177 @@
+# aio.py
+# -*- coding: utf-8 -*-
+# Asynchronous interface to solve line groups from within other programs.
+
+import os
+import math
+import asyncio
+import shutil
+import tempfile
+import logging
+from aeqw.isynspec import ISynspec, makescratch
+from aeqw.cache import SynspecCache
+from aeqw.runner import makerunner
+from aeqw.warmstart import WarmStart
+from aeqw.cog import CurveTables
+from aeqw.config import Config
+from aeqw.cluster import (
+    Unit55Overrides,
+    PlanClusters,
+    SetLineList,
+    PlanBaselines,
+    RunBaselines,
+    SolveClusterSteps,
+    MakeSpares,
+    CheckSpeculate,
+)
+
+logger = logging.getLogger("aeqw.aio")
+
+
+# Configuration from a dictionary of options, named as the parameters of the
+# configuration file. The parameters of unit 55 to override can be given as a
+# dictionary under "unit55".
+def makeconfig(options=None):
+    conf = Config()
+    for param, value in (options or {}).items():
+        if param.lower() == "unit55":
+            conf["unit55"] = {key: str(val) for key, val in value.items()}
+        else:
+            conf["aeqw"][param.upper()] = str(value)
+    return conf
+
+
+# Run the steps of solving (see Drive in aeqw.cluster), awaiting SYNSPEC.
+async def drive(synspec_interface, steps):
+    try:
+        while True:
+            interfaces = next(steps)
+            if interfaces is None:
+                await synspec_interface.arun()
+            else:
+                await asyncio.gather(*[si.arun() for si in interfaces])
+    except StopIteration as stop:
+        return stop.value
+
+
+# Solve the line groups, given as a list of (lines, target equivalent width)
+# with the lines as INLIN objects, for the model in srcdir. This is an
+# asynchronous generator which yields (index of the group, result) as the
+# groups are solved, the results being those reported in the output of aeqw.
+# linelist is written to fort.19 (or the part of it near each synthetic spectrum,
+# with LINEMARGIN), by default the lines of the groups. At most
+# JOBS clusters of groups are solved at a time, each in its own scratch
+# directory (and SPECULATE more for the extra abundances run with its trials),
+# so that nothing is written to srcdir. If the consumer is cancelled
+# or closes the generator, the running SYNSPEC processes are killed and the
+# scratch directories removed. cache is the cache of SYNSPEC output to use
+# instead of the one configured. The total number of runs is logged at the end,
+# as by aeqw.
+async def solve_groups(
+    model, groups, options=None, linelist=None, srcdir=".", cache=None
+):
+    conf = makeconfig(options)
+    CheckSpeculate(conf)
+    if not groups:
+        return
+    if cache is None and conf.getconf("CACHE"):
+        cache = SynspecCache(
+            conf.getconf("CACHEDIR"), int(conf.getconf("CACHESIZE") * 2**20)
+        )
+    runner = makerunner(
+        conf.getconf("RUNNER"), conf.getconf("SYNSPEC"), conf.getconf("RUNLOG")
+    )
+    if linelist is None:
+        linelist = sorted(
+            [line for testLine, _ in groups for line in testLine],
+            key=lambda line: line.ALAM,
+        )
+    clusters = PlanClusters(conf, groups, linelist)
+    scratchroot = tempfile.mkdtemp(prefix="aeqw")
+    tasks = []
+    try:
+        interfaces = []
+        for _ in range(max(min(conf.getconf("JOBS"), len(clusters)), 1)):
+            workdir = tempfile.mkdtemp(prefix="worker", dir=scratchroot)
+            makescratch(workdir, model, srcdir, runner)
+            synspec_interface = ISynspec(model, workdir, cache, runner)
+            for param, value in Unit55Overrides(synspec_interface, conf).items():
+                setattr(synspec_interface, param, value)
+            SetLineList(synspec_interface, conf, linelist)
+            MakeSpares(synspec_interface, conf, scratchroot, srcdir)
+            interfaces.append(synspec_interface)
+
+        baselines = {}
+        if conf.getconf("BASELINEWIDTH") > 0:
+            baselines = await drive(
+                interfaces[0],
+                RunBaselines(
+                    interfaces[0],
+                    conf,
+                    PlanBaselines(
+                        conf, [[groups[i] for i in cluster] for cluster in clusters]
+                    ),
+                    SynspecCache(os.path.join(scratchroot, "baselines"), math.inf),
+                ),
+            )
+            for synspec_interface in interfaces:
+                synspec_interface.RELOP = interfaces[0].RELOP
+        warmstart = None
+        if conf.getconf("WARMSTART") != "":
+            warmstart = WarmStart(conf.getconf("WARMSTART"), interfaces[0].modelhash())
+        tables = None
+        if conf.getconf("COGTABLE") != "":
+            tables = CurveTables(conf.getconf("COGTABLE"), interfaces[0].modelhash())
+
+        pending = list(range(len(clusters)))
+        finished = asyncio.Queue()
+
+        async def work(synspec_interface):
+            while pending:
+                n = pending.pop(0)
+                try:
+                    results = await drive(
+                        synspec_interface,
+                        SolveClusterSteps(
+                            synspec_interface,
+                            conf,
+                            [groups[i] for i in clusters[n]],
+                            baselines,
+                            warmstart,
+                            tables,
+                        ),
+                    )
+                except Exception as err:
+                    await finished.put((n, err))
+                    return
+                await finished.put((n, results))
+
+        tasks = [asyncio.ensure_future(work(si)) for si in interfaces]
+        for _ in clusters:
+            n, results = await finished.get()
+            if isinstance(results, Exception):
+                raise results
+            for i, result in zip(clusters[n], results):
+                if warmstart is not None and result["result"] == "success":
+                    warmstart.add(groups[i][0], result["relabun"])
+                curve = result.pop("curve", None)
+                if tables is not None and curve is not None:
+                    tables.put(**curve)
+                yield i, result
+        logger.info(
+            "Total runs: %d (%d cached)",
+            sum([si.runs for si in interfaces]),
+            sum([si.cached for si in interfaces]),
+        )
+        if warmstart is not None:
+            warmstart.save()
+        if tables is not None:
+            tables.save()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        shutil.rmtree(scratchroot, ignore_errors=True)
+
+
+__all__ = ["makeconfig", "drive", "solve_groups"]
@@ -0,0 +1,265 @@
+# benchmark.py
+# -*- coding: utf-8 -*-
+# Benchmark of aeqw on synthetic inputs, with aeqw.fakesynspec in place of
+# SYNSPEC.
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import tempfile
+import logging
+from argparse import ArgumentParser
+from aeqw import fakesynspec
+from aeqw.isynspec import ISynspec, INLIN
+from aeqw.config import Config
+from aeqw.drivers import aeqw as solve
+from aeqw.output import outputjson
+
+logger = logging.getLogger("aeqw.benchmark")
+
+MODEL = "bench"
+ELEMENTS = (6, 7, 8, 14)
+
+
+# A line, and the line as written to the input file.
+def makeline(alam, Z, Q, gf, excl):
+    line = INLIN(
+        f"{alam:>10.4f}{Z:>3d}.{Q:0>2d}{gf:>7.3f}{excl:>12.3f} 1.0{excl + 20000:>12.3f} 2.0    8.80   0.00   0.00 0"
+    )
+    return line, str(line)
+
+
+# Write the inputs of a benchmark of ngroups line groups to workdir: the model,
+# fort.55, fort.56, aeqw.in and an RSynspec script running aeqw.fakesynspec.
+# Each group has one to three lines of an element, and about half of them are
+# blended with a line of another element. The target equivalent widths are
+# those of the fake SYNSPEC at abundances drawn within 1 dex of 1e-4, except
+# for a fraction unreachable of the groups, whose abundance would be above 1.
+# Returns the abundance of every group.
+def makeinputs(workdir, ngroups, seed=0, unreachable=0.0):
+    rng = random.Random(seed)
+    with open(os.path.join(workdir, MODEL + ".5"), "w") as f:
+        f.write(f"{fakesynspec.REFTEMP:.1f} 4.0\n")
+    with open(os.path.join(workdir, MODEL + ".7"), "w") as f:
+        f.write("")
+    with open(os.path.join(workdir, "fort.55"), "w") as f:
+        f.write(
+            ISynspec.temp55.format(
+                *[getattr(ISynspec, param) for param in ISynspec.params55]
+            ).replace("e", "")
+        )
+    with open(os.path.join(workdir, "fort.56"), "w") as f:
+        f.write("0\n")
+    script = os.path.join(workdir, "RSynspec")
+    with open(script, "w") as f:
+        f.write(f"#!/bin/sh\nexec '{sys.executable}' '{fakesynspec.__file__}' \"$@\"\n")
+    os.chmod(script, 0o755)
+
+    abundances = []
+    rows = []
+    alam = 300.0
+    for n in range(ngroups):
+        Z = rng.choice(ELEMENTS)
+        abun = 10 ** rng.uniform(-5.0, -3.0)
+        if rng.random() < unreachable:
+            abun = 10 ** rng.uniform(0.5, 1.0)
+        abundances.append(abun)
+        rows.append(f"C Group {n:d}")
+        group = []
+        for k in range(rng.randint(1, 3)):
+            group.append(
+                (
+                    alam + k * rng.uniform(0.05, 0.1),
+                    Z,
+                    rng.uniform(-1.0, 0.5),
+                    rng.uniform(0.0, 40000.0),
+                )
+            )
+        lines = [makeline(lam, Z, 2, gf, excl) for lam, Z, gf, excl in group]
+        target = sum(
+            [
+                fakesynspec.equivalentwidth(line, abun, fakesynspec.REFTEMP)
+                for line, _ in lines
+            ]
+        )
+        rows.extend([row + " 0" for _, row in lines[:-1]])
+        rows.append(f"{lines[-1][1]} {target:.1f}")
+        if rng.random() < 0.5:
+            blend = rng.choice([z for z in ELEMENTS if z != Z])
+            rows.append(
+                makeline(
+                    alam + rng.uniform(-0.1, 0.3),
+                    blend,
+                    2,
+                    rng.uniform(-1.0, 0.5),
+                    rng.uniform(0.0, 40000.0),
+                )[1]
+            )
+        alam += 2.0 + rng.uniform(0.0, 1.0)
+    with open(os.path.join(workdir, "aeqw.in"), "w") as f:
+        f.write("".join([row + "\n" for row in rows]))
+    return abundances
+
+
+# Solve a benchmark of ngroups line groups in a scratch directory, with the
+# configuration conf. Returns the wall time, the runs of SYNSPEC, the number of
+# groups which did not converge (other than those meant to be unreachable, which
+# are counted apart) and the largest error (in dex) of the abundances found.
+def runbenchmark(conf, ngroups, seed=0, unreachable=0.0, keep=False):
+    workdir = tempfile.mkdtemp(prefix="aeqwbench")
+    cwd = os.getcwd()
+    try:
+        abundances = makeinputs(workdir, ngroups, seed, unreachable)
+        conf["aeqw"]["SYNSPEC"] = os.path.join(workdir, "RSynspec")
+        os.chdir(workdir)
+        start = time.perf_counter()
+        runs, cached = solve(conf, MODEL, outputjson)
+        seconds = time.perf_counter() - start
+        with open(conf.getconf("OUTFN")) as f:
+            rows = [row for row in json.load(f)[1] if row["type"] == "line"]
+    finally:
+        os.chdir(cwd)
+        if keep:
+            logger.info(f"Kept benchmark of {ngroups:d} groups in {workdir}")
+        else:
+            shutil.rmtree(workdir)
+    failures = unsolved = 0
+    error = 0.0
+    for abun, row in zip(abundances, rows):
+        result = row["abundance"]
+        if abun > 1.0:
+            unsolved += result["result"] != "success"
+        elif result["result"] != "success":
+            failures += 1
+        else:
+            error = max(error, abs(math.log10(result["relabun"] / abun)))
+    return {
+        "groups": ngroups,
+        "seconds": seconds,
+        "runs": runs,
+        "cached": cached,
+        "runspergroup": runs / ngroups,
+        "failures": failures,
+        "unreachable": unsolved,
+        "maxerror": error,
+    }
+
+
+def parse_cmd(argv=None):
+    argparser = ArgumentParser(
+        description="Benchmark aeqw on synthetic inputs of increasing size, using a fake SYNSPEC."
+    )
+    argparser.add_argument(
+        "sizes",
+        type=int,
+        nargs="*",
+        default=[10, 40, 160],
+        help="Numbers of line groups of the inputs.",
+    )
+    argparser.add_argument(
+        "-c",
+        action="append",
+        help="Configuration files, read as by aeqw. Can be repeated.",
+    )
+    argparser.add_argument(
+        "-O",
+        "--option",
+        action="append",
+        default=[],
+        metavar="PARAM=VALUE",
+        help="Set a parameter of the configuration, such as SOLVER=bracket. Can be repeated.",
+    )
+    argparser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the synthetic inputs."
+    )
+    argparser.add_argument(
+        "--unreachable",
+        type=float,
+        default=0.0,
+        help="Fraction of line groups whose target cannot be reached.",
+    )
+    argparser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds the fake SYNSPEC sleeps on each run.",
+    )
+    argparser.add_argument(
+        "--point-latency",
+        dest="pointlatency",
+        type=float,
+        default=0.0,
+        help="Seconds the fake SYNSPEC sleeps for every thousand wavelength points, so that wider or finer spectra cost more.",
+    )
+    argparser.add_argument(
+        "--relop",
+        type=float,
+        help="Largest RELOP for which the fake SYNSPEC writes any output.",
+    )
+    argparser.add_argument("--json", help="Also write the results to this file.")
+    argparser.add_argument(
+        "--keep",
+        action="store_true",
+        help="Keep the scratch directories of the benchmarks.",
+    )
+    return argparser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_cmd(argv)
+    logging.basicConfig(level=logging.ERROR, format="%(levelname)-8s: %(message)s")
+    logger.setLevel(logging.INFO)
+
+    os.environ["AEQW_FAKE_LATENCY"] = str(args.latency)
+    os.environ["AEQW_FAKE_POINTLATENCY"] = str(args.pointlatency)
+    if args.relop is not None:
+        os.environ["AEQW_FAKE_RELOP"] = str(args.relop)
+    results = []
+    print(
+        f"{'groups':>7s} {'seconds':>9s} {'runs':>6s} {'runs/grp':>8s} {'failed':>6s} {'unreach':>7s} {'maxerr':>7s}"
+    )
+    for size in args.sizes:
+        conf = Config()
+        conf.addconfs(args.c)
+        conf["aeqw"].update(
+            {
+                "OUTFN": "bench.json",
+                "OUTFMT": "json",
+                "MANIFEST": "",
+                "CACHE": "False",
+                "RUNNER": "rsynspec",
+            }
+        )
+        for option in args.option:
+            param, _, value = option.partition("=")
+            conf["aeqw"][param.strip().upper()] = value.strip()
+        result = runbenchmark(conf, size, args.seed, args.unreachable, args.keep)
+        results.append(result)
+        print(
+            "{groups:>7d} {seconds:>9.3f} {runs:>6d} {runspergroup:>8.2f} {failures:>6d} {unreachable:>7d} {maxerror:>7.4f}".format_map(
+                result
+            )
+        )
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "options": args.option,
+                    "seed": args.seed,
+                    "latency": args.latency,
+                    "pointlatency": args.pointlatency,
+                    "results": results,
+                },
+                f,
+                indent=1,
+            )
+
+
+__all__ = ["makeinputs", "runbenchmark", "main"]
+
+if __name__ == "__main__":
+    main()
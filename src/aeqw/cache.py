@@ -0,0 +1,108 @@
+# cache.py
+# -*- coding: utf-8 -*-
+# Persistent cache of the output of SYNSPEC runs.
+
+import os
+import collections
+import hashlib
+import tempfile
+import logging
+import numpy as np
+
+logger = logging.getLogger("aeqw.cache")
+
+
+# Content addressed store of the bins read from fort.16. Each entry is a .npy
+# file named after the hash of the inputs of the run. The access time of an entry
+# is recorded in its modification time, which is used to evict the least
+# recently used entries once the total size exceeds maxsize (in bytes).
+class SynspecCache(object):
+    suffix = ".npy"
+
+    def __init__(self, cachedir, maxsize):
+        self.cachedir = os.path.expanduser(cachedir)
+        self.maxsize = maxsize
+        os.makedirs(self.cachedir, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        h = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode()
+            h.update(hashlib.sha256(part).digest())
+        return h.hexdigest()
+
+    def _entryfn(self, key):
+        return os.path.join(self.cachedir, key + self.suffix)
+
+    def get(self, key):
+        try:
+            bins = np.load(self._entryfn(key))
+            os.utime(self._entryfn(key))
+        except (FileNotFoundError, ValueError):
+            return None
+        logger.debug("   Cache hit: {0:s}".format(key))
+        return bins
+
+    def put(self, key, bins):
+        # Written to a temporary file first, so that concurrent readers never
+        # see a partial entry.
+        fd, tmpfn = tempfile.mkstemp(dir=self.cachedir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, bins)
+        os.replace(tmpfn, self._entryfn(key))
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for fn in os.listdir(self.cachedir):
+            if fn.endswith(self.suffix):
+                try:
+                    st = os.stat(os.path.join(self.cachedir, fn))
+                except FileNotFoundError:  # Evicted by another process
+                    continue
+                entries.append((st.st_mtime, st.st_size, fn))
+        total = sum([entry[1] for entry in entries])
+        for _, size, fn in sorted(entries):
+            if total <= self.maxsize:
+                break
+            logger.debug("   Evicting cache entry: {0:s}".format(fn))
+            try:
+                os.remove(os.path.join(self.cachedir, fn))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+# The bins of the most recently used runs kept in memory, in front of another
+# cache (such as a SynspecCache) if one is given, for a process which solves
+# many inputs.
+class MemoryCache(object):
+    def __init__(self, backing=None, maxentries=4096):
+        self.backing = backing
+        self.maxentries = maxentries
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        bins = None if self.backing is None else self.backing.get(key)
+        if bins is not None:
+            self._keep(key, bins)
+        return bins
+
+    def put(self, key, bins):
+        self._keep(key, bins)
+        if self.backing is not None:
+            self.backing.put(key, bins)
+
+    def _keep(self, key, bins):
+        self.entries[key] = bins
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxentries:
+            self.entries.popitem(last=False)
+
+
+__all__ = ["SynspecCache", "MemoryCache"]
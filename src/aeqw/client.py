@@ -0,0 +1,56 @@
+# client.py
+# -*- coding: utf-8 -*-
+# Thin client of aeqw.daemon, which takes the same arguments as aeqw. It only
+# uses the standard library, so that it starts quickly.
+
+import os
+import sys
+import json
+import socket
+
+
+# Path of the Unix socket of the daemon, AEQW_SOCKET if set.
+def socketpath():
+    return os.environ.get("AEQW_SOCKET", os.path.expanduser("~/.aeqw.sock"))
+
+
+# Send the arguments and working directory to the daemon, and print what it
+# logs till it is done. Returns the exit status, or None if no daemon listens
+# at path.
+def request(argv, path=None):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socketpath() if path is None else path)
+    except OSError:
+        sock.close()
+        return None
+    with sock, sock.makefile("rwb") as f:
+        f.write(json.dumps({"argv": argv, "cwd": os.getcwd()}).encode() + b"\n")
+        f.flush()
+        for row in f:
+            message = json.loads(row)
+            if "log" in message:
+                print(message["log"], file=sys.stderr)
+            if "exit" in message:
+                return message["exit"]
+    print("aeqw: lost the connection to the daemon", file=sys.stderr)
+    return 1
+
+
+# Solve the input of the working directory with the daemon, or with aeqw itself
+# if no daemon is running.
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    status = request(argv)
+    if status is None:
+        from aeqw.__main__ import main as aeqwmain
+
+        aeqwmain(argv)
+        status = 0
+    sys.exit(status)
+
+
+__all__ = ["socketpath", "request", "main"]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1010 @@
+# cluster.py
+# -*- coding: utf-8 -*-
+# Reading the inputs of aeqw and solving clusters of line groups with SYNSPEC.
+
+import math
+import time
+import tempfile
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from aeqw.isynspec import ISynspec, INLIN, makescratch
+from aeqw.linelist import readlinelist, LineIndex
+from aeqw.cache import SynspecCache
+from aeqw.eqw import LO, HI, EQW, boxsums, windowsums
+from aeqw.solvers import CurveOfGrowthAbundance, StartSolver
+
+logger = logging.getLogger("aeqw.cluster")
+
+
+# Parameters of unit 55 overridden by the [unit55] section of the configuration.
+def Unit55Overrides(synspec_interface, conf):
+    overrides = {}
+    if "unit55" in conf:
+        for param in conf["unit55"]:
+            if hasattr(synspec_interface, param.upper()):
+                overrides[param.upper()] = type(
+                    getattr(synspec_interface, param.upper())
+                )(conf["unit55"][param])
+                logger.info(
+                    f"Setting unit 55 parameter {param.upper()} to {overrides[param.upper()]}"
+                )
+    return overrides
+
+
+def ReadInput(conf):
+    allLines = (
+        []
+    )  # allLines stores the information of all the lines that are going to be used
+    # testLines stores which all lines have to be tested. It is a list. Each
+    # element can either be a string or a or a testline. A testLine has the
+    # format: Couple of a tuple and a float. The tuple is a list of lines to be
+    # tested simultaneously. The float is the target equivalent width.
+    testLines = []
+    tempTL = []
+
+    lineNo = 1
+
+    logger.debug("Reading input file.")
+    with open(conf.getconf("INFN")) as f:
+        for line in f:
+            logger.debug(f" Processing line: {line.strip()}")
+            lineNo += 1
+            if line[0] == "#":  # Unprinted Comment
+                continue
+            if line[0] == "C":  # Printed Comment
+                testLines.append(line[2:])
+                continue
+            if line.strip() == "":  # Empty Line
+                continue
+            try:
+                inline = INLIN(line)
+                allLines.append(inline)
+                if inline.remainder.strip():
+                    tempTL.append(allLines[-1])
+                    if float(inline.remainder.split()[0]) != 0:
+                        TargetError(tempTL)
+                        testLines.append((tempTL, float(inline.remainder.split()[0])))
+                        tempTL = []
+            except Exception:
+                logger.error(f"Error while processing line {lineNo:d}\n{line}\n")
+                raise
+
+    if conf.getconf("LINELISTFN") != "":
+        return readlinelist(conf.getconf("LINELISTFN")).merge(allLines), testLines
+    allLines.sort(key=lambda x: x.ALAM)
+    return allLines, testLines
+
+
+# Set the lines of fort.19. With LINEMARGIN, fort.19 is written by InitParam for
+# every synthetic spectrum, with only the lines within LINEMARGIN of it, which
+# are looked up in the index of the lines. Otherwise all of them are written
+# once.
+def SetLineList(synspec_interface, conf, lines):
+    synspec_interface.LINELIST = lines
+    synspec_interface.lineindex = LineIndex(lines)
+    if conf.getconf("LINEMARGIN") <= 0:
+        synspec_interface.write19()
+
+
+# The half widths (BROAD, RANGE) of the box over which the equivalent width is
+# taken and of the synthetic spectrum.
+def Widths(conf):
+    return conf.getconf("BROAD"), conf.getconf("RANGE")
+
+
+# Determining the bounds of the synthetic spectrum ALAM0 and ALAM1. The multiplication by ten is for conversion from nm to A. Also writing to 19 and 55
+# If the bins of a run are given as grid, the bounds are widened to the edges of
+# its bins, so that the spectrum is binned as that run (see SnapWindow).
+def InitParam(synspec_interface, conf, testLine, widths=None, grid=None):
+    _, halfwidth = Widths(conf) if widths is None else widths
+    synspec_interface.ALAM0 = min([line.ALAM for line in testLine]) * 10 - halfwidth
+    synspec_interface.ALAM1 = max([line.ALAM for line in testLine]) * 10 + halfwidth
+    if grid is not None:
+        synspec_interface.ALAM0, synspec_interface.ALAM1 = SnapWindow(
+            grid, synspec_interface.ALAM0, synspec_interface.ALAM1
+        )
+    logger.debug(
+        f" InitParam: Setting range of synthetic spectrum: ({synspec_interface.ALAM0:.1f}, {synspec_interface.ALAM1:.1f})"
+    )
+
+    synspec_interface.write55()
+
+    if conf.getconf("SEP19") == True:
+        synspec_interface.LINELIST = testLine
+        synspec_interface.write19()
+    elif conf.getconf("LINEMARGIN") > 0:
+        synspec_interface.LINELIST = synspec_interface.lineindex.window(
+            synspec_interface.ALAM0 - conf.getconf("LINEMARGIN"),
+            synspec_interface.ALAM1 + conf.getconf("LINEMARGIN"),
+        )
+        synspec_interface.write19()
+
+
+# The uncertainty of the target equivalent width of a line group, which may be
+# given after the target on the last line of the group, or None.
+def TargetError(testLine):
+    fields = getattr(testLine[-1], "remainder", "").split()
+    if len(fields) < 2:
+        return None
+    return abs(float(fields[1]))
+
+
+# The inputs of SYNSPEC for a line group on its own: the hash of the model,
+# fort.55 as set for the group, the lines of the group, and the other lines of
+# the line list within its synthetic spectrum (and LINEMARGIN of it, if set).
+def GroupInputs(synspec_interface, conf, testLine):
+    margin = max(conf.getconf("LINEMARGIN"), 0.0)
+    alam0 = min([line.ALAM for line in testLine]) * 10 - conf.getconf("RANGE")
+    alam1 = max([line.ALAM for line in testLine]) * 10 + conf.getconf("RANGE")
+    return (
+        synspec_interface.modelhash(),
+        synspec_interface.render55(ALAM0=alam0, ALAM1=alam1),
+        "".join([f"{line}\n" for line in testLine]),
+        "".join(
+            [
+                f"{line}\n"
+                for line in synspec_interface.lineindex.window(
+                    alam0 - margin, alam1 + margin
+                )
+            ]
+        ),
+    )
+
+
+# Key of the result of a line group in the manifest. It is the hash of the
+# inputs of the group (see GroupInputs), its target (and its uncertainty, if
+# given), the identity of the runner (see aeqw.runner.Runner.identity), and the
+# parameters of the solver and of anything else which may change the result.
+def GroupKey(synspec_interface, conf, group):
+    testLine, xeqw = group
+    params = (
+        "BROAD",
+        "RANGE",
+        "EPSILON",
+        "NULLABUN",
+        "LOGATREF",
+        "SOLVER",
+        "SEP19",
+        "MAXITER",
+        "INITABUN",
+        "JOINT",
+        "CLUSTERWIDTH",
+        "WARMSTART",
+    )
+    if conf.getconf("ADAPTWINDOW"):
+        params += ("ADAPTWINDOW", "MINBROAD", "MAXBROAD")
+    if conf.getconf("COARSE") > 0:
+        params += ("COARSE", "COARSESPACE", "COARSERELOP", "COARSECUTOF0")
+    if conf.getconf("LINEMARGIN") > 0:
+        params += ("LINEMARGIN",)
+    if conf.getconf("BASELINEWIDTH") > 0:
+        params += ("BASELINEWIDTH",)
+    if conf.getconf("COGTABLE") != "":
+        params += ("COGTABLE", "COGSPAN", "COGVERIFY")
+    if conf.getconf("SPECULATE") > 0:
+        params += ("SPECULATE", "SPECSPREAD")
+    model, unit55, lines, others = GroupInputs(synspec_interface, conf, testLine)
+    return SynspecCache.key(
+        model,
+        unit55,
+        lines,
+        repr(xeqw)
+        + ("" if TargetError(testLine) is None else f" {TargetError(testLine)!r}"),
+        others,
+        synspec_interface.runner.identity(),
+        " ".join([f"{param}={conf.getconf(param)}" for param in params]),
+    )
+
+
+# Key of the curve of growth of a line group in CurveTables. It is that of the
+# manifest without the target, on which the curve does not depend, and with
+# only the parameters the curve depends on.
+def CurveKey(synspec_interface, conf, testLine):
+    params = ("BROAD", "RANGE", "EPSILON", "NULLABUN", "SEP19")
+    if conf.getconf("LINEMARGIN") > 0:
+        params += ("LINEMARGIN",)
+    return SynspecCache.key(
+        *GroupInputs(synspec_interface, conf, testLine),
+        " ".join([f"{param}={conf.getconf(param)}" for param in params]),
+    )
+
+
+# Calculate the Equivalent widths of line groups, from the bins of the last run
+# unless others are given. The total equivalent width is taken over the range of
+# the synthetic spectrum InitParam would set for the group, so that it is the
+# same when the spectrum is shared with other groups. widths are the half widths
+# (BROAD, RANGE) to use instead of those configured.
+def CalcEqws(synspec_interface, conf, testLines, bins=None, widths=None):
+    start = time.perf_counter()
+    if bins is None:
+        bins = synspec_interface.EQW
+    if len(bins) < 2:
+        logger.warning("  CalcEqw: SYNSPEC did not generate output in fort.16")
+        return [(None, 0)] * len(testLines)
+    broad, halfwidth = Widths(conf) if widths is None else widths
+    lo = [min([line.ALAM for line in testLine]) * 10 for testLine in testLines]
+    hi = [max([line.ALAM for line in testLine]) * 10 for testLine in testLines]
+    boxes = [(l - broad, h + broad) for l, h in zip(lo, hi)]
+    windows = [(l - halfwidth, h + halfwidth) for l, h in zip(lo, hi)]
+    eqws = list(
+        zip(
+            [float(t) for t in boxsums(bins, boxes)],
+            [float(t) for t in windowsums(bins, windows)],
+        )
+    )
+    for box, (total, alltotal) in zip(boxes, eqws):
+        logger.debug(
+            f"  CalcEqw: Calculating Equivalent width; including bins in {box}."
+        )
+        logger.debug(f"  CalcEqw: eqw = {total:f}, alleqw = {alltotal:f}")
+    synspec_interface.addtime("CalcEqw", start)
+    return eqws
+
+
+# Calculate the Equivalent width of a particular line
+def CalcEqw(synspec_interface, conf, testLine, bins=None, widths=None):
+    return CalcEqws(synspec_interface, conf, [testLine], bins, widths)[0]
+
+
+# Half widths (BROAD, RANGE) fitted to the absorption of a line group, measured
+# from the bins of a trial which gave the equivalent width eqw (above the zero,
+# whose bins are zerobins) in the spectrum of half width widths[1]. BROAD is the
+# smallest half width leaving out of the box the absorption which, scaled to
+# the target xeqw, is EPSILON/2, within MINBROAD and MAXBROAD. If the absorption
+# reaches the edge of the spectrum BROAD is set to MAXBROAD. RANGE is scaled by
+# the same factor. Returns None if the trial shows no absorption to measure.
+def FitWidths(conf, testLine, xeqw, bins, zerobins, eqw, widths):
+    if eqw is None or eqw * xeqw <= 0 or len(bins) < 2 or len(zerobins) < 2:
+        return None
+    lo = min([line.ALAM for line in testLine]) * 10
+    hi = max([line.ALAM for line in testLine]) * 10
+    profile = np.clip(
+        math.copysign(1, xeqw) * (bins[:, EQW] - boxsums(zerobins, bins[:, :2])),
+        0.0,
+        None,
+    )
+    if profile.sum() <= 0:
+        return None
+    distance = np.maximum(np.maximum(lo - bins[:, LO], bins[:, HI] - hi), 0.0)
+    order = np.argsort(distance)
+    outside = profile.sum() - np.cumsum(profile[order])
+    allowed = conf.getconf("EPSILON") / 2 * abs(eqw / xeqw)
+    broad = float(distance[order][np.argmax(outside <= allowed)])
+    if broad >= widths[1] - (bins[-1, HI] - bins[-1, LO]):
+        broad = conf.getconf("MAXBROAD")
+    broad = min(max(broad, conf.getconf("MINBROAD")), conf.getconf("MAXBROAD"))
+    return broad, widths[1] * broad / widths[0]
+
+
+# The steps of solving are generators, which yield whenever SYNSPEC has to be
+# run on the unit files they have written. The caller runs it, synchronously
+# with Drive or asynchronously (see aeqw.aio), and resumes them; the value they
+# return is that of the step. A step may instead yield a list of interfaces
+# (see RunMany), in all of which SYNSPEC is run at once.
+def Drive(synspec_interface, steps):
+    try:
+        while True:
+            interfaces = next(steps)
+            if interfaces is None:
+                synspec_interface.run()
+                continue
+            with ThreadPoolExecutor(len(interfaces)) as pool:
+                list(pool.map(lambda si: si.run(), interfaces))
+    except StopIteration as stop:
+        return stop.value
+
+
+# Set the abundance and run SYNSPEC and read the output
+def Run(synspec_interface, abundances):
+    logger.debug(f"  Setting abundance: {abundances}")
+    synspec_interface.ABUNDANCES = abundances
+    synspec_interface.write56()
+    yield
+    synspec_interface.read16()
+
+
+# Run SYNSPEC with each of the lists of abundances, as many at a time as the
+# interface has spares (see MakeSpares) besides itself. The spares are given
+# the unit files of the interface, and their runs are counted as its own.
+# Returns the bins of every run, those of the last being left in the interface.
+def RunMany(synspec_interface, abundancesets):
+    interfaces = [synspec_interface] + synspec_interface.spares
+    bins = []
+    for k in range(0, len(abundancesets), len(interfaces)):
+        batch = list(zip(interfaces, abundancesets[k : k + len(interfaces)]))
+        if len(batch) == 1:
+            yield from Run(synspec_interface, batch[0][1])
+            bins.append(synspec_interface.EQW)
+            continue
+        for si, abundances in batch:
+            logger.debug(f"  Setting abundance: {abundances} in {si.workdir}")
+            if si is not synspec_interface:
+                si.mirror(synspec_interface)
+            si.ABUNDANCES = abundances
+            si.write56()
+        yield [si for si, _ in batch]
+        for si, _ in batch:
+            bins.append(si.read16())
+            if si is not synspec_interface:
+                synspec_interface.absorb(si)
+    synspec_interface.EQW = bins[-1]
+    return bins
+
+
+# SPECULATE is an error with any solver but bracket, which is checked before
+# anything is run.
+def CheckSpeculate(conf):
+    if conf.getconf("SPECULATE") > 0 and conf.getconf("SOLVER") != "bracket":
+        logger.error("SPECULATE is only used by the bracket solver")
+        raise ValueError
+
+
+# Give the interface SPECULATE spares, each in its own scratch directory in
+# scratchroot populated from srcdir, to run the extra abundances of the bracket
+# solver at once with its trials (see Speculate).
+def MakeSpares(synspec_interface, conf, scratchroot, srcdir):
+    synspec_interface.spares = []
+    if conf.getconf("SPECULATE") <= 0:
+        return
+    CheckSpeculate(conf)
+    for _ in range(conf.getconf("SPECULATE")):
+        workdir = tempfile.mkdtemp(prefix="spare", dir=scratchroot)
+        makescratch(workdir, synspec_interface.model, srcdir, synspec_interface.runner)
+        synspec_interface.spares.append(
+            ISynspec(
+                synspec_interface.model,
+                workdir,
+                synspec_interface.cache,
+                synspec_interface.runner,
+            )
+        )
+
+
+# Extra abundances run along with a trial of the bracket solver, n of them
+# spread evenly within spread dex on either side of it (the odd one above),
+# so that the solver is likely to get a bracket, or even the answer, from a
+# single round. Abundances above 1 are left out.
+def Speculate(trial, n, spread):
+    m = (n + 1) // 2
+    steps = [spread * j / m for j in range(1, m + 1)]
+    steps = [s for pair in zip(steps, [-s for s in steps]) for s in pair][:n]
+    return [trial * 10**s for s in steps if trial * 10**s <= 1.0]
+
+
+# Run SYNSPEC with the null abundance of the given elements. If SYNSPEC does not
+# generate any output RELOP is lowered and it is run again.
+def RunNull(synspec_interface, conf, elements):
+    logger.debug(" Performing zero check")
+    abun = conf.getconf("NULLABUN")
+    yield from Run(synspec_interface, [(Z, abun) for Z in elements])
+    while len(synspec_interface.EQW) < 2:  # If the program didn't compute the bins
+        logger.warning("  RunNull: SYNSPEC did not generate output in fort.16")
+        if synspec_interface.RELOP > 1e-12:
+            synspec_interface.relopretries += 1
+            synspec_interface.RELOP /= 10
+            logger.debug(f" > Setting RELOP parameter to {synspec_interface.RELOP:.1e}")
+            synspec_interface.write55()
+        yield from Run(synspec_interface, [(Z, abun) for Z in elements])
+
+
+# Zero baselines are null abundance runs shared by all the line groups of an
+# element. Each covers the lines of a span of at most BASELINEWIDTH. Returns the
+# lines of the spans of each element.
+def PlanBaselines(conf, clusters):
+    spans = {}
+    lines = sorted(
+        [line for cluster in clusters for testLine, _ in cluster for line in testLine],
+        key=lambda line: (line.Z, line.ALAM),
+    )
+    for line in lines:
+        span = spans.get(line.Z, [[]])[-1]
+        if span and (line.ALAM - span[0].ALAM) * 10 + 2 * conf.getconf(
+            "RANGE"
+        ) <= conf.getconf("BASELINEWIDTH"):
+            span.append(line)
+        else:
+            spans.setdefault(line.Z, []).append([line])
+    return spans
+
+
+# Run the zero baselines. If a store is given they are cached in it instead of
+# the cache of the interface, so that processes sharing it do not run them
+# again. Returns the range and bins of the baselines of each element.
+def RunBaselines(synspec_interface, conf, spans, store=None):
+    baselines = {}
+    cache = synspec_interface.cache
+    if store is not None:
+        synspec_interface.cache = store
+    try:
+        for Z in spans:
+            for span in spans[Z]:
+                InitParam(synspec_interface, conf, span)
+                yield from RunNull(synspec_interface, conf, [Z])
+                baselines.setdefault(Z, []).append(
+                    (
+                        (span[0].ALAM, span[-1].ALAM),
+                        synspec_interface.EQW,
+                    )
+                )
+    finally:
+        synspec_interface.cache = cache
+    logger.debug(
+        f"Ran {sum([len(b) for b in baselines.values()])} zero baselines for {len(baselines)} elements"
+    )
+    return baselines
+
+
+# The bounds (alam0, alam1) widened to the nearest edges of bins outside them.
+# As the bins of fort.16 start from ALAM0, a run over these bounds is binned as
+# bins within them. Bounds beyond the bins are kept.
+def SnapWindow(bins, alam0, alam1):
+    los = bins[bins[:, LO] <= alam0 + 1e-6, LO]
+    his = bins[bins[:, HI] >= alam1 - 1e-6, HI]
+    return (
+        float(los[-1]) if len(los) else alam0,
+        float(his[0]) if len(his) else alam1,
+    )
+
+
+# Whether the bins of the zero baseline are those of a run binned as bins about
+# the boxes of each of the line groups (with half widths widths). Where the
+# edges of the bins differ, the bins cut by the edges of a box differ too, and
+# the absorption of blends is not cancelled by the zero.
+def SameGrid(testLines, baseline, bins, widths):
+    if len(bins) < 2 or len(baseline) < 2:
+        return False
+    for testLine in testLines:
+        lo = min([line.ALAM for line in testLine]) * 10 - widths[0]
+        hi = max([line.ALAM for line in testLine]) * 10 + widths[0]
+        inside = bins[(bins[:, HI] > lo) & (bins[:, LO] < hi)]
+        k = np.clip(
+            np.searchsorted(baseline[:, LO], inside[:, LO] - 1e-6), 0, len(baseline) - 1
+        )
+        if not np.allclose(baseline[k, :2], inside[:, :2], rtol=0.0, atol=1e-6):
+            return False
+    return True
+
+
+# The bins of the zero baseline covering all the lines of a cluster, if any.
+# Clusters of several elements have none, as the baselines null one element.
+def FindBaseline(baselines, cluster):
+    lines = [line for testLine, _ in cluster for line in testLine]
+    if len(set([line.Z for line in lines])) > 1:
+        return None
+    for span, bins in baselines.get(lines[0].Z, []):
+        if span[0] <= min([line.ALAM for line in lines]) and span[1] >= max(
+            [line.ALAM for line in lines]
+        ):
+            return bins
+    return None
+
+
+# Whether line group i can share the runs of the groups of cluster of other
+# elements, whose trial abundances would also be set in every run. It can if no
+# line of the index of its element lies within their boxes, nor any of theirs
+# within its box.
+def Unblended(conf, index, groups, cluster, i):
+    def blends(group, Z):
+        lines = index.window(
+            min([line.ALAM for line in group[0]]) * 10 - conf.getconf("BROAD"),
+            max([line.ALAM for line in group[0]]) * 10 + conf.getconf("BROAD"),
+        )
+        return bool(np.any(lines.array["Z"] == Z))
+
+    Z = groups[i][0][0].Z
+    return not any(
+        [
+            blends(groups[i], groups[j][0][0].Z) or blends(groups[j], Z)
+            for j in cluster
+            if groups[j][0][0].Z != Z
+        ]
+    )
+
+
+# Clusters of line groups which are solved in a shared synthetic spectrum, as
+# long as the spectrum is no wider than CLUSTERWIDTH and the boxes over which
+# their equivalent widths are taken do not overlap. Only groups of the same
+# element are clustered, unless JOINT is set and the lines of the input are
+# given, in which case groups of other elements are too if they are not blended
+# with each other (see Unblended). Returns lists of indices into groups.
+def PlanClusters(conf, groups, lines=None):
+    if conf.getconf("CLUSTERWIDTH") <= 0:
+        return [[i] for i in range(len(groups))]
+    joint = conf.getconf("JOINT") and lines is not None
+    if joint:
+        index = LineIndex(lines)
+    clusters = []
+    order = sorted(
+        range(len(groups)),
+        key=lambda i: (
+            0 if joint else groups[i][0][0].Z,
+            min([line.ALAM for line in groups[i][0]]),
+        ),
+    )
+    for i in order:
+        lo = min([line.ALAM for line in groups[i][0]]) * 10
+        hi = max([line.ALAM for line in groups[i][0]]) * 10
+        if (
+            clusters
+            and (
+                Unblended(conf, index, groups, clusters[-1], i)
+                if joint
+                else groups[clusters[-1][0]][0][0].Z == groups[i][0][0].Z
+            )
+            and hi - start + 2 * conf.getconf("RANGE") <= conf.getconf("CLUSTERWIDTH")
+            and lo - end > 2 * conf.getconf("BROAD")
+        ):
+            clusters[-1].append(i)
+            end = max(end, hi)
+        else:
+            clusters.append([i])
+            start, end = lo, hi
+    logger.debug(f"Solving {len(groups)} line groups in {len(clusters)} clusters")
+    return clusters
+
+
+# Set the fidelity of the following runs. Coarse runs have SPACE, RELOP and
+# CUTOF0 of fort.55 multiplied by COARSESPACE, COARSERELOP and COARSECUTOF0.
+def SetFidelity(synspec_interface, conf, coarse):
+    synspec_interface.coarse = None
+    if coarse:
+        synspec_interface.coarse = {
+            "SPACE": conf.getconf("COARSESPACE"),
+            "RELOP": conf.getconf("COARSERELOP"),
+            "CUTOF0": conf.getconf("COARSECUTOF0"),
+        }
+    synspec_interface.write55()
+
+
+# Abundances of group i of cluster at its target equivalent width less and plus
+# sigma, from the full fidelity observations of the group and the zero of its
+# box. SYNSPEC is only run if a target lies outside the widths observed: at the
+# abundance extrapolated along the curve of growth and 0.05 dex beyond it, at
+# most three times, with the other elements at their abundances in abundances
+# (a dictionary by Z). Returns (lower, upper); lower is 0 if the target less
+# sigma is not positive, and either is None if it could not be found.
+def ErrorSteps(
+    synspec_interface, conf, cluster, i, observations, zero, widths, sigma, abundances
+):
+    testLine, xeqw = cluster[i]
+    SetFidelity(synspec_interface, conf, False)
+    bounds = []
+    for sign in (-1, 1):
+        target = xeqw + sign * sigma
+        if target <= 0:
+            bounds.append(0.0)
+            continue
+        abun = CurveOfGrowthAbundance(observations, target)
+        for _ in range(3):
+            if abun is not None:
+                break
+            trial = CurveOfGrowthAbundance(observations, target, True)
+            if trial is None or trial * 10 ** (0.05 * sign) > 1.0:
+                break
+            trial *= 10 ** (0.05 * sign)
+            logger.debug(f" Running for abundance: {trial:e}, target width: {target:f}")
+            yield from Run(
+                synspec_interface,
+                sorted({**abundances, testLine[0].Z: trial}.items()),
+            )
+            eqw, _ = CalcEqw(synspec_interface, conf, testLine, widths=widths)
+            observations.append((trial, None if eqw is None else eqw - zero))
+            abun = CurveOfGrowthAbundance(observations, target)
+        bounds.append(abun)
+    return tuple(bounds)
+
+
+# The counters of the interface: runs, cached runs, RELOP retries and the time
+# spent in each phase.
+def Counters(synspec_interface):
+    return (
+        synspec_interface.runs,
+        synspec_interface.cached,
+        synspec_interface.relopretries,
+        dict(synspec_interface.timings),
+    )
+
+
+# The counters of the interface since start (see Counters), as in the
+# statistics of a line group.
+def CountersSince(synspec_interface, start):
+    return {
+        "runs": synspec_interface.runs - start[0],
+        "cached": synspec_interface.cached - start[1],
+        "relopretries": synspec_interface.relopretries - start[2],
+        "seconds": {
+            phase: seconds - start[3].get(phase, 0.0)
+            for phase, seconds in synspec_interface.timings.items()
+        },
+    }
+
+
+# The statistics (see aeqw.metrics) of a line group of cluster solved by method
+# with the given result, in trials of which coarse had coarse runs, since the
+# counters were start.
+def GroupStats(
+    synspec_interface,
+    start,
+    result,
+    trials,
+    coarse,
+    method,
+    seeded,
+    widths,
+    cluster,
+):
+    return {
+        "trials": trials,
+        "coarse": coarse,
+        **CountersSince(synspec_interface, start),
+        "converged": result["result"] == "success",
+        "method": method,
+        "seeded": seeded,
+        "window": [synspec_interface.ALAM0, synspec_interface.ALAM1],
+        "broad": widths[0],
+        "cluster": len(cluster),
+    }
+
+
+# Find the abundances which reproduce the target equivalent widths of a cluster
+# of line groups, given as a list of (testLine, xeqw). Every run of SYNSPEC is
+# shared by all the groups of the cluster, and each group is iterated by its own
+# solver. The groups of each element take turns at the abundance of the element
+# in a run. The zero check is taken from baselines if they cover the cluster,
+# and the first trials are seeded from warmstart if given. Returns the entries
+# of finAbun for the groups, with the statistics of each group (see
+# aeqw.metrics) under "stats", and the abundances at the target less and plus
+# its uncertainty (see ErrorSteps) under "relabun_lo" and "relabun_hi" if one
+# is given. If the tables of the curves of growth are given, the groups are
+# solved from them instead (see CurveOfGrowthSteps).
+def SolveCluster(
+    synspec_interface, conf, cluster, baselines=None, warmstart=None, tables=None
+):
+    return Drive(
+        synspec_interface,
+        SolveClusterSteps(
+            synspec_interface, conf, cluster, baselines, warmstart, tables
+        ),
+    )
+
+
+def SolveClusterSteps(
+    synspec_interface, conf, cluster, baselines=None, warmstart=None, tables=None
+):
+    if baselines is None:
+        baselines = {}
+    if tables is not None:
+        from aeqw.cog import CurveOfGrowthSteps
+
+        return (
+            yield from CurveOfGrowthSteps(
+                synspec_interface, conf, cluster, baselines, warmstart, tables
+            )
+        )
+    start = Counters(synspec_interface)
+    elements = [testLine[0].Z for testLine, _ in cluster]
+    for testLine, xeqw in cluster:
+        logger.info(
+            "Calculating for following lines with target equivalent width: %f", xeqw
+        )
+        for t in testLine:
+            logger.info(str(t))
+    synspec_interface.coarse = None
+    # The zero check is run for each fidelity (True for coarse runs) when it is
+    # first needed, and kept as the bins and zeros of the groups. With a zero
+    # baseline, the runs are binned as it.
+    baseline = FindBaseline(baselines, cluster)
+    InitParam(
+        synspec_interface,
+        conf,
+        [line for testLine, _ in cluster for line in testLine],
+        grid=baseline,
+    )
+    zerobins = {}
+    zeros = {}
+    widths = Widths(conf)
+    adapt = conf.getconf("ADAPTWINDOW") and len(cluster) == 1
+
+    # Finding the abundance that gives reasonable eqw. With COARSE, each group
+    # is first iterated with coarse runs to within COARSE times EPSILON, and
+    # then from the abundance found with full fidelity runs.
+    coarsen = conf.getconf("COARSE") > 0
+    iterations = []
+    seeds = []
+    seeded = []
+    for testLine, xeqw in cluster:
+        seed = None if warmstart is None else warmstart.seed(testLine)
+        seeded.append(seed is not None)
+        if seed is None:
+            seed = (
+                synspec_interface.INITABUNZWISE.get(
+                    testLine[0].Z, conf.getconf("INITABUN")
+                ),
+                None,
+            )
+        else:
+            logger.debug(f" Warm start: {seed[0]:e}, spread {seed[1]:.2f} dex")
+        seeds.append(seed)
+        iterations.append(
+            StartSolver(
+                conf,
+                xeqw,
+                seed,
+                conf.getconf("COARSE") * conf.getconf("EPSILON") if coarsen else None,
+            )
+        )
+    coarse = [coarsen] * len(cluster)
+    trials = {i: next(iteration) for i, iteration in enumerate(iterations)}
+    # The extra abundances run with a trial are spread by at most SPECSPREAD,
+    # or the spread of its seed, and then by the last step of the solver.
+    nspares = len(synspec_interface.spares)
+    spreads = [
+        min(conf.getconf("SPECSPREAD"), math.inf if seed[1] is None else seed[1])
+        for seed in seeds
+    ]
+    ntrials = [0] * len(cluster)
+    ncoarse = [0] * len(cluster)
+    history = [[] for _ in cluster]
+    results = [None] * len(cluster)
+    uncertain = []  # Groups whose uncertainties are to be found
+    current = {}  # Abundances of the elements in the last run
+
+    while trials:
+        for i in trials:
+            ntrials[i] += 1
+            ncoarse[i] += coarse[i]
+        # Every abundance asked for is run once for each fidelity, and each
+        # group observes all the runs of its fidelity in the round with its
+        # element at an abundance asked for, its own trial last. Elements which
+        # have run out of abundances are kept at their last one.
+        observations = {i: [] for i in trials}
+        for fidelity in sorted(set([coarse[i] for i in trials])):
+            group = [i for i in trials if coarse[i] == fidelity]
+            SetFidelity(synspec_interface, conf, fidelity)
+            if fidelity not in zeros and (fidelity or baseline is None):
+                yield from RunNull(synspec_interface, conf, sorted(set(elements)))
+                zerobins[fidelity] = synspec_interface.EQW
+                zeros[fidelity] = CalcEqws(
+                    synspec_interface,
+                    conf,
+                    [testLine for testLine, _ in cluster],
+                    zerobins[fidelity],
+                    widths,
+                )
+                for zero, allzero in zeros[fidelity]:
+                    logger.debug(f" > Zero = {zero:f}, allZero = {allzero:f}")
+            # With spares, the extra abundances of each trial are run at once
+            # with it, and observed as the others.
+            abuns = {
+                Z: sorted(
+                    set(
+                        [
+                            abun
+                            for i in group
+                            if elements[i] == Z
+                            for abun in [trials[i]]
+                            + Speculate(trials[i], nspares, spreads[i])
+                        ]
+                    )
+                )
+                for Z in sorted(set([elements[i] for i in group]))
+            }
+            abundancesets = [
+                [(Z, a[min(k, len(a) - 1)]) for Z, a in abuns.items()]
+                for k in range(max([len(a) for a in abuns.values()]))
+            ]
+            bins = yield from RunMany(synspec_interface, abundancesets)
+            current.update(abundancesets[-1])
+            # The zero baseline is only used if the runs of the cluster are
+            # binned as it is about the boxes of the groups, otherwise the zero
+            # check is run. If it has to lower RELOP the runs are repeated.
+            if fidelity not in zeros:
+                if SameGrid(
+                    [testLine for testLine, _ in cluster], baseline, bins[0], widths
+                ):
+                    logger.debug(" Using zero baseline")
+                    zerobins[fidelity] = baseline
+                else:
+                    logger.debug(" Zero baseline binned otherwise, running zero check")
+                    relop = synspec_interface.RELOP
+                    yield from RunNull(synspec_interface, conf, sorted(set(elements)))
+                    zerobins[fidelity] = synspec_interface.EQW
+                    if synspec_interface.RELOP != relop:
+                        bins = yield from RunMany(synspec_interface, abundancesets)
+                        current.update(abundancesets[-1])
+                    synspec_interface.EQW = bins[-1]
+                zeros[fidelity] = CalcEqws(
+                    synspec_interface,
+                    conf,
+                    [testLine for testLine, _ in cluster],
+                    zerobins[fidelity],
+                    widths,
+                )
+                for zero, allzero in zeros[fidelity]:
+                    logger.debug(f" > Zero = {zero:f}, allZero = {allzero:f}")
+            for k in range(len(bins)):
+                observers = [i for i in group if k < len(abuns[elements[i]])]
+                eqws = CalcEqws(
+                    synspec_interface,
+                    conf,
+                    [cluster[i][0] for i in observers],
+                    bins[k],
+                    widths,
+                )
+                for i, (eqw, alleqw) in zip(observers, eqws):
+                    eqw = None if eqw is None else eqw - zeros[fidelity][i][0]
+                    observations[i].append((abuns[elements[i]][k], eqw, alleqw))
+        # The window of a line group on its own is fitted to the absorption of
+        # the first trial showing any. As the bins of fort.16 start from ALAM0,
+        # the zero check is run again in the new window. The trial is measured
+        # in the new box from its bins if the window shrank, against the zero
+        # of the same bins, otherwise it is run again. The extra abundances run
+        # with it (see Speculate), measured in the old window, are dropped.
+        if adapt:
+            testLine, xeqw = cluster[0]
+            fidelity = coarse[0]
+            k = [o[0] for o in observations[0]].index(trials[0])
+            abun, eqw, _ = observations[0][k]
+            fitted = FitWidths(
+                conf,
+                testLine,
+                xeqw,
+                bins[k],
+                zerobins[fidelity],
+                eqw,
+                widths,
+            )
+            if fitted is not None:
+                adapt = False
+                extend = fitted[1] > widths[1]
+                widths = fitted
+                if not extend:
+                    zero, _ = CalcEqw(
+                        synspec_interface, conf, testLine, zerobins[fidelity], widths
+                    )
+                    eqw, alleqw = CalcEqw(
+                        synspec_interface, conf, testLine, bins[k], widths
+                    )
+                InitParam(synspec_interface, conf, testLine, widths)
+                logger.info(
+                    f" Adaptive window: BROAD = {widths[0]:.2f}, RANGE = {widths[1]:.2f}"
+                )
+                baseline = None
+                yield from RunNull(synspec_interface, conf, elements)
+                zerobins = {fidelity: synspec_interface.EQW}
+                zeros = {
+                    fidelity: CalcEqws(
+                        synspec_interface, conf, [testLine], zerobins[fidelity], widths
+                    )
+                }
+                if extend:
+                    yield from Run(synspec_interface, [(elements[0], abun)])
+                    eqw, alleqw = CalcEqw(
+                        synspec_interface, conf, testLine, widths=widths
+                    )
+                    zero = zeros[fidelity][0][0]
+                eqw = None if eqw is None else eqw - zero
+                observations[0] = [(abun, eqw, alleqw)]
+                history[0] = []
+        # The full fidelity observations of each group are kept for the
+        # uncertainties of the abundances
+        for i in trials:
+            if not coarse[i]:
+                history[i].extend([(abun, eqw) for abun, eqw, _ in observations[i]])
+        for i in list(trials):
+            observations[i].sort(key=lambda o: o[0] == trials[i])
+            try:
+                trial = iterations[i].send(observations[i])
+                if nspares > 0:
+                    spreads[i] = min(
+                        conf.getconf("SPECSPREAD"), abs(math.log10(trial / trials[i]))
+                    )
+                trials[i] = trial
+            except StopIteration as stop:
+                result, abun, observation = stop.value
+                if coarse[i]:
+                    # Starting over with full fidelity, from the seed if the
+                    # coarse runs did not converge
+                    coarse[i] = False
+                    seed = seeds[i] if result is not None else (abun, None)
+                    logger.debug(f" Switching to full fidelity at {seed[0]:e}")
+                    iterations[i] = StartSolver(conf, cluster[i][1], seed)
+                    trials[i] = next(iterations[i])
+                    continue
+                del trials[i]
+                if result is None:
+                    wingpercent = (
+                        (observation[2] - zeros[False][i][1]) / observation[1] - 1
+                    ) * 100
+                    result = {
+                        "result": "success",
+                        "relabun": abun,
+                        "logabun": math.log(abun, 10) + conf.getconf("LOGATREF"),
+                        "wingpercent": wingpercent,
+                    }
+                    if TargetError(cluster[i][0]) is not None:
+                        uncertain.append(i)
+                logger.info(
+                    f"Result: {result['relabun'] if result['result'] == 'success' else result['message']} ({synspec_interface.runs - start[0]} runs)"
+                )
+                result["stats"] = GroupStats(
+                    synspec_interface,
+                    start,
+                    result,
+                    ntrials[i],
+                    ncoarse[i],
+                    conf.getconf("SOLVER"),
+                    seeded[i],
+                    widths,
+                    cluster,
+                )
+                results[i] = result
+    # The uncertainties are found once all the groups are solved, so that the
+    # runs of the cluster are not disturbed, with the other elements of the
+    # cluster at their abundances in its last run.
+    for i in uncertain:
+        lo, hi = yield from ErrorSteps(
+            synspec_interface,
+            conf,
+            cluster,
+            i,
+            history[i],
+            zeros[False][i][0],
+            widths,
+            TargetError(cluster[i][0]),
+            current,
+        )
+        results[i]["relabun_lo"], results[i]["relabun_hi"] = lo, hi
+        results[i]["stats"].update(CountersSince(synspec_interface, start))
+    synspec_interface.coarse = None
+    return results
+
+
+# The cache of SYNSPEC output, if enabled.
+def MakeCache(conf):
+    if not conf.getconf("CACHE"):
+        return None
+    cache = SynspecCache(
+        conf.getconf("CACHEDIR"), int(conf.getconf("CACHESIZE") * 2**20)
+    )
+    logger.debug(f"Caching SYNSPEC output in {cache.cachedir}")
+    return cache
+
+
+__all__ = [
+    "Unit55Overrides",
+    "ReadInput",
+    "SetLineList",
+    "Widths",
+    "InitParam",
+    "TargetError",
+    "GroupInputs",
+    "GroupKey",
+    "CurveKey",
+    "CalcEqws",
+    "CalcEqw",
+    "FitWidths",
+    "Drive",
+    "Run",
+    "RunMany",
+    "CheckSpeculate",
+    "MakeSpares",
+    "Speculate",
+    "RunNull",
+    "PlanBaselines",
+    "RunBaselines",
+    "SnapWindow",
+    "SameGrid",
+    "FindBaseline",
+    "Unblended",
+    "PlanClusters",
+    "SetFidelity",
+    "ErrorSteps",
+    "Counters",
+    "CountersSince",
+    "GroupStats",
+    "SolveCluster",
+    "SolveClusterSteps",
+    "MakeCache",
+]
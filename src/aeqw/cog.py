@@ -0,0 +1,416 @@
+# cog.py
+# -*- coding: utf-8 -*-
+# Database of the curves of growth of line groups, which are inverted by
+# interpolation for any target equivalent width.
+
+import os
+import json
+import tempfile
+import math
+import logging
+from aeqw.warmstart import WarmStart, Seeds
+from aeqw.solvers import CurveOfGrowthAbundance
+from aeqw.cluster import (
+    Widths,
+    InitParam,
+    TargetError,
+    CurveKey,
+    CalcEqws,
+    Run,
+    RunNull,
+    Counters,
+    GroupStats,
+    SolveClusterSteps,
+)
+
+logger = logging.getLogger("aeqw.cog")
+
+
+# Curves of growth of line groups, stored for each model (identified by the
+# hash of its files) under the key of the group (see CurveKey in aeqw.cluster).
+# A curve is the zero of the group, (equivalent width, total equivalent width)
+# at the null abundance, and its points, (abundance, equivalent width above the
+# zero, total equivalent width), sorted by abundance.
+class CurveTables(object):
+    def __init__(self, fn, model):
+        self.fn = fn
+        self.model = model
+        try:
+            with open(fn) as f:
+                self.db = json.load(f)
+            logger.debug("Read curve of growth tables {0:s}".format(fn))
+        except FileNotFoundError:
+            self.db = {}
+        except ValueError:
+            logger.warning("Ignoring corrupt curve of growth tables {0:s}".format(fn))
+            self.db = {}
+        self.curves = self.db.setdefault(model, {})
+
+    # Returns the zero and the points of the curve, or None if it is not known.
+    def get(self, key):
+        curve = self.curves.get(key)
+        if curve is None:
+            return None
+        return tuple(curve["zero"]), [tuple(point) for point in curve["points"]]
+
+    def put(self, key, zero, points):
+        self.curves[key] = {
+            "zero": list(zero),
+            "points": [list(point) for point in sorted(points)],
+        }
+
+    def save(self):
+        logger.debug("Writing curve of growth tables {0:s}".format(self.fn))
+        fd, tmpfn = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.fn)), suffix=".tmp"
+        )
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.db, f)
+        os.replace(tmpfn, self.fn)
+
+
+# Curves of growth are first sampled every COGSTEP dex, and refined down to
+# steps of COGMINSTEP dex.
+COGSTEP = 0.5
+
+
+COGMINSTEP = 0.01
+
+
+# Error (in equivalent width) of the curve of growth interpolated through
+# points, a dictionary of (equivalent width, total equivalent width) by
+# abundance, at the abundance m where it was observed, when m is left out. It is
+# the equivalent width of the abundance found for the width observed, estimated
+# from the slope of the curve between the neighbours of m, or where the widths
+# are not positive the difference from the linear interpolation between them.
+def CurveError(points, m):
+    eqw = points[m][0]
+    others = [(abun, points[abun][0]) for abun in points if abun != m]
+    a = max([abun for abun, _ in others if abun < m])
+    b = min([abun for abun, _ in others if abun > m])
+    eqwa, eqwb = points[a][0], points[b][0]
+    if min(eqw, eqwa, eqwb) <= 0:
+        return abs(eqw - (eqwa + eqwb) / 2)
+    abun = CurveOfGrowthAbundance(others, eqw)
+    if abun is None:
+        return math.inf
+    return abs((eqwb - eqwa) / math.log(b / a) * math.log(abun / m))
+
+
+# Solve a cluster of line groups by interpolating the curves of growth of the
+# groups, taken from tables (see CurveTables). Missing curves are sampled on a grid
+# of COGSPAN dex about the initial abundance, every interval of which is
+# bisected until the curve interpolated without its midpoint is within EPSILON
+# of it there. Curves which do not reach the targets of their groups are
+# extended beyond the abundances sampled. The runs are shared by the groups of
+# the cluster as in SolveClusterSteps. The abundances found are run, which
+# gives the total width for wing%. Groups missing their target there by more
+# than EPSILON are solved by SolveClusterSteps from them with COGVERIFY, and
+# are errors otherwise. Groups with targets which are not positive are solved
+# by SolveClusterSteps. The curves sampled or extended are returned under
+# "curve" in the results, to be stored in tables.
+def CurveOfGrowthSteps(synspec_interface, conf, cluster, baselines, warmstart, tables):
+    results = [None] * len(cluster)
+    table = [i for i, (_, xeqw) in enumerate(cluster) if xeqw > 0]
+    rest = [i for i in range(len(cluster)) if i not in table]
+    if rest:
+        for i, result in zip(
+            rest,
+            (
+                yield from SolveClusterSteps(
+                    synspec_interface,
+                    conf,
+                    [cluster[i] for i in rest],
+                    baselines,
+                    warmstart,
+                )
+            ),
+        ):
+            results[i] = result
+    if not table:
+        return results
+    start = Counters(synspec_interface)
+    groups = [cluster[i] for i in table]
+    for testLine, xeqw in groups:
+        logger.info(
+            "Calculating for following lines with target equivalent width: %f", xeqw
+        )
+        for t in testLine:
+            logger.info(str(t))
+    synspec_interface.coarse = None
+    InitParam(
+        synspec_interface, conf, [line for testLine, _ in groups for line in testLine]
+    )
+    widths = Widths(conf)
+    elements = [testLine[0].Z for testLine, _ in groups]
+    keys = [CurveKey(synspec_interface, conf, testLine) for testLine, _ in groups]
+    curves = [tables.get(key) for key in keys]
+    zeros = [None if curve is None else curve[0] for curve in curves]
+    points = [
+        {} if curve is None else {abun: (eqw, alleqw) for abun, eqw, alleqw in curve[1]}
+        for curve in curves
+    ]
+    # The widths each curve has to reach
+    targets = []
+    for testLine, xeqw in groups:
+        sigma = TargetError(testLine) or 0.0
+        targets.append([t for t in (xeqw - sigma, xeqw, xeqw + sigma) if t > 0])
+
+    # Each round runs the abundances asked for by the groups: new points of
+    # their curves, and the midpoints of the intervals to check. Intervals
+    # between new points are checked once both of them have been run.
+    todo = [[] for _ in groups]
+    spans = [[] for _ in groups]
+    intervals = [[] for _ in groups]
+    changed = [False] * len(groups)
+    extending = [True] * len(groups)
+    ntrials = [0] * len(groups)
+    for k, (testLine, _) in enumerate(groups):
+        if curves[k] is None:
+            center = (
+                round(
+                    2
+                    * math.log10(
+                        synspec_interface.INITABUNZWISE.get(
+                            testLine[0].Z, conf.getconf("INITABUN")
+                        )
+                    )
+                )
+                / 2
+            )
+            n = int(conf.getconf("COGSPAN") / COGSTEP)
+            todo[k] = [
+                10 ** (center + j * COGSTEP)
+                for j in range(-n, n + 1)
+                if center + j * COGSTEP <= 0
+            ]
+            spans[k] = list(zip(todo[k][:-1], todo[k][1:]))
+    # The zero check is always run for new curves, as the zero baselines may be
+    # binned otherwise (see SameGrid), and it is one run of many.
+    if any([zero is None for zero in zeros]):
+        yield from RunNull(synspec_interface, conf, sorted(set(elements)))
+        for k, zero in enumerate(
+            CalcEqws(
+                synspec_interface,
+                conf,
+                [tl for tl, _ in groups],
+                synspec_interface.EQW,
+                widths,
+            )
+        ):
+            if zeros[k] is None:
+                zeros[k] = zero
+                logger.debug(f" > Zero = {zero[0]:f}, allZero = {zero[1]:f}")
+    while True:
+        for k in range(len(groups)):
+            if todo[k] or intervals[k] or not points[k] or not extending[k]:
+                continue
+            # Extending the curve to the widths it has to reach
+            abuns = sorted(points[k])
+            eqws = [points[k][abun][0] for abun in abuns]
+            if targets[k] and max(eqws) < max(targets[k]) and abuns[-1] < 1.0:
+                new = min(abuns[-1] * 10**COGSTEP, 1.0)
+                spans[k] = [(abuns[-1], new)]
+            elif (
+                targets[k]
+                and min([eqw for eqw in eqws if eqw > 0], default=math.inf)
+                > min(targets[k])
+                and abuns[0] > conf.getconf("NULLABUN")
+            ):
+                new = max(abuns[0] / 10**COGSTEP, conf.getconf("NULLABUN"))
+                spans[k] = [(new, abuns[0])]
+            else:
+                continue
+            logger.debug(f" Extending the curve of growth to {new:e}")
+            todo[k] = [new]
+        asked = [
+            todo[k] + [math.sqrt(a * b) for a, b in intervals[k]]
+            for k in range(len(groups))
+        ]
+        if not any(asked):
+            break
+        abuns = {
+            Z: sorted(
+                set(
+                    [
+                        abun
+                        for k in range(len(groups))
+                        if elements[k] == Z
+                        for abun in asked[k]
+                    ]
+                )
+            )
+            for Z in sorted(set(elements))
+        }
+        abuns = {Z: a for Z, a in abuns.items() if a}
+        for j in range(max([len(a) for a in abuns.values()])):
+            run = {Z: a[min(j, len(a) - 1)] for Z, a in abuns.items()}
+            yield from Run(synspec_interface, list(run.items()))
+            observers = [
+                k
+                for k in range(len(groups))
+                if elements[k] in run and run[elements[k]] in asked[k]
+            ]
+            eqws = CalcEqws(
+                synspec_interface,
+                conf,
+                [groups[k][0] for k in observers],
+                widths=widths,
+            )
+            for k, (eqw, alleqw) in zip(observers, eqws):
+                ntrials[k] += 1
+                if eqw is not None:
+                    points[k][run[elements[k]]] = (eqw - zeros[k][0], alleqw)
+                    changed[k] = True
+        for k in range(len(groups)):
+            checked, intervals[k] = intervals[k], []
+            for a, b in checked:
+                m = math.sqrt(a * b)
+                if m not in points[k]:
+                    continue
+                error = CurveError(points[k], m)
+                logger.debug(
+                    f"  Curve of growth at {m:e}: error {error:f} without the point"
+                )
+                if error > conf.getconf("EPSILON") and math.log10(b / a) > COGMINSTEP:
+                    intervals[k].extend([(a, m), (m, b)])
+            intervals[k].extend(
+                [(a, b) for a, b in spans[k] if a in points[k] and b in points[k]]
+            )
+            # A curve is not extended past an abundance without output
+            if any([abun not in points[k] for abun in todo[k]]):
+                extending[k] = False
+            todo[k], spans[k] = [], []
+
+    # Interpolating the curves, and verifying the abundances found
+    found = []
+    for k, (testLine, xeqw) in enumerate(groups):
+        curve = [(abun, points[k][abun][0]) for abun in sorted(points[k])]
+        found.append(CurveOfGrowthAbundance(curve, xeqw))
+        logger.debug(f" Interpolated from {len(curve)} points: {found[-1]}")
+    # The abundances found are run, for the total width of wing% and to check
+    # that they reach the targets.
+    verified = [None] * len(groups)
+    abuns = {
+        Z: sorted(
+            set(
+                [
+                    found[k]
+                    for k in range(len(groups))
+                    if elements[k] == Z and found[k] is not None
+                ]
+            )
+        )
+        for Z in sorted(set(elements))
+    }
+    abuns = {Z: a for Z, a in abuns.items() if a}
+    for j in range(max([len(a) for a in abuns.values()], default=0)):
+        run = {Z: a[min(j, len(a) - 1)] for Z, a in abuns.items()}
+        yield from Run(synspec_interface, list(run.items()))
+        observers = [
+            k
+            for k in range(len(groups))
+            if elements[k] in run and run[elements[k]] == found[k]
+        ]
+        eqws = CalcEqws(
+            synspec_interface,
+            conf,
+            [groups[k][0] for k in observers],
+            widths=widths,
+        )
+        for k, (eqw, alleqw) in zip(observers, eqws):
+            ntrials[k] += 1
+            if eqw is not None:
+                verified[k] = (eqw - zeros[k][0], alleqw)
+                points[k][found[k]] = verified[k]
+                changed[k] = True
+
+    failed = []
+    for k, (testLine, xeqw) in enumerate(groups):
+        abun = found[k]
+        curve = [(a, points[k][a][0]) for a in sorted(points[k])]
+        if abun is None:
+            logger.warning("Target outside the curve of growth")
+            result = {
+                "result": "error",
+                "message": (
+                    "Line Strength Insufficient. Manual Examination suggested."
+                    if not curve or max([eqw for _, eqw in curve]) < xeqw
+                    else "Target below the curve of growth sampled."
+                ),
+            }
+        elif verified[k] is None or abs(verified[k][0] - xeqw) > conf.getconf(
+            "EPSILON"
+        ):
+            logger.warning(
+                f" Verification of {abun:e} gave {None if verified[k] is None else verified[k][0]}"
+                + (", solving the group" if conf.getconf("COGVERIFY") else "")
+            )
+            if conf.getconf("COGVERIFY"):
+                failed.append(k)
+                continue
+            result = {
+                "result": "error",
+                "message": "Curve of growth misses the target. Set COGVERIFY to solve the group.",
+            }
+        else:
+            result = {
+                "result": "success",
+                "relabun": abun,
+                "logabun": math.log(abun, 10) + conf.getconf("LOGATREF"),
+                "wingpercent": ((verified[k][1] - zeros[k][1]) / xeqw - 1) * 100,
+            }
+            sigma = TargetError(testLine)
+            if sigma is not None:
+                result["relabun_lo"] = (
+                    0.0
+                    if xeqw - sigma <= 0
+                    else CurveOfGrowthAbundance(curve, xeqw - sigma)
+                )
+                result["relabun_hi"] = CurveOfGrowthAbundance(curve, xeqw + sigma)
+        logger.info(
+            f"Result: {result['relabun'] if result['result'] == 'success' else result['message']} ({synspec_interface.runs - start[0]} runs)"
+        )
+        result["stats"] = GroupStats(
+            synspec_interface,
+            start,
+            result,
+            ntrials[k],
+            0,
+            "cog",
+            False,
+            widths,
+            cluster,
+        )
+        results[table[k]] = result
+    if failed:
+        seeds = Seeds(WarmStart.linespread)
+        for k in failed:
+            seeds.add(groups[k][0], found[k])
+        for k, result in zip(
+            failed,
+            (
+                yield from SolveClusterSteps(
+                    synspec_interface,
+                    conf,
+                    [groups[k] for k in failed],
+                    baselines,
+                    seeds,
+                )
+            ),
+        ):
+            results[table[k]] = result
+    for k in range(len(groups)):
+        if changed[k]:
+            results[table[k]]["curve"] = {
+                "key": keys[k],
+                "zero": zeros[k],
+                "points": [
+                    (abun, eqw, alleqw)
+                    for abun, (eqw, alleqw) in sorted(points[k].items())
+                ],
+            }
+    return results
+
+
+__all__ = ["CurveTables", "COGSTEP", "COGMINSTEP", "CurveError", "CurveOfGrowthSteps"]
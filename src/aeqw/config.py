@@ -0,0 +1,462 @@
+# config.py
+# -*- coding: utf-8 -*-
+# Command line and configuration file of aeqw.
+
+import logging
+from configparser import ConfigParser, ExtendedInterpolation
+from argparse import ArgumentParser
+from aeqw import __version__
+
+logger = logging.getLogger("aeqw.config")
+
+
+CONFFN = "aeqw.conf"
+
+
+def parse_cmd(argv=None, prog=None):
+    argparser = ArgumentParser(
+        prog=prog,
+        description="Program to automate equivalent width finding using SYNSPEC.",
+    )
+    argparser.add_argument(
+        "model",
+        help="Name of the input model (such as 'hhe35lt'). With several models, or glob patterns such as 'hhe*', the line groups are solved for all of them and written to a combined table.",
+        nargs="*",
+        default=["fort"],
+    )
+    argparser.add_argument("-i", "--infn", help="Custom input filename.")
+    argparser.add_argument("-o", "--outfn", help="Custom output filename.")
+    argparser.add_argument(
+        "-c",
+        action="append",
+        help="Extra configuration options files. Can be repeated.",
+    )
+    argparser.add_argument("-l", "--extralogfn", help="Extra log file.")
+    argparser.add_argument(
+        "--initabun",
+        type=float,
+        help="Assumed initial abundance for elements if not described in 'fort.56'.",
+    )
+    argparser.add_argument(
+        "--nullabun",
+        type=float,
+        help="Abundance of elements used to estimate equivalent width at zero abundance.",
+    )
+    argparser.add_argument(
+        "--logatref", type=float, help="Abundance of reference element."
+    )
+    argparser.add_argument(
+        "--broad",
+        type=float,
+        help="Half width (in Å) upto which absorption is assumed to come from the line. Set it so as to cover the entire line. If set correctly 'wing%%' should be low for isolated lines.",
+    )
+    argparser.add_argument(
+        "--range",
+        type=float,
+        help="Half width (in Å) of the generated synthetic spectrum used for analysis.",
+    )
+    argparser.add_argument(
+        "--epsilon",
+        type=float,
+        help="Accuracy to which the program will try to match the equivalent width.",
+    )
+    argparser.add_argument(
+        "--adaptwindow",
+        action="store_true",
+        help="Fit BROAD and RANGE of every line group on its own to the absorption of its first trial, for the remaining trials.",
+    )
+    argparser.add_argument(
+        "--minbroad",
+        type=float,
+        help="Smallest BROAD (in Å) chosen by --adaptwindow.",
+    )
+    argparser.add_argument(
+        "--maxbroad",
+        type=float,
+        help="Largest BROAD (in Å) chosen by --adaptwindow.",
+    )
+    argparser.add_argument(
+        "--coarse",
+        type=float,
+        help="Iterate with coarse runs of SYNSPEC till the equivalent width is within this multiple of EPSILON, then with the settings of fort.55. 0 disables.",
+    )
+    argparser.add_argument(
+        "--sep19",
+        action="store_true",
+        help="Whether to generate a separate 'fort.19' file for every line group.",
+    )
+    argparser.add_argument(
+        "--linelistfn",
+        help="Line list, in the format of 'fort.19', written to 'fort.19' along with the lines of the input file.",
+    )
+    argparser.add_argument(
+        "--linemargin",
+        type=float,
+        help="Write to 'fort.19' only the lines within this margin (in Å) of the synthetic spectrum of each line group. 0 writes all the lines once.",
+    )
+    argparser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Take the results of line groups from the manifest of a previous run, if their inputs have not changed, and solve only the others.",
+    )
+    argparser.add_argument(
+        "--manifest",
+        help="File in which the result of each line group is recorded as soon as it is solved. Empty to disable.",
+    )
+    argparser.add_argument(
+        "--outfmt",
+        help="Format of the output file, Valid options are txt and json, and ndjson and csv which are written as the line groups are solved.",
+        choices=("txt", "json", "ndjson", "csv"),
+    )
+    argparser.add_argument(
+        "--solver",
+        help="Method used to find the abundance. 'linear' refines a linear approximation with the secant method, 'bracket' brackets the target on the curve of growth and narrows the bracket with inverse quadratic interpolation.",
+        choices=("linear", "bracket"),
+    )
+    argparser.add_argument(
+        "--maxiter",
+        type=int,
+        help="Maximum number of trials of the solver for a line group, after which it is reported as not converged.",
+    )
+    argparser.add_argument(
+        "--clusterwidth",
+        type=float,
+        help="Maximum width (in Å) of a synthetic spectrum shared by line groups of the same element. 0 disables clustering.",
+    )
+    argparser.add_argument(
+        "--joint",
+        action="store_true",
+        help="Also cluster line groups of different elements which are not blended with each other, setting the trial abundance of every element in each run.",
+    )
+    argparser.add_argument(
+        "--baselinewidth",
+        type=float,
+        help="Maximum width (in Å) of the zero baselines shared by the line groups of an element. 0 runs a zero check for every line group.",
+    )
+    argparser.add_argument(
+        "--warmstart",
+        help="File in which converged abundances are stored and from which the first trials are seeded. Empty to disable.",
+    )
+    argparser.add_argument(
+        "--cogtable",
+        help="File of tables of the curves of growth of the line groups, which are sampled once and inverted by interpolation for any target. Empty to disable.",
+    )
+    argparser.add_argument(
+        "--cogspan",
+        type=float,
+        help="Half width (in dex) of the grid of abundances on which a curve of growth is first sampled.",
+    )
+    argparser.add_argument(
+        "--cogverify",
+        dest="cogverify",
+        action="store_true",
+        default=None,
+        help="Solve the line groups whose abundances interpolated from the curves of growth miss their targets.",
+    )
+    argparser.add_argument(
+        "--no-cogverify",
+        dest="cogverify",
+        action="store_false",
+        default=None,
+        help="Report the line groups whose abundances interpolated from the curves of growth miss their targets as errors.",
+    )
+    argparser.add_argument(
+        "--speculate",
+        type=int,
+        help="Number of extra abundances run at once with each trial of the bracket solver, each in its own scratch directory.",
+    )
+    argparser.add_argument(
+        "--specspread",
+        type=float,
+        help="Largest spread (in dex) of the extra abundances of --speculate about the trial.",
+    )
+    argparser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of line groups to solve in parallel, each in its own scratch directory.",
+    )
+    argparser.add_argument(
+        "--gridtempscale",
+        type=float,
+        help="In grid mode, the difference in Teff (in K) which counts as much as 1 dex in logg when finding the nearest model.",
+    )
+    argparser.add_argument(
+        "--gridspread",
+        type=float,
+        help="In grid mode, the expected difference (in dex) between the abundances of neighbouring models.",
+    )
+    argparser.add_argument(
+        "--serve",
+        help="Address (host:port, or the path of a Unix socket) at which the line groups are served to workers, instead of solving them here.",
+    )
+    argparser.add_argument(
+        "--worker",
+        metavar="ADDRESS",
+        help="Run JOBS workers solving the line groups served at ADDRESS, till there are none left.",
+    )
+    argparser.add_argument(
+        "--authkey",
+        help="Key shared by the coordinator and its workers.",
+    )
+    argparser.add_argument(
+        "--retries",
+        type=int,
+        help="Number of times a line group is given to another worker if its worker fails or disconnects.",
+    )
+    argparser.add_argument(
+        "--metrics",
+        help="Write statistics of every line group (trials, runs, time spent in each phase) to METRICS.json and METRICS.prom. Empty to disable.",
+    )
+    argparser.add_argument(
+        "--batch",
+        nargs="+",
+        metavar="INFN",
+        help="Solve the line groups of several input files in one run, writing the output of each to a file named after it with the extension of OUTFN. Line groups with the same inputs are only solved once.",
+    )
+    argparser.add_argument(
+        "--profile",
+        nargs="?",
+        const="aeqw.prof",
+        help="Run under cProfile and write the profile to PROFILE (by default aeqw.prof).",
+    )
+    argparser.add_argument(
+        "--runner",
+        help="How SYNSPEC is run. 'rsynspec' runs the RSynspec script with the name of the model, 'direct' runs the SYNSPEC executable itself.",
+        choices=("rsynspec", "direct"),
+    )
+    argparser.add_argument(
+        "--synspec",
+        help="Script or executable run by the runner, instead of RSynspec or synspec.",
+    )
+    argparser.add_argument(
+        "--runlog",
+        type=int,
+        help="Number of lines of the output of SYNSPEC kept to be logged if it fails. 0 discards the output.",
+    )
+    argparser.add_argument(
+        "--cache-dir",
+        dest="cachedir",
+        help="Directory in which the output of SYNSPEC runs is cached.",
+    )
+    argparser.add_argument(
+        "--cache-size",
+        dest="cachesize",
+        type=float,
+        help="Maximum size of the cache (in MB). Least recently used entries are removed beyond this.",
+    )
+    argparser.add_argument(
+        "--cache",
+        dest="cache",
+        action="store_true",
+        default=None,
+        help="Cache the output of SYNSPEC runs in CACHEDIR and use it instead of running SYNSPEC again.",
+    )
+    argparser.add_argument(
+        "--no-cache",
+        dest="cache",
+        action="store_false",
+        default=None,
+        help="Always run SYNSPEC instead of using cached outputs.",
+    )
+    argparser.add_argument(
+        "-V", "--version", action="version", version=f"%(prog)s {__version__}"
+    )
+    args = argparser.parse_args(argv)
+    return args
+
+
+argconf = (
+    "infn",
+    "outfn",
+    "extralogfn",
+    "initabun",
+    "nullabun",
+    "logatref",
+    "broad",
+    "range",
+    "epsilon",
+    "minbroad",
+    "maxbroad",
+    "coarse",
+    "linelistfn",
+    "linemargin",
+    "manifest",
+    "outfmt",
+    "solver",
+    "maxiter",
+    "clusterwidth",
+    "baselinewidth",
+    "warmstart",
+    "cogtable",
+    "cogspan",
+    "cogverify",
+    "speculate",
+    "specspread",
+    "jobs",
+    "gridtempscale",
+    "gridspread",
+    "serve",
+    "authkey",
+    "retries",
+    "metrics",
+    "runner",
+    "synspec",
+    "runlog",
+    "cachedir",
+    "cachesize",
+    "cache",
+)
+
+
+argconfbool = ("adaptwindow", "sep19", "resume", "joint")
+
+
+class Config(ConfigParser):
+    confgetter = {
+        "str": "get",
+        "float": "getfloat",
+        "int": "getint",
+        "bool": "getboolean",
+    }
+
+    def __init__(self, defaultconf=None):
+        super().__init__(interpolation=ExtendedInterpolation())
+        self["DEFAULT"] = {
+            "INFN": "aeqw.in",
+            "OUTFN": "aeqw.out",
+            "EXTRALOGFN": "",
+            "INITABUN": 1e-4,
+            "NULLABUN": 1e-10,
+            "LOGATREF": 11.54,
+            "BROAD": 2.0,
+            "RANGE": 5.0,
+            "EPSILON": 0.1,
+            "ADAPTWINDOW": False,
+            "MINBROAD": 0.5,
+            "MAXBROAD": 10.0,
+            "COARSE": 0.0,
+            "COARSESPACE": 5.0,
+            "COARSERELOP": 100.0,
+            "COARSECUTOF0": 0.5,
+            "SEP19": False,
+            "LINELISTFN": "",
+            "LINEMARGIN": 0.0,
+            "MANIFEST": "",
+            "RESUME": False,
+            "OUTFMT": "txt",
+            "SOLVER": "linear",
+            "MAXITER": 50,
+            "CLUSTERWIDTH": 0.0,
+            "JOINT": False,
+            "BASELINEWIDTH": 0.0,
+            "WARMSTART": "",
+            "COGTABLE": "",
+            "COGSPAN": 2.0,
+            "COGVERIFY": True,
+            "SPECULATE": 0,
+            "SPECSPREAD": 0.2,
+            "JOBS": 1,
+            "GRIDTEMPSCALE": 1000.0,
+            "GRIDSPREAD": 0.2,
+            "SERVE": "",
+            "AUTHKEY": "",
+            "RETRIES": 2,
+            "METRICS": "",
+            "RUNNER": "rsynspec",
+            "SYNSPEC": "",
+            "RUNLOG": 0,
+            "CACHE": False,
+            "CACHEDIR": "~/.cache/aeqw",
+            "CACHESIZE": 512.0,
+        }
+        self["TYPES"] = {
+            "INFN": "str",
+            "OUTFN": "str",
+            "EXTRALOGFN": "str",
+            "INITABUN": "float",
+            "NULLABUN": "float",
+            "LOGATREF": "float",
+            "BROAD": "float",
+            "RANGE": "float",
+            "EPSILON": "float",
+            "ADAPTWINDOW": "bool",
+            "MINBROAD": "float",
+            "MAXBROAD": "float",
+            "COARSE": "float",
+            "COARSESPACE": "float",
+            "COARSERELOP": "float",
+            "COARSECUTOF0": "float",
+            "SEP19": "bool",
+            "LINELISTFN": "str",
+            "LINEMARGIN": "float",
+            "MANIFEST": "str",
+            "RESUME": "bool",
+            "OUTFMT": "str",
+            "SOLVER": "str",
+            "MAXITER": "int",
+            "CLUSTERWIDTH": "float",
+            "JOINT": "bool",
+            "BASELINEWIDTH": "float",
+            "WARMSTART": "str",
+            "COGTABLE": "str",
+            "COGSPAN": "float",
+            "COGVERIFY": "bool",
+            "SPECULATE": "int",
+            "SPECSPREAD": "float",
+            "JOBS": "int",
+            "GRIDTEMPSCALE": "float",
+            "GRIDSPREAD": "float",
+            "SERVE": "str",
+            "AUTHKEY": "str",
+            "RETRIES": "int",
+            "METRICS": "str",
+            "RUNNER": "str",
+            "SYNSPEC": "str",
+            "RUNLOG": "int",
+            "CACHE": "bool",
+            "CACHEDIR": "str",
+            "CACHESIZE": "float",
+        }
+        self["aeqw"] = {}
+        self.sec = "aeqw"
+        if defaultconf is not None:
+            self.readconf(defaultconf)
+
+    def readconf(self, conffn, warnifnotfound=False):
+        if self.read(conffn) == []:
+            if warnifnotfound:
+                logger.warn(f" Configuration file {conffn} not found.")
+            else:
+                logger.info(f" Configuration information can be added to file {conffn}")
+            return
+        logger.info(f" Reading Configuration file: {conffn}")
+
+    def addconfs(self, confs):
+        if confs is not None:
+            for c in confs:
+                self.readconf(c, True)
+
+    def getconf(self, param, sec=None):
+        if sec is None:
+            sec = self.sec
+        if param in self[sec]:
+            try:
+                return getattr(self[sec], self.confgetter[self["TYPES"][param]])(param)
+            except ValueError:
+                logger.error(f"Invalid type for parameter {param} in configuration")
+                raise
+        else:
+            logger.error(f"Parameter {param} not found")
+            raise ValueError
+
+    def add_args(self, args, argconf, argconfbool):
+        for c in argconf:
+            if getattr(args, c) is not None:
+                self["aeqw"][c.upper()] = str(getattr(args, c))
+        for c in argconfbool:
+            if getattr(args, c) == True:
+                self["aeqw"][c.upper()] = "True"
+
+
+__all__ = ["CONFFN", "parse_cmd", "argconf", "argconfbool", "Config"]
@@ -0,0 +1,356 @@
+# daemon.py
+# -*- coding: utf-8 -*-
+# Long lived process solving the inputs of aeqw sent by aeqw.client over a Unix
+# socket. Parsed line lists, the hashes of the models and the output of recent
+# runs of SYNSPEC are kept in memory between requests, which are solved
+# concurrently, each in its own scratch directories.
+
+import os
+import io
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import logging
+import contextlib
+import contextvars
+from argparse import ArgumentParser
+from aeqw.client import socketpath
+from aeqw.cache import SynspecCache, MemoryCache
+from aeqw.isynspec import ISynspec, aeqwISError
+from aeqw.linelist import LineIndex
+from aeqw.manifest import Manifest
+from aeqw.metrics import Metrics
+from aeqw.writers import streamwriter
+from aeqw.aio import solve_groups
+from aeqw.config import (
+    CONFFN,
+    Config,
+    parse_cmd as aeqw_parse_cmd,
+    argconf,
+    argconfbool,
+)
+from aeqw.cluster import ReadInput, Unit55Overrides, GroupKey
+from aeqw.grid import ExpandModels
+from aeqw.output import OutputHeader, OutputData, outputformatter
+
+logger = logging.getLogger("aeqw.daemon")
+
+# Parameters which are paths, taken relative to the working directory of the
+# client.
+PATHS = (
+    "INFN",
+    "OUTFN",
+    "EXTRALOGFN",
+    "LINELISTFN",
+    "MANIFEST",
+    "WARMSTART",
+    "COGTABLE",
+    "METRICS",
+    "CACHEDIR",
+)
+
+# The request solved by the current task, to which its log records are sent.
+_request = contextvars.ContextVar("request", default=None)
+
+
+# A request of a client, and the extra log of its configuration, if any.
+class Request(object):
+    def __init__(self, writer):
+        self.writer = writer
+        self.extralog = None
+
+    def send(self, message):
+        self.writer.write(json.dumps(message).encode() + b"\n")
+
+
+# Handler sending the log records of a request to its client, those of level
+# INFO and above formatted as on the console of aeqw, and all of them to its
+# extra log. Records logged outside requests are left to the other handlers.
+class RequestHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.setFormatter(logging.Formatter("%(levelname)-8s: %(message)s"))
+
+    def emit(self, record):
+        request = _request.get()
+        if request is None:
+            return
+        if record.levelno >= logging.INFO:
+            request.send({"log": self.format(record)})
+        if request.extralog is not None:
+            request.extralog.handle(record)
+
+
+# The configuration of a request, read as by aeqw in the working directory of
+# the client, with the paths taken relative to it.
+def RequestConfig(args, cwd):
+    conf = Config(os.path.join(cwd, CONFFN))
+    conf.add_args(args, argconf, argconfbool)
+    for param in PATHS:
+        if conf.getconf(param) != "":
+            conf["aeqw"][param] = os.path.join(
+                cwd, os.path.expanduser(conf.getconf(param))
+            )
+    if os.sep in conf.getconf("SYNSPEC"):
+        conf["aeqw"]["SYNSPEC"] = os.path.join(cwd, conf.getconf("SYNSPEC"))
+    return conf
+
+
+# Solve the input of a client as aeqw would with the arguments args in the
+# directory cwd, except that SYNSPEC is run in scratch directories (see
+# aeqw.aio.solve_groups). Only a single model is solved, locally. caches has
+# the caches of SYNSPEC output in memory, under their directory and size.
+async def solve(args, cwd, caches, memsize):
+    start = time.perf_counter()
+    if args.worker is not None or args.profile is not None or args.batch is not None:
+        logger.error("--worker, --profile and --batch are not supported by the daemon")
+        raise ValueError
+    conf = RequestConfig(args, cwd)
+    if conf.getconf("EXTRALOGFN") != "":
+        extralog = logging.FileHandler(conf.getconf("EXTRALOGFN"))
+        extralog.setFormatter(
+            logging.Formatter("%(asctime)s - %(name)-15s %(levelname)-8s: %(message)s")
+        )
+        _request.get().extralog = extralog
+    models = [
+        os.path.relpath(model, cwd)
+        for model in ExpandModels([os.path.join(cwd, model) for model in args.model])
+    ]
+    if len(models) != 1 or conf.getconf("SERVE") != "":
+        logger.error("Grids of models and SERVE are not supported by the daemon")
+        raise ValueError
+    model = models[0]
+    logger.info(f"Model: {model}")
+
+    synspec_interface = ISynspec(model, cwd)
+    overrides = Unit55Overrides(synspec_interface, conf)
+    for param, value in overrides.items():
+        setattr(synspec_interface, param, value)
+    allLines, testLines = await asyncio.get_event_loop().run_in_executor(
+        None, contextvars.copy_context().run, ReadInput, conf
+    )
+    synspec_interface.lineindex = LineIndex(allLines)
+    groups = [tl for tl in testLines if type(tl) != str]
+    solved = [None] * len(groups)
+    manifest = None
+    if conf.getconf("MANIFEST") != "":
+        manifest = Manifest(conf.getconf("MANIFEST"), conf.getconf("RESUME"))
+        keys = [GroupKey(synspec_interface, conf, group) for group in groups]
+        solved = [manifest.get(key) for key in keys]
+        if conf.getconf("RESUME"):
+            logger.info(
+                f"Resuming: {len(groups) - solved.count(None)} of {len(groups)} line groups already solved"
+            )
+    stream = None
+    if conf.getconf("OUTFMT") in streamwriter:
+        stream = streamwriter[conf.getconf("OUTFMT")](
+            conf.getconf("OUTFN"),
+            OutputHeader(conf, model, synspec_interface),
+            testLines,
+        )
+        positions = [k for k, tl in enumerate(testLines) if type(tl) != str]
+        for i, result in enumerate(solved):
+            if result is not None:
+                stream.write(positions[i], result)
+    metrics = None
+    if conf.getconf("METRICS") != "":
+        metrics = Metrics()
+
+    cache = None
+    if conf.getconf("CACHE"):
+        cachekey = (conf.getconf("CACHEDIR"), conf.getconf("CACHESIZE"))
+        if cachekey not in caches:
+            caches[cachekey] = MemoryCache(
+                SynspecCache(cachekey[0], int(cachekey[1] * 2**20)), memsize
+            )
+        cache = caches[cachekey]
+    options = {param: conf["aeqw"][param] for param in conf["aeqw"]}
+    options["unit55"] = overrides
+    pending = [i for i, result in enumerate(solved) if result is None]
+    async for n, result in solve_groups(
+        model,
+        [groups[i] for i in pending],
+        options,
+        linelist=allLines,
+        srcdir=cwd,
+        cache=cache,
+    ):
+        i = pending[n]
+        stats = result.pop("stats", None)
+        if metrics is not None and stats is not None:
+            metrics.add(*groups[i], stats)
+        solved[i] = result
+        if manifest is not None:
+            manifest.add(keys[i], result)
+        if stream is not None:
+            stream.write(positions[i], result)
+    if manifest is not None:
+        manifest.close()
+    if metrics is not None:
+        metrics.save(conf.getconf("METRICS"))
+
+    if stream is not None:
+        stream.close()
+    else:
+        solved = iter(solved)
+        finAbun = [
+            {"result": "comment"} if type(tl) == str else next(solved)
+            for tl in testLines
+        ]
+        outputformatter[conf.getconf("OUTFMT")](
+            OutputData(
+                OutputHeader(conf, model, synspec_interface), testLines, finAbun
+            ),
+            conf.getconf("OUTFN"),
+        )
+    logger.info(f"Runtime: {time.perf_counter() - start:.3f}")
+
+
+# Run a request with the command line argv of aeqw in the directory cwd.
+# Returns the exit status.
+async def run(argv, cwd, caches, memsize):
+    request = _request.get()
+    # The usage and errors of the command line are sent to the client
+    usage = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(usage), contextlib.redirect_stderr(usage):
+            args = aeqw_parse_cmd(argv, "aeqw")
+    except SystemExit as exit:
+        request.send({"log": usage.getvalue().rstrip("\n")})
+        return exit.code
+    try:
+        await solve(args, cwd, caches, memsize)
+    except Exception as err:
+        logger.debug("Request failed", exc_info=True)
+        # Errors of aeqw are logged when raised
+        if not isinstance(err, aeqwISError) and str(err) != "":
+            logger.error(f"{type(err).__name__}: {err}")
+        return 1
+    finally:
+        if request.extralog is not None:
+            request.extralog.close()
+    return 0
+
+
+# Serve a client: read its request, solve it while sending it the log, and
+# send the exit status. The request is cancelled if the client goes away.
+async def handle(reader, writer, caches, memsize):
+    request = Request(writer)
+    row = await reader.readline()
+    try:
+        message = json.loads(row)
+        argv, cwd = list(message["argv"]), message["cwd"]
+    except (ValueError, KeyError, TypeError):
+        # Nothing is sent when checking whether the daemon is listening
+        if row != b"":
+            logger.warning("Ignoring a malformed request")
+        writer.close()
+        return
+    logger.info(f"Request in {cwd}: {' '.join(argv)}")
+    token = _request.set(request)
+    task = asyncio.ensure_future(run(argv, cwd, caches, memsize))
+    _request.reset(token)
+    gone = asyncio.ensure_future(reader.read())
+    await asyncio.wait([task, gone], return_when=asyncio.FIRST_COMPLETED)
+    if not task.done():
+        logger.info(f"Client in {cwd} went away, cancelling its request")
+        task.cancel()
+    gone.cancel()
+    try:
+        status = await task
+    except asyncio.CancelledError:
+        status = 1
+    try:
+        request.send({"exit": status})
+        await writer.drain()
+        writer.close()
+    except ConnectionError:
+        pass
+
+
+# Listen at the Unix socket path till SIGINT or SIGTERM, keeping at most
+# memsize runs of SYNSPEC in memory for each cache directory.
+async def serve(path, memsize):
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.remove(path)  # Left by a daemon which did not stop cleanly
+        else:
+            logger.error(f"A daemon is already listening at {path}")
+            raise ValueError
+        finally:
+            probe.close()
+    caches = {}
+    umask = os.umask(0o177)  # Only the user can connect
+    try:
+        server = await asyncio.start_unix_server(
+            lambda reader, writer: handle(reader, writer, caches, memsize), path
+        )
+    finally:
+        os.umask(umask)
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_event_loop().add_signal_handler(signum, stop.set)
+    logger.info(f"Listening at {path}")
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        os.remove(path)
+        logger.info("Stopped")
+
+
+def parse_cmd(argv=None):
+    argparser = ArgumentParser(
+        description="Daemon solving the inputs of aeqw sent with aeqw-client, keeping parsed line lists, models and recent SYNSPEC output in memory."
+    )
+    argparser.add_argument(
+        "-s",
+        "--socket",
+        default=socketpath(),
+        help="Unix socket to listen at. By default AEQW_SOCKET, or ~/.aeqw.sock.",
+    )
+    argparser.add_argument(
+        "--memcache",
+        type=int,
+        default=4096,
+        help="Number of recent SYNSPEC runs kept in memory for each cache directory.",
+    )
+    argparser.add_argument("-l", "--logfn", help="Log file of the daemon.")
+    return argparser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_cmd(argv)
+    root = logging.getLogger("aeqw")
+    root.setLevel(logging.DEBUG)
+    root.addHandler(RequestHandler())
+    # The log of the daemon itself, apart from that of the requests
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    console.addFilter(lambda record: _request.get() is None)
+    console.setFormatter(logging.Formatter("%(levelname)-8s: %(message)s"))
+    root.addHandler(console)
+    if args.logfn is not None:
+        filelog = logging.FileHandler(args.logfn)
+        filelog.setLevel(logging.DEBUG)
+        filelog.setFormatter(
+            logging.Formatter("%(asctime)s - %(name)-15s %(levelname)-8s: %(message)s")
+        )
+        root.addHandler(filelog)
+    try:
+        asyncio.run(serve(args.socket, args.memcache))
+    except ValueError:
+        sys.exit(1)
+
+
+__all__ = ["RequestConfig", "solve", "serve", "main"]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+# drivers.py
+# -*- coding: utf-8 -*-
+# Solving the inputs of aeqw for one model, alone or in batches.
+
+import os
+import logging
+from aeqw.isynspec import ISynspec
+from aeqw.linelist import LineStore
+from aeqw.cache import SynspecCache
+from aeqw.runner import makerunner
+from aeqw.manifest import Manifest
+from aeqw.metrics import Metrics
+from aeqw.warmstart import WarmStart, Seeds
+from aeqw.cog import CurveTables
+from aeqw.solvers import CurveOfGrowthAbundance
+from aeqw.cluster import (
+    Unit55Overrides,
+    ReadInput,
+    SetLineList,
+    GroupKey,
+    CurveKey,
+    Drive,
+    CheckSpeculate,
+    PlanBaselines,
+    RunBaselines,
+    PlanClusters,
+    MakeCache,
+)
+from aeqw.parallel import SolveClusters
+from aeqw.output import OutputHeader, OutputData
+
+logger = logging.getLogger("aeqw.drivers")
+
+
+# Solve the line groups of the input for model, and write the output with
+# outputformatter, or as the groups are solved with writer (a StreamWriter
+# class) if it is given. Returns the number of runs of SYNSPEC and how many of
+# them were cached.
+def aeqw(conf, model, outputformatter, writer=None):
+    CheckSpeculate(conf)
+    cache = MakeCache(conf)
+    runner = makerunner(
+        conf.getconf("RUNNER"), conf.getconf("SYNSPEC"), conf.getconf("RUNLOG")
+    )
+    with ISynspec(model, cache=cache, runner=runner) as synspec_interface:
+
+        overrides = Unit55Overrides(synspec_interface, conf)
+        for param, value in overrides.items():
+            setattr(synspec_interface, param, value)
+
+        allLines, testLines = ReadInput(conf)
+
+        SetLineList(synspec_interface, conf, allLines)
+
+        # Iterating over all testLines
+        logger.debug("Estimating abundance for all lines.")
+        groups = [tl for tl in testLines if type(tl) != str]
+        solved = [None] * len(groups)
+        manifest = None
+        if conf.getconf("MANIFEST") != "":
+            manifest = Manifest(conf.getconf("MANIFEST"), conf.getconf("RESUME"))
+            keys = [GroupKey(synspec_interface, conf, group) for group in groups]
+            solved = [manifest.get(key) for key in keys]
+            if conf.getconf("RESUME"):
+                logger.info(
+                    f"Resuming: {len(groups) - solved.count(None)} of {len(groups)} line groups already solved"
+                )
+        elif conf.getconf("RESUME"):
+            logger.warning("RESUME is not used without MANIFEST")
+        stream = None
+        if writer is not None:
+            stream = writer(
+                conf.getconf("OUTFN"),
+                OutputHeader(conf, model, synspec_interface),
+                testLines,
+            )
+            positions = [k for k, tl in enumerate(testLines) if type(tl) != str]
+            for i, result in enumerate(solved):
+                if result is not None:
+                    stream.write(positions[i], result)
+        pending = [i for i, result in enumerate(solved) if result is None]
+        clusters = [
+            [pending[j] for j in cluster]
+            for cluster in PlanClusters(conf, [groups[i] for i in pending], allLines)
+        ]
+
+        metrics = None
+        if conf.getconf("METRICS") != "":
+            metrics = Metrics()
+
+        # The results of each cluster are recorded as soon as it is solved
+        def done(n, results):
+            for i, result in zip(clusters[n], results):
+                stats = result.pop("stats", None)
+                if metrics is not None and stats is not None:
+                    metrics.add(*groups[i], stats)
+                curve = result.pop("curve", None)
+                if tables is not None and curve is not None:
+                    tables.put(**curve)
+                transient = result.pop("transient", False)
+                solved[i] = result
+                if manifest is not None and not transient:
+                    manifest.add(keys[i], result)
+                if stream is not None:
+                    stream.write(positions[i], result)
+
+        baselines = {}
+        if conf.getconf("BASELINEWIDTH") > 0:
+            baselines = Drive(
+                synspec_interface,
+                RunBaselines(
+                    synspec_interface,
+                    conf,
+                    PlanBaselines(
+                        conf, [[groups[i] for i in cluster] for cluster in clusters]
+                    ),
+                ),
+            )
+        warmstart = None
+        if conf.getconf("WARMSTART") != "":
+            warmstart = WarmStart(
+                conf.getconf("WARMSTART"), synspec_interface.modelhash()
+            )
+        tables = None
+        if conf.getconf("COGTABLE") != "":
+            tables = CurveTables(
+                conf.getconf("COGTABLE"), synspec_interface.modelhash()
+            )
+        runs, cached = SolveClusters(
+            synspec_interface,
+            conf,
+            model,
+            overrides,
+            allLines,
+            [[groups[i] for i in cluster] for cluster in clusters],
+            cache,
+            runner,
+            baselines,
+            warmstart,
+            tables,
+            done,
+        )
+        runs += synspec_interface.runs
+        cached += synspec_interface.cached
+        if manifest is not None:
+            manifest.close()
+        if metrics is not None:
+            metrics.save(conf.getconf("METRICS"))
+        if warmstart is not None:
+            for group, result in zip(groups, solved):
+                if result["result"] == "success":
+                    warmstart.add(group[0], result["relabun"])
+            warmstart.save()
+        if tables is not None:
+            tables.save()
+        solved = iter(solved)
+        finAbun = [
+            {"result": "comment"} if type(tl) == str else next(solved)
+            for tl in testLines
+        ]
+
+        if stream is not None:
+            stream.close()
+            logger.info("Total runs: %d (%d cached)", runs, cached)
+            return runs, cached
+
+        # Writing the output
+        logger.debug("Writing Output")
+        outputformatter(
+            OutputData(
+                OutputHeader(conf, model, synspec_interface), testLines, finAbun
+            ),
+            conf.getconf("OUTFN"),
+        )
+        logger.info("Total runs: %d (%d cached)", runs, cached)
+        return runs, cached
+
+
+# Output file of the input infn in batch mode: infn with the extension of
+# OUTFN in place of its own, or appended if it has the same one.
+def BatchOutput(conf, infn):
+    ext = os.path.splitext(conf.getconf("OUTFN"))[1] or ".out"
+    root, inext = os.path.splitext(infn)
+    return (infn if inext == ext else root) + ext
+
+
+# Batch mode: the line groups of several inputs are solved for model in one
+# run, and the output of each input is written to its own file (see
+# BatchOutput), with outputformatter or writer as by aeqw. Inputs with the same
+# line list are solved together, and groups with the same key in the manifest
+# only once, whichever inputs they are in. Groups with the same curve of growth
+# (see CurveKey) but different targets are solved in rounds, each group seeded
+# from the abundances found for the others in earlier rounds, interpolated (or
+# extrapolated) along the curve of growth to its target. Returns the number of
+# runs of SYNSPEC and how many of them were cached.
+def aeqwbatch(conf, model, infns, outputformatter, writer=None):
+    if conf.getconf("SERVE") != "":
+        logger.error("SERVE is not used in batch mode")
+        raise ValueError
+    CheckSpeculate(conf)
+    cache = MakeCache(conf)
+    runner = makerunner(
+        conf.getconf("RUNNER"), conf.getconf("SYNSPEC"), conf.getconf("RUNLOG")
+    )
+    with ISynspec(model, cache=cache, runner=runner) as synspec_interface:
+
+        overrides = Unit55Overrides(synspec_interface, conf)
+        for param, value in overrides.items():
+            setattr(synspec_interface, param, value)
+
+        infn = conf.getconf("INFN")
+        inputs = []
+        for fn in infns:
+            conf["aeqw"]["INFN"] = fn
+            inputs.append(ReadInput(conf))
+        conf["aeqw"]["INFN"] = infn
+        # Inputs by line list
+        linelists = {}
+        for n, (allLines, _) in enumerate(inputs):
+            store = (
+                allLines
+                if isinstance(allLines, LineStore)
+                else LineStore.fromlines(allLines)
+            )
+            linelists.setdefault(SynspecCache.key(store.array.tobytes()), []).append(n)
+
+        manifest = None
+        if conf.getconf("MANIFEST") != "":
+            manifest = Manifest(conf.getconf("MANIFEST"), conf.getconf("RESUME"))
+        metrics = None
+        if conf.getconf("METRICS") != "":
+            metrics = Metrics()
+        warmstart = None
+        if conf.getconf("WARMSTART") != "":
+            warmstart = WarmStart(
+                conf.getconf("WARMSTART"), synspec_interface.modelhash()
+            )
+        tables = None
+        if conf.getconf("COGTABLE") != "":
+            tables = CurveTables(
+                conf.getconf("COGTABLE"), synspec_interface.modelhash()
+            )
+
+        solved = {}  # Results by key
+        keys = [[] for _ in inputs]
+        nsolves = runs = cached = 0
+        for members in linelists.values():
+            allLines = inputs[members[0]][0]
+            SetLineList(synspec_interface, conf, allLines)
+            # The groups to solve, by curve of growth
+            curves = {}
+            for n in members:
+                for group in inputs[n][1]:
+                    if type(group) == str:
+                        continue
+                    key = GroupKey(synspec_interface, conf, group)
+                    keys[n].append(key)
+                    if key in solved:
+                        continue
+                    solved[key] = None if manifest is None else manifest.get(key)
+                    if solved[key] is None:
+                        curves.setdefault(
+                            CurveKey(synspec_interface, conf, group[0]), []
+                        ).append((key, group))
+            for r in range(max([len(curve) for curve in curves.values()], default=0)):
+                batch = [curve[r] for curve in curves.values() if r < len(curve)]
+                groups = [group for _, group in batch]
+                nsolves += len(groups)
+                seeds = warmstart
+                if r > 0:
+                    seeds = Seeds(WarmStart.linespread)
+                    for curve in curves.values():
+                        if r >= len(curve):
+                            continue
+                        seed = CurveOfGrowthAbundance(
+                            [
+                                (solved[key]["relabun"], xeqw)
+                                for key, (_, xeqw) in curve[:r]
+                                if solved[key]["result"] == "success"
+                            ],
+                            curve[r][1][1],
+                            True,
+                        )
+                        if seed is not None:
+                            seeds.add(curve[r][1][0], seed)
+                clusters = PlanClusters(conf, groups, allLines)
+                logger.info(
+                    f"Round {r + 1:d}: solving {len(groups)} line groups in {len(clusters)} clusters"
+                )
+
+                def done(n, results):
+                    for i, result in zip(clusters[n], results):
+                        stats = result.pop("stats", None)
+                        if metrics is not None and stats is not None:
+                            metrics.add(*groups[i], stats)
+                        curve = result.pop("curve", None)
+                        if tables is not None and curve is not None:
+                            tables.put(**curve)
+                        transient = result.pop("transient", False)
+                        solved[batch[i][0]] = result
+                        if manifest is not None and not transient:
+                            manifest.add(batch[i][0], result)
+
+                baselines = {}
+                if conf.getconf("BASELINEWIDTH") > 0:
+                    baselines = Drive(
+                        synspec_interface,
+                        RunBaselines(
+                            synspec_interface,
+                            conf,
+                            PlanBaselines(
+                                conf,
+                                [[groups[i] for i in cluster] for cluster in clusters],
+                            ),
+                        ),
+                    )
+                solve = SolveClusters(
+                    synspec_interface,
+                    conf,
+                    model,
+                    overrides,
+                    allLines,
+                    [[groups[i] for i in cluster] for cluster in clusters],
+                    cache,
+                    runner,
+                    baselines,
+                    seeds,
+                    tables,
+                    done,
+                )
+                runs += solve[0]
+                cached += solve[1]
+        runs += synspec_interface.runs
+        cached += synspec_interface.cached
+        logger.info(
+            f"Batch of {len(infns):d} inputs with {len(linelists):d} line lists: {sum([len(k) for k in keys]):d} line groups, {nsolves:d} solved"
+        )
+        if manifest is not None:
+            manifest.close()
+        if metrics is not None:
+            metrics.save(conf.getconf("METRICS"))
+        if warmstart is not None:
+            for n in range(len(inputs)):
+                for group, key in zip(
+                    [tl for tl in inputs[n][1] if type(tl) != str], keys[n]
+                ):
+                    if solved[key]["result"] == "success":
+                        warmstart.add(group[0], solved[key]["relabun"])
+            warmstart.save()
+        if tables is not None:
+            tables.save()
+
+        # Writing the outputs
+        header = OutputHeader(conf, model, synspec_interface)
+        for fn, (_, testLines), groupkeys in zip(infns, inputs, keys):
+            groupkeys = iter(groupkeys)
+            finAbun = [
+                {"result": "comment"} if type(tl) == str else solved[next(groupkeys)]
+                for tl in testLines
+            ]
+            outfn = BatchOutput(conf, fn)
+            logger.debug(f"Writing output of {fn} to {outfn}")
+            if writer is not None:
+                stream = writer(outfn, header, testLines)
+                for k, tl in enumerate(testLines):
+                    if type(tl) != str:
+                        stream.write(k, finAbun[k])
+                stream.close()
+            else:
+                outputformatter(OutputData(header, testLines, finAbun), outfn)
+        logger.info("Total runs: %d (%d cached)", runs, cached)
+        return runs, cached
+
+
+__all__ = ["aeqw", "BatchOutput", "aeqwbatch"]
@@ -0,0 +1,93 @@
+# eqw.py
+# -*- coding: utf-8 -*-
+# Equivalent widths from the bins of fort.16.
+
+import io
+import numpy as np
+
+# The bins are stored as an array with a row (lower bound, upper bound,
+# equivalent width) for each bin, in increasing order of wavelength.
+LO, HI, EQW = 0, 1, 2
+
+
+# Read the bins from fort.16, taking the first three columns of every row.
+# Numbers in Fortran notation (1.0D-03, or 1.0-03 without the exponent letter)
+# are converted as SYNSPEC may write them.
+def readbins(fn):
+    with open(fn) as f:
+        text = f.read()
+    if not text.strip():
+        return np.empty((0, 3))
+    try:
+        return np.loadtxt(io.StringIO(text), usecols=(0, 1, 2), ndmin=2)
+    except ValueError:
+        return np.array(
+            [
+                [fortranfloat(t) for t in row.split()[:3]]
+                for row in text.splitlines()
+                if row.strip()
+            ]
+        )
+
+
+def fortranfloat(token):
+    token = token.upper().replace("D", "E")
+    try:
+        return float(token)
+    except ValueError:
+        k = max(token.rfind("-"), token.rfind("+"))
+        if k <= 0 or "E" in token:
+            raise
+        return float(token[:k] + "E" + token[k:])
+
+
+# Equivalent width absorbed within each of the boxes (an array of (lower bound,
+# upper bound) rows). A bin partially inside a box contributes the square root
+# of the fraction of the bin inside it. Bins fully inside a box are summed from
+# the cumulative sum of the equivalent widths, so only the two bins at the edges
+# of each box need to be weighted.
+def boxsums(bins, boxes):
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 2)
+    if len(bins) == 0:
+        return np.zeros(len(boxes))
+    cum = np.concatenate(([0.0], np.cumsum(bins[:, EQW])))
+    first = np.searchsorted(bins[:, LO], boxes[:, 0], "left")
+    last = np.searchsorted(bins[:, HI], boxes[:, 1], "right")
+    total = cum[np.maximum(first, last)] - cum[first]
+    lower = first - 1
+    upper = np.where(last == lower, len(bins), last)
+    for edge in (lower, upper):
+        valid = (edge >= 0) & (edge < len(bins))
+        i = np.where(valid, edge, 0)
+        l = np.maximum(bins[i, LO], boxes[:, 0])
+        r = np.minimum(bins[i, HI], boxes[:, 1])
+        weight = np.sqrt(np.clip(r - l, 0.0, None) / (bins[i, HI] - bins[i, LO]))
+        total += np.where(valid, bins[i, EQW] * weight, 0.0)
+    return total
+
+
+# Total equivalent width of the bins which overlap each of the windows.
+def windowsums(bins, windows):
+    windows = np.asarray(windows, dtype=float).reshape(-1, 2)
+    if len(bins) == 0:
+        return np.zeros(len(windows))
+    cum = np.concatenate(([0.0], np.cumsum(bins[:, EQW])))
+    start = np.searchsorted(bins[:, HI], windows[:, 0], "right")
+    end = np.searchsorted(bins[:, LO], windows[:, 1], "left")
+    return cum[np.maximum(start, end)] - cum[start]
+
+
+# Equivalent widths for many (box, bins) pairs. Pairs sharing the same bins are
+# evaluated together.
+def batcheqw(pairs):
+    totals = np.zeros(len(pairs))
+    shared = {}
+    for n, (box, bins) in enumerate(pairs):
+        shared.setdefault(id(bins), (bins, []))[1].append((n, box))
+    for bins, boxes in shared.values():
+        index = [n for n, _ in boxes]
+        totals[index] = boxsums(bins, [box for _, box in boxes])
+    return totals
+
+
+__all__ = ["readbins", "fortranfloat", "boxsums", "windowsums", "batcheqw"]
@@ -0,0 +1,172 @@
+# fakesynspec.py
+# -*- coding: utf-8 -*-
+# Deterministic stand-in for SYNSPEC, for benchmarks and testing without
+# TLUSTY/SYNSPEC. It only uses the standard library, so that it can be run as a
+# script without importing aeqw.
+
+import os
+import sys
+import math
+import time
+import collections
+
+# The equivalent width of a line follows an analytic curve of growth in the
+# strength X of the line, W = WD * (ln(1 + X) + DAMP * sqrt(X)), which is linear
+# for weak lines, flat once they saturate and grows as sqrt(X) on the damping
+# part. WD (in mA) is the Doppler width at REFLAM (in A), and X is STRENGTH at
+# log gf 0, abundance REFABUN and Teff REFTEMP, scaled by the Boltzmann factor
+# of the lower level relative to REFTEMP.
+WD = 150.0
+REFLAM = 4500.0
+DAMP = 0.05
+STRENGTH = 3.0
+REFABUN = 1e-4
+REFTEMP = 33000.0
+C2 = 1.4388  # Second radiation constant (cm K)
+C = 299792.458  # Speed of light (km/s)
+K_AMU = 8.2545e-3  # Boltzmann constant over atomic mass unit (km^2 s^-2 K^-1)
+
+# Elements missing from fort.56 have this abundance.
+DEFAULTABUN = 1e-4
+
+# Width (in A) of the bins of fort.16.
+BINWIDTH = 1.0
+
+# The parameters of a line used, as the attributes of aeqw.isynspec.INLIN.
+Line = collections.namedtuple("Line", ("ALAM", "Z", "GF", "EXCL"))
+
+
+def fortfloat(x):
+    if "e" in x:
+        return float(x)
+    return float(x.replace("-", "e-").replace("+", "e+"))
+
+
+# A line of fort.19, whose wavelength may extend to the left of its column.
+def readline(row):
+    tokens = row.split()
+    row = " " * (10 - len(tokens[0])) + row.lstrip()
+    return Line(float(row[0:10]), int(row[11:13]), float(row[16:23]), float(row[23:35]))
+
+
+def strength(line, abundance, temperature):
+    return (
+        abundance
+        / REFABUN
+        * 10**line.GF
+        * STRENGTH
+        * math.exp(-C2 * line.EXCL * (1 / temperature - 1 / REFTEMP))
+    )
+
+
+# Equivalent width (in mA) of a line at the abundance of its element.
+def equivalentwidth(line, abundance, temperature):
+    x = strength(line, abundance, temperature)
+    return WD * line.ALAM * 10 / REFLAM * (math.log1p(x) + DAMP * math.sqrt(x))
+
+
+# Width (in A) of the Gaussian profile of a line, from thermal and
+# microturbulent velocities. The mass of an element is taken as 2Z amu.
+def linewidth(line, temperature, vtb):
+    mass = 1.0 if line.Z == 1 else 2.0 * line.Z
+    return line.ALAM * 10 * math.sqrt(2 * K_AMU * temperature / mass + vtb**2) / C
+
+
+# Bins (lower bound, upper bound, equivalent width) over (alam0, alam1) of the
+# lines at the given abundances (a dictionary by Z). The profiles are sampled
+# every space A, and cut off at cutof0 A from the centre of the line. Lines
+# weaker than relop times the strongest one are left out.
+def synthesize(
+    lines, abundances, temperature, alam0, alam1, space, vtb, relop=0.0, cutof0=math.inf
+):
+    nbins = max(int(math.ceil((alam1 - alam0) / BINWIDTH - 1e-9)), 1)
+    edges = [min(alam0 + k * BINWIDTH, alam1) for k in range(nbins + 1)]
+    eqws = [0.0] * nbins
+    npoints = max(int(round((alam1 - alam0) / space)), 1)
+    step = (alam1 - alam0) / npoints
+    lines = [
+        (line, strength(line, abundances.get(line.Z, DEFAULTABUN), temperature))
+        for line in lines
+    ]
+    strongest = max([x for _, x in lines], default=0.0)
+    for line, x in lines:
+        if x < relop * strongest:
+            continue
+        sigma = linewidth(line, temperature, vtb)
+        lam = line.ALAM * 10
+        reach = min(6 * sigma, cutof0)
+        if lam + reach < alam0 or lam - reach > alam1:
+            continue
+        eqw = equivalentwidth(line, abundances.get(line.Z, DEFAULTABUN), temperature)
+        first = max(int(math.ceil((lam - reach - alam0) / step - 0.5)), 0)
+        last = min(int((lam + reach - alam0) / step - 0.5), npoints - 1)
+        for k in range(first, last + 1):
+            point = alam0 + (k + 0.5) * step
+            eqws[min(int((point - alam0) / BINWIDTH), nbins - 1)] += (
+                eqw
+                * math.exp(-(((point - lam) / sigma) ** 2) / 2)
+                / (sigma * math.sqrt(2 * math.pi))
+                * step
+            )
+    return [(edges[k], edges[k + 1], eqws[k]) for k in range(nbins)]
+
+
+# Run in the current directory as RSynspec would be, with the name of the model
+# as the argument, or as SYNSPEC with the input parameters of the model on
+# stdin. Reads fort.55, fort.19 and fort.56 and writes fort.16. The environment
+# variables AEQW_FAKE_LATENCY (seconds to sleep for each run),
+# AEQW_FAKE_POINTLATENCY (seconds to sleep for every thousand wavelength points)
+# and AEQW_FAKE_RELOP (the largest RELOP for which output is written, fort.16
+# being left empty otherwise) make it behave more like SYNSPEC.
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        with open(argv[0] + ".5") as f:
+            temperature = float(f.readline().split()[0])
+    else:
+        temperature = float(sys.stdin.readline().split()[0])
+    with open("fort.55") as f:
+        unit55 = f.read().splitlines()
+    tokens = unit55[5].split()
+    alam0, alam1, cutof0 = float(tokens[0]), float(tokens[1]), int(tokens[2])
+    relop, space = fortfloat(tokens[4]), float(tokens[5])
+    vtb = float(unit55[7])
+    with open("fort.56") as f:
+        rows = f.read().splitlines()
+    abundances = {}
+    for row in rows[1 : 1 + int(rows[0])]:
+        z, abun = row.split()
+        abundances[int(z)] = fortfloat(abun)
+    with open("fort.19") as f:
+        lines = [readline(row) for row in f if row.strip()]
+
+    time.sleep(
+        float(os.environ.get("AEQW_FAKE_LATENCY", 0))
+        + float(os.environ.get("AEQW_FAKE_POINTLATENCY", 0))
+        * (alam1 - alam0)
+        / space
+        / 1000
+    )
+    with open("fort.16", "w") as f:
+        if relop > float(os.environ.get("AEQW_FAKE_RELOP", "inf")):
+            return
+        cumulative = 0.0
+        for lo, hi, eqw in synthesize(
+            lines, abundances, temperature, alam0, alam1, space, vtb, relop, cutof0
+        ):
+            cumulative += eqw
+            f.write(f"{lo:12.3f}{hi:12.3f}{eqw:14.6e}{cumulative:14.6e}\n")
+
+
+__all__ = [
+    "Line",
+    "readline",
+    "strength",
+    "equivalentwidth",
+    "linewidth",
+    "synthesize",
+    "main",
+]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# grid.py
+# -*- coding: utf-8 -*-
+# Grid mode: the same inputs solved for many models.
+
+import os
+import tempfile
+import multiprocessing
+import logging
+import math
+import glob
+import queue
+from aeqw.isynspec import ISynspec, makescratch
+from aeqw.cache import SynspecCache
+from aeqw.runner import makerunner
+from aeqw.metrics import Metrics
+from aeqw.warmstart import Seeds
+from aeqw.cluster import (
+    Unit55Overrides,
+    ReadInput,
+    SetLineList,
+    Drive,
+    PlanBaselines,
+    RunBaselines,
+    PlanClusters,
+    SolveCluster,
+    MakeCache,
+)
+from aeqw import __version__
+
+logger = logging.getLogger("aeqw.grid")
+
+
+# Grid mode: the same line groups are solved for many models. Every (model,
+# cluster) solve is a task of a pool of workers, each of which keeps a scratch
+# directory for every model it has been given. The models are taken in order of
+# Teff and logg, and each solve is seeded from the results of the nearest model
+# already solved.
+
+_gridworker = None
+
+
+def _GridWorkerInit(conf, srcdir, scratchroot, allLines, spans, cache, runner):
+    global _gridworker
+    _gridworker = (conf, srcdir, scratchroot, allLines, spans, cache, runner, {})
+
+
+# The interface and zero baselines for model in this worker, set up on first use.
+def _GridWorkerModel(model, attributes):
+    conf, srcdir, scratchroot, allLines, spans, cache, runner, models = _gridworker
+    if model not in models:
+        workdir = tempfile.mkdtemp(prefix=f"{model}.", dir=scratchroot)
+        makescratch(workdir, model, srcdir, runner)
+        synspec_interface = ISynspec(model, workdir, cache, runner)
+        for param, value in attributes.items():
+            setattr(synspec_interface, param, value)
+        SetLineList(synspec_interface, conf, allLines)
+        baselines = {}
+        if spans:
+            baselines = Drive(
+                synspec_interface,
+                RunBaselines(
+                    synspec_interface,
+                    conf,
+                    spans,
+                    SynspecCache(
+                        os.path.join(scratchroot, f"{model}.baselines"), math.inf
+                    ),
+                ),
+            )
+        models[model] = synspec_interface, baselines
+    return models[model]
+
+
+def _GridWorkerSolve(task):
+    model, attributes, cluster, seeds = task
+    synspec_interface, baselines = _GridWorkerModel(model, attributes)
+    runs, cached = synspec_interface.runs, synspec_interface.cached
+    results = SolveCluster(synspec_interface, _gridworker[0], cluster, baselines, seeds)
+    return (
+        results,
+        synspec_interface.runs - runs,
+        synspec_interface.cached - cached,
+    )
+
+
+# Expand the names of models which are glob patterns into the models whose
+# input parameters (modelname.5) match it.
+def ExpandModels(patterns):
+    models = []
+    for pattern in patterns:
+        if not any([c in pattern for c in "*?["]):
+            models.append(pattern)
+            continue
+        matches = sorted([fn[:-2] for fn in glob.glob(pattern + ".5")])
+        if not matches:
+            logger.warning(f"No models match {pattern}")
+        models.extend(matches)
+    return models
+
+
+# Distance between models in the (Teff, logg) plane, in which GRIDTEMPSCALE K
+# count as much as 1 dex in logg.
+def ModelDistance(conf, a, b):
+    return math.hypot(
+        (a.TEMP - b.TEMP) / conf.getconf("GRIDTEMPSCALE"), a.LOGG - b.LOGG
+    )
+
+
+def aeqwgrid(conf, models, outputformatter):
+    if conf.getconf("COGTABLE") != "":
+        logger.warning("COGTABLE is not used in grid mode")
+    if conf.getconf("SPECULATE") > 0:
+        logger.warning("SPECULATE is not used in grid mode")
+    cache = MakeCache(conf)
+    runner = makerunner(
+        conf.getconf("RUNNER"), conf.getconf("SYNSPEC"), conf.getconf("RUNLOG")
+    )
+    interfaces = {}
+    attributes = {}
+    for model in models:
+        interfaces[model] = ISynspec(model)
+        attributes[model] = dict(
+            Unit55Overrides(interfaces[model], conf),
+            INITABUNZWISE=interfaces[model].INITABUNZWISE,
+        )
+        logger.info(
+            f"Model: {model} ({interfaces[model].TEMP:.0f} K, {interfaces[model].LOGG:.2f})"
+        )
+    models = sorted(
+        models, key=lambda model: (interfaces[model].TEMP, interfaces[model].LOGG)
+    )
+
+    allLines, testLines = ReadInput(conf)
+    groups = [tl for tl in testLines if type(tl) != str]
+    clusters = PlanClusters(conf, groups, allLines)
+    spans = {}
+    if conf.getconf("BASELINEWIDTH") > 0:
+        spans = PlanBaselines(
+            conf, [[groups[i] for i in cluster] for cluster in clusters]
+        )
+    jobs = max(conf.getconf("JOBS"), 1)
+    logger.info(
+        f"Solving {len(clusters)} clusters of line groups for {len(models)} models with {jobs} jobs"
+    )
+
+    # The seeds of a task are taken when it is started, so that it makes use
+    # of all the models solved by then.
+    solved = {model: [None] * len(groups) for model in models}
+    metrics = None
+    if conf.getconf("METRICS") != "":
+        metrics = Metrics()
+    tasks = [(model, n) for model in models for n in range(len(clusters))]
+    runs = cached = 0
+    done = queue.Queue()
+    with tempfile.TemporaryDirectory(prefix="aeqw") as scratchroot:
+        with multiprocessing.Pool(
+            jobs,
+            _GridWorkerInit,
+            (conf, os.getcwd(), scratchroot, allLines, spans, cache, runner),
+        ) as pool:
+            running = 0
+            while tasks or running:
+                while tasks and running < jobs:
+                    model, n = tasks.pop(0)
+                    seeds = Seeds(conf.getconf("GRIDSPREAD"))
+                    for i in clusters[n]:
+                        neighbours = sorted(
+                            [
+                                other
+                                for other in models
+                                if solved[other][i] is not None
+                                and solved[other][i]["result"] == "success"
+                            ],
+                            key=lambda other: ModelDistance(
+                                conf, interfaces[model], interfaces[other]
+                            ),
+                        )
+                        if neighbours:
+                            seeds.add(groups[i][0], solved[neighbours[0]][i]["relabun"])
+                    pool.apply_async(
+                        _GridWorkerSolve,
+                        (
+                            (
+                                model,
+                                attributes[model],
+                                [groups[i] for i in clusters[n]],
+                                seeds,
+                            ),
+                        ),
+                        callback=lambda solve, task=(model, n): done.put((task, solve)),
+                        error_callback=lambda err: done.put((None, err)),
+                    )
+                    running += 1
+                task, solve = done.get()
+                running -= 1
+                if task is None:
+                    raise solve
+                for i, result in zip(clusters[task[1]], solve[0]):
+                    stats = result.pop("stats", None)
+                    if metrics is not None and stats is not None:
+                        metrics.add(*groups[i], stats, model=task[0])
+                    solved[task[0]][i] = result
+                runs += solve[1]
+                cached += solve[2]
+    if metrics is not None:
+        metrics.save(conf.getconf("METRICS"))
+
+    # Writing the output
+    outputData = (
+        {
+            "models": [
+                {
+                    "model": model,
+                    "temperature": interfaces[model].TEMP,
+                    "logg": interfaces[model].LOGG,
+                }
+                for model in models
+            ],
+            "version": __version__,
+        },
+        [],
+    )
+    index = iter(range(len(groups)))
+    for tl in testLines:
+        if type(tl) == str:
+            outputData[1].append({"type": "comment", "value": tl.rstrip("\n")})
+            continue
+        i = next(index)
+        outputData[1].append(
+            {
+                "type": "line",
+                "target": tl[1],
+                "abundances": [solved[model][i] for model in models],
+                "lines": [
+                    {"wavelength": line.ALAM, "ion": f"{line.Z: >2d}.{line.Q:0>2d}"}
+                    for line in tl[0]
+                ],
+            }
+        )
+    logger.debug("Writing Output")
+    outputformatter(outputData, conf.getconf("OUTFN"))
+    logger.info("Total runs: %d (%d cached)", runs, cached)
+
+
+__all__ = ["ExpandModels", "ModelDistance", "aeqwgrid"]
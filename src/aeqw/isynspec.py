@@ -7,11 +7,21 @@
 
 from warnings import warn
 import itertools
-from subprocess import call
+import os
+import time
+import shutil
 import logging
+import numpy as np
+from aeqw.cache import SynspecCache
+from aeqw.runner import ScriptRunner
+from aeqw.eqw import readbins
 
 logger = logging.getLogger("aeqw.iSynspec")
 
+# Hashes of the models, under the path, size and modification time of their
+# files, so that a process solving many inputs hashes a model once.
+_modelhashes = {}
+
 
 def fortfloat(x):
     if "e" in x:
@@ -43,37 +53,58 @@ class ISUnitNotFoundError(aeqwISError):
         aeqwISError.__init__(self, "File '{0:s}' is missing.".format(fn))
 
 
+# The fields of a line of fort.19, with their types in the columnar line store
+# of aeqw.linelist.
+LINEDTYPE = np.dtype(
+    [
+        ("ALAM", "f8"),
+        ("Z", "i4"),
+        ("Q", "i4"),
+        ("GF", "f8"),
+        ("EXCL", "f8"),
+        ("QL", "f8"),
+        ("EXCU", "f8"),
+        ("QU", "f8"),
+        ("AGAM", "f8"),
+        ("GS", "f8"),
+        ("GW", "f8"),
+    ]
+)
+
+
+# The fields of a line of fort.19, in the order of LINEDTYPE, and whatever
+# follows them. The wavelength may extend to the left of its column.
+def parseline(INLINstr):
+    line = "".join([" "] * (10 - len(INLINstr.split()[0])) + [INLINstr.lstrip()])
+    return (
+        float(line[0:10]),
+        int(line[11:13]),
+        int(line[14:16]),
+        float(line[16:23]),
+        float(line[23:35]),
+        float(line[35:39]),
+        float(line[39:51]),
+        float(line[51:55]),
+        float(line[55:63]),
+        float(line[63:70]),
+        float(line[70:77]),
+    ), line[79:]
+
+
+# A line of fort.19. Its fields are stored in a record of LINEDTYPE, which is
+# either its own or a row of a line store (see aeqw.linelist.LineStore), so that
+# a line list does not cost an object with a dictionary for every line. The
+# fields are read as Python floats and ints.
 class INLIN(object):
-    ALAM, Z, Q, GF, EXCL, QL, EXCU, QU, GS, GW, INEXT = (
-        0.0,
-        1,
-        0,
-        0.0,
-        0.0,
-        0.0,
-        0.0,
-        0.0,
-        0.0,
-        0.0,
-        0.0,
-    )
+    __slots__ = ("_row", "remainder")
 
-    def __init__(self, INLINstr):
+    def __init__(self, INLINstr=None, row=None):
+        if INLINstr is None:
+            self._row = row
+            self.remainder = ""
+            return
         try:
-            line = "".join(
-                [" "] * (10 - len(INLINstr.split()[0])) + [INLINstr.lstrip()]
-            )
-            self.ALAM = float(line[0:10])
-            self.Z, self.Q = int(line[11:13]), int(line[14:16])
-            self.GF = float(line[16:23])
-            self.EXCL = float(line[23:35])
-            self.QL = float(line[35:39])
-            self.EXCU = float(line[39:51])
-            self.QU = float(line[51:55])
-            self.AGAM = float(line[55:63])
-            self.GS = float(line[63:70])
-            self.GW = float(line[70:77])
-            self.remainder = line[79:]
+            fields, self.remainder = parseline(INLINstr)
         except ValueError as e:
             raise InvalidInput(
                 "Spectral line couldn't be parsed.",
@@ -81,25 +112,36 @@ class INLIN(object):
                 str(INLINstr),
                 "<see SYNSPEC doc>",
             ) from e
+        self._row = np.array([fields], dtype=LINEDTYPE)[0]
+
+    # The fields as a tuple, in the order of LINEDTYPE.
+    def fields(self):
+        return self._row.item()
 
     def __str__(self):
         return "{0:>10.4f}{1:>3d}.{2:0>2d}{3:>7.3f}{4:>12.3f}{5:>4.1f}{6:>12.3f}{7:>4.1f} {8:>7.2f}{9:>7.2f}{10:>7.2f} 0".format(
-            self.ALAM,
-            self.Z,
-            self.Q,
-            self.GF,
-            self.EXCL,
-            self.QL,
-            self.EXCU,
-            self.QU,
-            self.AGAM,
-            self.GS,
-            self.GW,
+            *self._row.item()
         )
 
 
+def _linefield(name):
+    def get(self):
+        return self._row[name].item()
+
+    def set(self, value):
+        self._row[name] = value
+
+    return property(get, set)
+
+
+for _name in LINEDTYPE.names:
+    setattr(INLIN, _name, _linefield(_name))
+
+
 class ISynspec(object):
     runs = 0
+    cached = 0  # Number of runs whose output was taken from the cache
+    relopretries = 0  # Number of times RELOP was lowered for lack of output
     # Here come some default values of all the parameters. See synspec guide to understand.
     # fort.55
     IMODE, IDSTD, IPRIN = 1, 32, 0
@@ -115,6 +157,37 @@ class ISynspec(object):
     LINELIST = []
     # fort.56
     ABUNDANCES = []  # To be stored as a list of tuples (int, float)
+    # The parameters of fort.55, in the order of the template.
+    params55 = (
+        "IMODE",
+        "IDSTD",
+        "IPRIN",
+        "INMOD",
+        "INTRPL",
+        "ICHANG",
+        "ICHEMC",
+        "IOPHLI",
+        "NUNALP",
+        "NUNBET",
+        "NUNGAM",
+        "NUNBAL",
+        "IFREQ",
+        "INLTE",
+        "ICONTL",
+        "INLIST",
+        "IFHE2",
+        "IHYDPR",
+        "IHE1PR",
+        "IHE2PR",
+        "ALAM0",
+        "ALAM1",
+        "CUTOF0",
+        "CUTOFS",
+        "RELOP",
+        "SPACE",
+        "NMLIST",
+        "VTB",
+    )
     # The template for fort.55
     temp55 = (
         "{0:d} {1:d} {2:d}\n"
@@ -127,8 +200,19 @@ class ISynspec(object):
         "{27:f}\n"
     )
 
-    def __init__(self, model="fort"):
+    def __init__(self, model="fort", workdir=".", cache=None, runner=None):
         self.model = model
+        self.workdir = workdir
+        self.cache = cache
+        self.runner = ScriptRunner() if runner is None else runner
+        self._units = {}  # Contents of the unit files last written
+        self.coarse = None  # Factors of the parameters of fort.55 for coarse runs
+        self.lineindex = None  # Lines of fort.19 indexed by wavelength
+        self.timings = {}  # Time spent in each phase of the runs
+        self.spares = []  # Interfaces in other directories running trials at once
+        self._modelhash = None
+        self._cachekey = None
+        self._cachedEQW = None
         self.read55()
         self.read56()
         self.INITABUNZWISE = {i[0]: i[1] for i in self.ABUNDANCES}
@@ -145,51 +229,30 @@ class ISynspec(object):
 
     # Methods to write to input files.
     def write55(self):
-        logger.debug("   Writing to fort.55")
-        with open("fort.55", "w") as f:
-            f.write(
-                self.temp55.format(
-                    self.IMODE,
-                    self.IDSTD,
-                    self.IPRIN,
-                    self.INMOD,
-                    self.INTRPL,
-                    self.ICHANG,
-                    self.ICHEMC,
-                    self.IOPHLI,
-                    self.NUNALP,
-                    self.NUNBET,
-                    self.NUNGAM,
-                    self.NUNBAL,
-                    self.IFREQ,
-                    self.INLTE,
-                    self.ICONTL,
-                    self.INLIST,
-                    self.IFHE2,
-                    self.IHYDPR,
-                    self.IHE1PR,
-                    self.IHE2PR,
-                    self.ALAM0,
-                    self.ALAM1,
-                    self.CUTOF0,
-                    self.CUTOFS,
-                    self.RELOP,
-                    self.SPACE,
-                    self.NMLIST,
-                    self.VTB,
-                ).replace("e", "")
-            )
+        start = time.perf_counter()
+        params = {}
+        if self.coarse is not None:
+            for param, factor in self.coarse.items():
+                value = getattr(self, param) * factor
+                params[param] = max(round(value), 1) if param == "CUTOF0" else value
+        self._writeunit("fort.55", self.render55(**params))
+        self.addtime("write55", start)
+
+    # Contents of fort.55, with the parameters in params in place of those set.
+    def render55(self, **params):
+        return self.temp55.format(
+            *[params.get(param, getattr(self, param)) for param in self.params55]
+        ).replace("e", "")
 
     def write19(self):
-        logger.debug("   Writing to fort.19")
-        with open("fort.19", "w") as f:
-            for line in self.LINELIST:
-                f.write(str(line))
-                f.write("\n")
+        start = time.perf_counter()
+        self._writeunit("fort.19", "".join([f"{line}\n" for line in self.LINELIST]))
+        self.addtime("write19", start)
 
     def write56(self):
         logger.debug("   Writing to fort.56")
-        with open("fort.56", "w") as f:
+        start = time.perf_counter()
+        with open(self._unitfn("fort.56"), "w") as f:
             f.write("{0:d}\n".format(len(self.ABUNDANCES)))
             for ABUN in self.ABUNDANCES:
                 # Checking for unusual abundances
@@ -200,27 +263,29 @@ class ISynspec(object):
                         )
                     )
                 f.write("{0:d} {1:e}\n".format(ABUN[0], ABUN[1]).replace("e", ""))
+        self.addtime("write56", start)
 
     # Methods to read from output file.
     def read16(self):
+        if self._cachedEQW is not None:
+            self.EQW = self._cachedEQW
+            return self.EQW
         logger.debug("   Reading from fort.16")
-        self.EQW = []
+        start = time.perf_counter()
         try:
-            with open("fort.16") as f:
-                for line in f:
-                    tokens = line.split()
-                    self.EQW.append(
-                        ((float(tokens[0]), float(tokens[1])), float(tokens[2]))
-                    )
+            self.EQW = readbins(self._unitfn("fort.16"))
         except FileNotFoundError as err:
             raise ISUnitNotFoundError("fort.16") from err
+        self.addtime("read16", start)
+        if self._cachekey is not None and len(self.EQW) > 1:
+            self.cache.put(self._cachekey, self.EQW)
         return self.EQW
 
     # Reading fort.55 for values of all parameter.
     def read55(self):
         logger.debug("    Reading from fort.55")
         try:
-            with open("fort.55") as f:
+            with open(self._unitfn("fort.55")) as f:
                 # Line 1
                 self.IMODE, self.IDSTD, self.IPRIN = [
                     int(i) for i in f.readline().split()
@@ -266,7 +331,7 @@ class ISynspec(object):
     def read56(self):
         logger.debug("    Reading from fort.56")
         try:
-            with open("fort.56") as f:
+            with open(self._unitfn("fort.56")) as f:
                 self.ABUNDANCES = []
                 nelem = int(f.readline().strip())
                 for _ in itertools.repeat(None, nelem):
@@ -280,7 +345,7 @@ class ISynspec(object):
     def readmodel(self):
         try:
             logger.debug("Checking existence of model input.")
-            with open(self._getmodelfn(5)) as f:
+            with open(self._unitfn(self._getmodelfn(5))) as f:
                 tokens = f.readline().split()
                 self.TEMP = float(tokens[0])
                 self.LOGG = float(tokens[1])
@@ -288,20 +353,103 @@ class ISynspec(object):
             raise ISUnitNotFoundError(self._getmodelfn(5)) from err
         try:
             logger.debug("Checking existence of model.")
-            with open(self._getmodelfn(8)) as _:
+            with open(self._unitfn(self._getmodelfn(8))) as _:
                 pass
         except FileNotFoundError as err:
             raise ISUnitNotFoundError(self._getmodelfn(8)) from err
 
     # Running the SYNSPEC program. self.runs is a counter that keeps track of number of runs.
     def run(self):
-        logger.debug("   Running SYNSPEC: RSynspec {0}".format(self.model))
-        call(
-            ["rm", "-f", "fort.16"]
-        )  # To avoid reading previous data in case of SYNSPEC not running.
         self.runs += 1
-        with open("/dev/null", "r+") as nullf:
-            call(["RSynspec", self.model], stdout=nullf)
+        if not self._lookup():
+            start = time.perf_counter()
+            self.runner(self.model, self.workdir)
+            self.addtime("synspec", start)
+
+    # Running the SYNSPEC program as a coroutine.
+    async def arun(self):
+        self.runs += 1
+        if not self._lookup():
+            start = time.perf_counter()
+            await self.runner.arun(self.model, self.workdir)
+            self.addtime("synspec", start)
+
+    # Write the unit files last written by other, so that a run here is the same
+    # as one there, apart from the abundances.
+    def mirror(self, other):
+        for fn, text in other._units.items():
+            self._writeunit(fn, text)
+
+    # Count the runs of other, since they were last counted, as those of this
+    # interface, along with the time spent on them.
+    def absorb(self, other):
+        self.runs += other.runs
+        self.cached += other.cached
+        self.relopretries += other.relopretries
+        for phase, seconds in other.timings.items():
+            self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+        other.runs = other.cached = other.relopretries = 0
+        other.timings = {}
+
+    # Add the time since start to the time spent in phase.
+    def addtime(self, phase, start):
+        self.timings[phase] = self.timings.get(phase, 0.0) + time.perf_counter() - start
+
+    # Look up the output of the run in the cache. Returns whether it was found.
+    def _lookup(self):
+        self._cachekey = self._cachedEQW = None
+        if self.cache is not None:
+            self._cachekey = self._getcachekey()
+            self._cachedEQW = self.cache.get(self._cachekey)
+            if self._cachedEQW is not None:
+                logger.debug("   Using cached output of SYNSPEC")
+                self.cached += 1
+                return True
+        return False
+
+    # The key of a run in the cache is the hash of the identity of the runner
+    # (see aeqw.runner.Runner.identity), the model and the unit files written
+    # for it.
+    def _getcachekey(self):
+        units = []
+        for fn in ("fort.55", "fort.19", "fort.56"):
+            with open(self._unitfn(fn)) as f:
+                units.append(f.read())
+        return SynspecCache.key(self.runner.identity(), self.modelhash(), *units)
+
+    # Hash of the files of the model, which identifies it.
+    def modelhash(self):
+        if self._modelhash is None:
+            fns = [
+                os.path.realpath(self._unitfn(self._getmodelfn(unit)))
+                for unit in (5, 8)
+            ]
+            stats = tuple(
+                [(fn, os.stat(fn).st_size, os.stat(fn).st_mtime_ns) for fn in fns]
+            )
+            if stats not in _modelhashes:
+                modelfiles = []
+                for fn in fns:
+                    with open(fn, "rb") as f:
+                        modelfiles.append(f.read())
+                _modelhashes[stats] = SynspecCache.key(*modelfiles)
+            self._modelhash = _modelhashes[stats]
+        return self._modelhash
+
+    # Write a unit file, unless it already has the same contents. Files written
+    # by others are not noticed, so they should not touch the working directory.
+    def _writeunit(self, fn, text):
+        if self._units.get(fn) == text:
+            logger.debug("   {0:s} is unchanged".format(fn))
+            return
+        logger.debug("   Writing to {0:s}".format(fn))
+        with open(self._unitfn(fn), "w") as f:
+            f.write(text)
+        self._units[fn] = text
+
+    # Path of a unit or model file inside the working directory.
+    def _unitfn(self, fn):
+        return os.path.join(self.workdir, fn)
 
     # Backwards compatibility
     def _getmodelfn(self, unit):
@@ -320,6 +468,30 @@ class ISynspec(object):
             return "{0:s}.{1:d}".format(self.model, unit)
 
 
+# Populate a scratch directory so that an independent SYNSPEC process can run in
+# it. The model is linked, as are any other entries (e.g. atomic data) which
+# SYNSPEC may need. Unit files and files named after the model are not linked
+# as SYNSPEC writes to those; fort.55 and fort.56 are copied instead. The
+# runner, if given, sets up the rest (see aeqw.runner.Runner.scratch).
+def makescratch(workdir, model="fort", srcdir=".", runner=None):
+    logger.debug("Populating scratch directory {0:s}".format(workdir))
+    srcdir = os.path.abspath(srcdir)
+    modelfns = (
+        "{0:s}.5".format(model),
+        "fort.8" if model == "fort" else "{0:s}.7".format(model),
+    )
+    for fn in os.listdir(srcdir):
+        if fn in modelfns or not (fn.startswith("fort.") or fn.startswith(model + ".")):
+            os.symlink(os.path.join(srcdir, fn), os.path.join(workdir, fn))
+    for fn in ("fort.55", "fort.56"):
+        try:
+            shutil.copy(os.path.join(srcdir, fn), os.path.join(workdir, fn))
+        except FileNotFoundError as err:
+            raise ISUnitNotFoundError(fn) from err
+    if runner is not None:
+        runner.scratch(model, workdir)
+
+
 __all__ = [
     "fortfloat",
     "aeqwISError",
@@ -327,4 +499,5 @@ __all__ = [
     "ISUnitNotFoundError",
     "INLIN",
     "ISynspec",
+    "makescratch",
 ]
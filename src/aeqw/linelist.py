@@ -0,0 +1,156 @@
+# linelist.py
+# -*- coding: utf-8 -*-
+# Line lists stored by column and indexed by wavelength, so that only the lines
+# near a synthetic spectrum are written to fort.19.
+
+import os
+import time
+import tempfile
+import logging
+import numpy as np
+from aeqw.isynspec import INLIN, LINEDTYPE, parseline
+
+logger = logging.getLogger("aeqw.linelist")
+
+# Number of lines parsed at a time by readlinelist.
+CHUNK = 65536
+
+# The line list last read by this process from each path, with its key.
+_stores = {}
+
+
+# Lines stored as an array of LINEDTYPE records sorted by wavelength, which may
+# be memory mapped from a file. It is a sequence of INLIN views of its rows, so
+# that it can be written to fort.19 as a list of lines.
+class LineStore(object):
+    def __init__(self, array):
+        self.array = array
+        self._alams = None
+
+    @classmethod
+    def fromlines(cls, lines):
+        array = np.array([line.fields() for line in lines], dtype=LINEDTYPE)
+        return cls(array[np.argsort(array["ALAM"], kind="stable")])
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return LineStore(self.array[k])
+        return INLIN(row=self.array[k])
+
+    def __iter__(self):
+        for row in self.array:
+            yield INLIN(row=row)
+
+    # Wavelengths (in Å) of the lines.
+    @property
+    def alams(self):
+        if self._alams is None:
+            self._alams = self.array["ALAM"] * 10
+        return self._alams
+
+    # The lines whose wavelength (in Å) is within [lo, hi].
+    def window(self, lo, hi):
+        first = np.searchsorted(self.alams, lo, "left")
+        last = np.searchsorted(self.alams, hi, "right")
+        return self[first:last]
+
+    # A store of these lines and those of lines which are not already among them.
+    def merge(self, lines):
+        extra = []
+        for line in lines:
+            same = self.window(line.ALAM * 10, line.ALAM * 10)
+            if str(line) not in [str(other) for other in same]:
+                extra.append(line)
+        if not extra:
+            return self
+        array = np.concatenate([self.array, LineStore.fromlines(extra).array])
+        return LineStore(array[np.argsort(array["ALAM"], kind="stable")])
+
+
+# Read a line list in the format of fort.19, one line per row. Blank rows and
+# rows starting with a "#" are skipped. The lines parsed are stored alongside
+# fn, in fn.npy, under the size and modification time of fn (in fn.npy.key), and
+# are memory mapped from there as long as fn is not changed, instead of being
+# parsed again. A process reading the same list again gets the same store.
+def readlinelist(fn, cache=True):
+    st = os.stat(fn)
+    key = f"{st.st_size:d} {st.st_mtime_ns:d} {LINEDTYPE.descr}"
+    sidecar = fn + ".npy"
+    if cache and _stores.get(os.path.abspath(fn), (None,))[0] == key:
+        return _stores[os.path.abspath(fn)][1]
+    store = _readlinelist(fn, key, sidecar, cache)
+    if cache:
+        _stores[os.path.abspath(fn)] = key, store
+    return store
+
+
+def _readlinelist(fn, key, sidecar, cache):
+    start = time.perf_counter()
+    if cache:
+        try:
+            with open(sidecar + ".key") as f:
+                if f.read() == key:
+                    store = LineStore(np.load(sidecar, mmap_mode="r"))
+                    logger.debug(
+                        f"Mapped {len(store)} lines of {fn} from {sidecar} in {time.perf_counter() - start:.3f} s"
+                    )
+                    return store
+        except (FileNotFoundError, ValueError):
+            pass
+    # Parsed in chunks, so that only a chunk of the lines is held as tuples.
+    chunks = []
+    fields = []
+    with open(fn) as f:
+        for row in f:
+            if row.strip() == "" or row[0] == "#":
+                continue
+            fields.append(parseline(row)[0])
+            if len(fields) == CHUNK:
+                chunks.append(np.array(fields, dtype=LINEDTYPE))
+                fields = []
+    chunks.append(np.array(fields, dtype=LINEDTYPE))
+    array = np.concatenate(chunks)
+    chunks = fields = None
+    store = LineStore(array[np.argsort(array["ALAM"], kind="stable")])
+    logger.debug(
+        f"Read {len(store)} lines from {fn} in {time.perf_counter() - start:.3f} s"
+    )
+    if cache:
+        # Written to temporary files first, and the key last, so that a
+        # sidecar is never used with the key of another version of fn.
+        try:
+            for name, write in (
+                (sidecar, lambda f: np.save(f, store.array)),
+                (sidecar + ".key", lambda f: f.write(key.encode())),
+            ):
+                fd, tmpfn = tempfile.mkstemp(
+                    dir=os.path.dirname(os.path.abspath(fn)), suffix=".tmp"
+                )
+                with os.fdopen(fd, "wb") as f:
+                    write(f)
+                os.replace(tmpfn, name)
+        except OSError as e:
+            logger.debug(f"Could not store the lines of {fn} in {sidecar}: {e}")
+    return store
+
+
+# Lines sorted by wavelength, from which those within a range are taken by
+# binary search.
+class LineIndex(object):
+    def __init__(self, lines):
+        self.store = (
+            lines if isinstance(lines, LineStore) else LineStore.fromlines(lines)
+        )
+
+    def __len__(self):
+        return len(self.store)
+
+    # The lines whose wavelength (in Å) is within [lo, hi].
+    def window(self, lo, hi):
+        return self.store.window(lo, hi)
+
+
+__all__ = ["LineStore", "readlinelist", "LineIndex"]
@@ -0,0 +1,52 @@
+# manifest.py
+# -*- coding: utf-8 -*-
+# Record of the results of line groups, written as each group is solved.
+
+import os
+import json
+import logging
+
+logger = logging.getLogger("aeqw.manifest")
+
+
+# The manifest is a file with a line of JSON, {"key": key, "result": result},
+# for every solved line group, flushed to disk as soon as it is added. The key
+# identifies the inputs which gave the result. If resume is set the entries
+# already in the file are read, otherwise the file is started afresh.
+class Manifest(object):
+    def __init__(self, fn, resume=False):
+        self.fn = fn
+        self.entries = {}
+        if resume:
+            try:
+                with open(fn) as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                            self.entries[entry["key"]] = entry["result"]
+                        except (ValueError, KeyError, TypeError):
+                            # Such as the last line of a run which was killed
+                            logger.debug("Skipping unreadable line in manifest")
+            except FileNotFoundError:
+                pass
+            logger.debug(
+                "Read {0:d} entries from manifest {1:s}".format(len(self.entries), fn)
+            )
+        self.f = open(fn, "a" if resume else "w")
+        if resume and self.f.tell() > 0:
+            self.f.write("\n")  # In case the last line was cut short
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def add(self, key, result):
+        self.entries[key] = result
+        self.f.write(json.dumps({"key": key, "result": result}) + "\n")
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
+
+
+__all__ = ["Manifest"]
@@ -0,0 +1,109 @@
+# metrics.py
+# -*- coding: utf-8 -*-
+# Statistics of the solving of line groups, exported as JSON and in the
+# Prometheus text format.
+
+import json
+import logging
+
+logger = logging.getLogger("aeqw.metrics")
+
+# The phases of a run whose time is recorded by ISynspec and CalcEqws.
+PHASES = ("write55", "write19", "write56", "synspec", "read16", "CalcEqw")
+
+
+# Statistics of every line group, added as the groups are solved. The
+# statistics of a group are a dictionary with the number of trials (and how
+# many of those were coarse), SYNSPEC runs (and how many of those were cached)
+# and RELOP retries, the time spent in each phase, whether it converged and
+# with which method. Groups solved together in a cluster share runs, so those
+# are counted for every group of the cluster up to when the group was solved.
+class Metrics(object):
+    def __init__(self):
+        self.groups = []
+
+    def add(self, testLine, xeqw, stats, model=None):
+        group = {
+            "lines": [
+                {"wavelength": line.ALAM, "ion": f"{line.Z: >2d}.{line.Q:0>2d}"}
+                for line in testLine
+            ],
+            "target": xeqw,
+        }
+        if model is not None:
+            group["model"] = model
+        group.update(stats)
+        self.groups.append(group)
+
+    def totals(self):
+        totals = {
+            "groups": len(self.groups),
+            "converged": sum([group["converged"] for group in self.groups]),
+            "trials": sum([group["trials"] for group in self.groups]),
+            "coarse": sum([group["coarse"] for group in self.groups]),
+            "relopretries": sum([group["relopretries"] for group in self.groups]),
+            "seconds": {
+                phase: sum([group["seconds"].get(phase, 0.0) for group in self.groups])
+                for phase in PHASES
+            },
+        }
+        return totals
+
+    def savejson(self, fn):
+        with open(fn, "w") as f:
+            json.dump({"totals": self.totals(), "groups": self.groups}, f, indent=1)
+
+    def saveprometheus(self, fn):
+        def labels(group, **extra):
+            label = {
+                "wavelength": " ".join(
+                    [f"{line['wavelength']:.4f}" for line in group["lines"]]
+                ),
+                "ion": group["lines"][0]["ion"].strip(),
+            }
+            if "model" in group:
+                label["model"] = group["model"]
+            label.update(extra)
+            return ",".join(
+                [
+                    '{0}="{1}"'.format(
+                        key, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                    )
+                    for key, value in label.items()
+                ]
+            )
+
+        samples = [
+            ("aeqw_group_trials", "Number of trials of the line group.", "trials"),
+            ("aeqw_group_coarse_trials", "Number of those trials coarse.", "coarse"),
+            ("aeqw_group_runs", "Number of SYNSPEC runs of the cluster.", "runs"),
+            ("aeqw_group_cached_runs", "Number of those runs cached.", "cached"),
+            ("aeqw_group_relop_retries", "Number of RELOP retries.", "relopretries"),
+        ]
+        with open(fn, "w") as f:
+            for name, doc, key in samples:
+                f.write(f"# HELP {name} {doc}\n# TYPE {name} gauge\n")
+                for group in self.groups:
+                    f.write(f"{name}{{{labels(group)}}} {group[key]}\n")
+            name = "aeqw_group_seconds"
+            f.write(f"# HELP {name} Time spent in each phase.\n# TYPE {name} gauge\n")
+            for group in self.groups:
+                for phase, seconds in group["seconds"].items():
+                    f.write(f"{name}{{{labels(group, phase=phase)}}} {seconds:.6f}\n")
+            name = "aeqw_group_converged"
+            f.write(
+                f"# HELP {name} Whether the line group converged.\n# TYPE {name} gauge\n"
+            )
+            for group in self.groups:
+                f.write(
+                    f"{name}{{{labels(group, method=group['method'])}}} {int(group['converged'])}\n"
+                )
+
+    # Write the metrics to fn.json and fn.prom.
+    def save(self, fn):
+        logger.debug(f"Writing metrics to {fn}.json and {fn}.prom")
+        self.savejson(fn + ".json")
+        self.saveprometheus(fn + ".prom")
+
+
+__all__ = ["PHASES", "Metrics"]
@@ -0,0 +1,166 @@
+# output.py
+# -*- coding: utf-8 -*-
+# Output formats of the abundances found by aeqw.
+
+import json
+from aeqw import __version__
+
+
+def outputtxt(outputData, outfn):
+    with open(outfn, "w") as f:
+        f.write("{model:s} {temperature:.2f} {logg:.2f}\n".format_map(outputData[0]))
+        if "unit55" in outputData[0]:
+            f.write(
+                "".join(
+                    [f"{key} = {value}\n" for key, value in outputData[0]["unit55"]]
+                )
+            )
+        f.write("LAMBDANM   Z.Q      Teqw  ABUN/ref  LOGABUN   wing%")
+        f.write(
+            ErrorsTxt(
+                [row["abundance"] for row in outputData[1] if row["type"] == "line"]
+            )
+        )
+        for row in outputData[1]:
+            if row["type"] == "comment":
+                f.write("\n" + row["value"])
+            elif row["type"] == "line":
+                f.write(
+                    "".join(
+                        [
+                            "\n{wavelength: >8.4f}  {ion}".format_map(line)
+                            for line in row["lines"]
+                        ]
+                    )
+                )
+                f.write(f" {row['target']:8.2f}  {AbunTxt(row['abundance'])}")
+        f.write("\n")
+
+
+def AbunTxt(abundance):
+    if abundance["result"] != "success":
+        return abundance["message"]
+    # Rounded before formatting, so that a wing just below zero shows as 0%
+    # rather than -0%.
+    txt = "{relabun: >8.2e}  {logabun: >7.2f}   {wingpercent: >4.0f}%".format_map(
+        dict(abundance, wingpercent=round(abundance["wingpercent"], 0) + 0.0)
+    )
+    if "relabun_lo" in abundance:
+        txt += "".join(
+            [
+                f"  {'-':>8s}" if abundance[key] is None else f"  {abundance[key]:8.2e}"
+                for key in ("relabun_lo", "relabun_hi")
+            ]
+        )
+    return txt
+
+
+# Header of the columns of the abundances for the uncertainties of the targets,
+# if any of the abundances have them.
+def ErrorsTxt(abundances):
+    if any(["relabun_lo" in abundance for abundance in abundances]):
+        return "   ABUN_lo   ABUN_hi"
+    return ""
+
+
+def outputjson(outputData, outfn):
+    txt = json.dumps(outputData)
+    with open(outfn, "w") as f:
+        f.write(txt)
+
+
+outputformatter = {"txt": outputtxt, "json": outputjson}
+
+
+# Output formatters for a grid of models. The rows of line groups have the
+# results for every model, in the order of the models in the header.
+
+
+def outputgridtxt(outputData, outfn):
+    with open(outfn, "w") as f:
+        f.write(
+            "MODEL           TEMP   LOGG  LAMBDANM   Z.Q      Teqw  ABUN/ref  LOGABUN   wing%"
+        )
+        f.write(
+            ErrorsTxt(
+                [
+                    abundance
+                    for row in outputData[1]
+                    if row["type"] == "line"
+                    for abundance in row["abundances"]
+                ]
+            )
+        )
+        for row in outputData[1]:
+            if row["type"] == "comment":
+                f.write("\n" + row["value"])
+            elif row["type"] == "line":
+                for model, abundance in zip(outputData[0]["models"], row["abundances"]):
+                    f.write(
+                        "".join(
+                            [
+                                "\n{model: <12s} {temperature: >8.0f} {logg: >6.2f}  ".format_map(
+                                    model
+                                )
+                                + "{wavelength: >8.4f}  {ion}".format_map(line)
+                                for line in row["lines"]
+                            ]
+                        )
+                    )
+                    f.write(f" {row['target']:8.2f}  {AbunTxt(abundance)}")
+        f.write("\n")
+
+
+outputgridformatter = {"txt": outputgridtxt, "json": outputjson}
+
+
+# Header of the output, describing the model.
+def OutputHeader(conf, model, synspec_interface):
+    header = {
+        "model": model,
+        "temperature": synspec_interface.TEMP,
+        "logg": synspec_interface.LOGG,
+        "version": __version__,
+    }
+    if "unit55" in conf:
+        header["unit55"] = {
+            param.upper(): getattr(synspec_interface, param.upper())
+            for param in conf["unit55"]
+            if hasattr(synspec_interface, param.upper())
+        }
+    return header
+
+
+# The output of the entries of the input, given the results of all of them
+# (which are ignored for comments).
+def OutputData(header, testLines, finAbun):
+    outputData = (header, [])
+    for i, tl in enumerate(testLines):
+        if type(tl) == str:
+            outputData[1].append({"type": "comment", "value": tl.rstrip("\n")})
+            continue
+        outputData[1].append(
+            {
+                "type": "line",
+                "target": tl[1],
+                "abundance": finAbun[i],
+                "lines": [
+                    {"wavelength": line.ALAM, "ion": f"{line.Z: >2d}.{line.Q:0>2d}"}
+                    for line in tl[0]
+                ],
+            }
+        )
+    return outputData
+
+
+__all__ = [
+    "outputtxt",
+    "AbunTxt",
+    "ErrorsTxt",
+    "outputjson",
+    "outputformatter",
+    "outputgridtxt",
+    "outputgridformatter",
+    "OutputHeader",
+    "OutputData",
+]
@@ -0,0 +1,284 @@
+# parallel.py
+# -*- coding: utf-8 -*-
+# Solving the clusters of line groups of a model in parallel, in worker
+# processes or in aeqw workers on other hosts.
+
+import os
+import tempfile
+import multiprocessing
+import secrets
+import logging
+from aeqw.isynspec import ISynspec, makescratch
+from aeqw.runner import makerunner
+from aeqw.workqueue import Coordinator, work
+from aeqw.cluster import MakeCache, MakeSpares, SetLineList, SolveCluster
+
+logger = logging.getLogger("aeqw.parallel")
+
+
+# Parallel solving. Each worker process gets its own scratch directory, so that
+# the SYNSPEC unit files of different workers do not clash.
+
+_worker = None
+
+
+def _WorkerInit(
+    conf,
+    model,
+    srcdir,
+    scratchroot,
+    attributes,
+    allLines,
+    cache,
+    runner,
+    baselines,
+    warmstart,
+    tables=None,
+):
+    global _worker
+    workdir = tempfile.mkdtemp(prefix="worker", dir=scratchroot)
+    makescratch(workdir, model, srcdir, runner)
+    synspec_interface = ISynspec(model, workdir, cache, runner)
+    for param, value in attributes.items():
+        setattr(synspec_interface, param, value)
+    SetLineList(synspec_interface, conf, allLines)
+    MakeSpares(synspec_interface, conf, scratchroot, srcdir)
+    _worker = (synspec_interface, conf, baselines, warmstart, tables)
+
+
+def _WorkerSolve(cluster):
+    synspec_interface, conf, baselines, warmstart, tables = _worker
+    runs, cached = synspec_interface.runs, synspec_interface.cached
+    results = SolveCluster(
+        synspec_interface, conf, cluster, baselines, warmstart, tables
+    )
+    return (
+        results,
+        synspec_interface.runs - runs,
+        synspec_interface.cached - cached,
+    )
+
+
+def _WorkerSolveIndexed(task):
+    return task[0], _WorkerSolve(task[1])
+
+
+# Solve all the clusters of line groups in a pool of jobs processes. The
+# interfaces of the workers are given the attributes of the ISynspec interface
+# in attributes. done is called with the index and the results of each cluster
+# as soon as it is solved. Returns the total number of runs and the number of
+# those which were cached.
+def SolveParallel(
+    conf,
+    model,
+    attributes,
+    allLines,
+    clusters,
+    jobs,
+    cache,
+    runner,
+    baselines,
+    warmstart,
+    done,
+    tables=None,
+):
+    logger.info(f"Solving {len(clusters)} clusters of line groups with {jobs} jobs")
+    runs = cached = 0
+    with tempfile.TemporaryDirectory(prefix="aeqw") as scratchroot:
+        with multiprocessing.Pool(
+            jobs,
+            _WorkerInit,
+            (
+                conf,
+                model,
+                os.getcwd(),
+                scratchroot,
+                attributes,
+                allLines,
+                cache,
+                runner,
+                baselines,
+                warmstart,
+                tables,
+            ),
+        ) as pool:
+            for n, solve in pool.imap_unordered(
+                _WorkerSolveIndexed, enumerate(clusters)
+            ):
+                done(n, solve[0])
+                runs += solve[1]
+                cached += solve[2]
+    return runs, cached
+
+
+# Solve the clusters of line groups in the interface, or remotely with SERVE,
+# or in JOBS processes, with overrides the parameters of unit 55 set in the
+# interface. done is called with the index and the results of each cluster as
+# soon as it is solved. Returns the number of runs of the workers and how many
+# of them were cached, apart from those of the interface.
+def SolveClusters(
+    synspec_interface,
+    conf,
+    model,
+    overrides,
+    allLines,
+    clusters,
+    cache,
+    runner,
+    baselines,
+    warmstart,
+    tables,
+    done,
+):
+    attributes = dict(
+        overrides,
+        RELOP=synspec_interface.RELOP,
+        INITABUNZWISE=synspec_interface.INITABUNZWISE,
+    )
+    if conf.getconf("SERVE") != "":
+        authkey = conf.getconf("AUTHKEY")
+        if authkey == "":
+            authkey = secrets.token_hex(16)
+            logger.info(f"Workers can connect with --authkey {authkey}")
+        return SolveRemote(
+            conf,
+            model,
+            attributes,
+            allLines,
+            clusters,
+            baselines,
+            warmstart,
+            authkey,
+            done,
+            tables,
+        )
+    if conf.getconf("JOBS") > 1:
+        return SolveParallel(
+            conf,
+            model,
+            attributes,
+            allLines,
+            clusters,
+            conf.getconf("JOBS"),
+            cache,
+            runner,
+            baselines,
+            warmstart,
+            done,
+            tables,
+        )
+    with tempfile.TemporaryDirectory(prefix="aeqw") as scratchroot:
+        MakeSpares(synspec_interface, conf, scratchroot, os.getcwd())
+        try:
+            for n, cluster in enumerate(clusters):
+                results = SolveCluster(
+                    synspec_interface, conf, cluster, baselines, warmstart, tables
+                )
+                done(n, results)
+                # Later groups are seeded from those already solved
+                if warmstart is not None:
+                    for (testLine, _), result in zip(cluster, results):
+                        if result["result"] == "success":
+                            warmstart.add(testLine, result["relabun"])
+        finally:
+            synspec_interface.spares = []
+    return 0, 0
+
+
+# Remote solving. The coordinator serves the clusters of line groups as jobs to
+# workers, which connect to it from any node sharing the working directory (or
+# a copy of it). Workers are set up as those of SolveParallel, from the context
+# sent by the coordinator, and the cache and runner of their own configuration.
+def SolveRemote(
+    conf,
+    model,
+    attributes,
+    allLines,
+    clusters,
+    baselines,
+    warmstart,
+    authkey,
+    done,
+    tables=None,
+):
+    # Clusters which the workers failed to solve are reported as errors marked
+    # as transient, which are not recorded in the manifest, so that they are
+    # solved again on resuming.
+    def finished(n, result):
+        status, value = result
+        if status == "done":
+            done(n, value[0])
+        else:
+            done(
+                n,
+                [
+                    {"result": "error", "message": value, "transient": True}
+                    for _ in clusters[n]
+                ],
+            )
+
+    coordinator = Coordinator(
+        conf.getconf("SERVE"),
+        authkey.encode(),
+        (conf, model, attributes, allLines, baselines, warmstart, tables),
+        clusters,
+        conf.getconf("RETRIES"),
+        finished,
+    )
+    solved = [value for status, value in coordinator.serve() if status == "done"]
+    return sum([s[1] for s in solved]), sum([s[2] for s in solved])
+
+
+def _RemoteSetup(conf, scratchroot, context):
+    remoteconf, model, attributes, allLines, baselines, warmstart, tables = context
+    _WorkerInit(
+        remoteconf,
+        model,
+        os.getcwd(),
+        scratchroot,
+        attributes,
+        allLines,
+        MakeCache(conf),
+        makerunner(
+            conf.getconf("RUNNER"), conf.getconf("SYNSPEC"), conf.getconf("RUNLOG")
+        ),
+        baselines,
+        warmstart,
+        tables,
+    )
+
+
+def _RemoteWork(conf, address, authkey):
+    with tempfile.TemporaryDirectory(prefix="aeqw") as scratchroot:
+        work(
+            address,
+            authkey.encode(),
+            lambda context: _RemoteSetup(conf, scratchroot, context),
+            lambda state, cluster: _WorkerSolve(cluster),
+        )
+
+
+# Run JOBS workers for the coordinator at address, till it has no jobs left.
+def aeqwworker(conf, address):
+    if conf.getconf("AUTHKEY") == "":
+        logger.error("AUTHKEY has to be set to that of the coordinator")
+        raise ValueError
+    if conf.getconf("JOBS") <= 1:
+        _RemoteWork(conf, address, conf.getconf("AUTHKEY"))
+        return
+    workers = [
+        multiprocessing.Process(
+            target=_RemoteWork, args=(conf, address, conf.getconf("AUTHKEY"))
+        )
+        for _ in range(conf.getconf("JOBS"))
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if any([worker.exitcode != 0 for worker in workers]):
+        logger.error("Some of the workers failed")
+        raise RuntimeError
+
+
+__all__ = ["SolveParallel", "SolveClusters", "SolveRemote", "aeqwworker"]
@@ -0,0 +1,194 @@
+# runner.py
+# -*- coding: utf-8 -*-
+# Backends which run SYNSPEC in a working directory.
+
+import os
+import shutil
+import signal
+import asyncio
+import collections
+import subprocess
+import logging
+
+logger = logging.getLogger("aeqw.runner")
+
+
+# Removes fort.16 so that the output of a previous run is not read in case
+# SYNSPEC does not run.
+def _clear16(workdir):
+    try:
+        os.remove(os.path.join(workdir, "fort.16"))
+    except FileNotFoundError:
+        pass
+
+
+# Common part of the runners, which are called with the model and the working
+# directory to run SYNSPEC, or awaited through arun. Subclasses give the command
+# and the file for its stdin in _prepare. If logsize is positive, the last
+# logsize lines written by SYNSPEC to stdout and stderr are kept in self.log,
+# and are logged when SYNSPEC fails.
+class Runner(object):
+    def __init__(self, logsize=0):
+        self.logsize = logsize
+        self.log = collections.deque(maxlen=logsize if logsize > 0 else 0)
+
+    def _prepare(self, model, workdir):
+        raise NotImplementedError
+
+    def _program(self):
+        raise NotImplementedError
+
+    # Undo what _prepare did to the working directory, once SYNSPEC has run.
+    def _cleanup(self, model, workdir):
+        pass
+
+    # Set up a scratch directory (see aeqw.isynspec.makescratch) for the runs
+    # of model, which is kept for as long as the directory.
+    def scratch(self, model, workdir):
+        pass
+
+    # Identity of what is run, which is part of the key of a cached run: the
+    # runner, and the path, size and modification time of its program, so that
+    # the runs of another SYNSPEC are not taken from the cache.
+    def identity(self):
+        program = shutil.which(self._program()) or self._program()
+        try:
+            st = os.stat(program)
+        except OSError:
+            return f"{type(self).__name__} {program}"
+        return f"{type(self).__name__} {os.path.realpath(program)} {st.st_size:d} {st.st_mtime_ns:d}"
+
+    def _output(self):
+        if self.logsize <= 0:
+            return subprocess.DEVNULL, subprocess.DEVNULL
+        return subprocess.PIPE, subprocess.STDOUT
+
+    def _finish(self, args, returncode, output):
+        if output is not None:
+            self.log.extend(output.decode(errors="replace").splitlines())
+        if returncode != 0:
+            logger.warning(
+                "   {0:s} exited with status {1:d}".format(args[0], returncode)
+            )
+            for line in self.log:
+                logger.warning("   | {0:s}".format(line))
+        return returncode
+
+    def __call__(self, model, workdir):
+        args, stdinfn = self._prepare(model, workdir)
+        stdout, stderr = self._output()
+        try:
+            with open(stdinfn) if stdinfn is not None else open(os.devnull) as stdin:
+                proc = subprocess.run(
+                    args, stdin=stdin, stdout=stdout, stderr=stderr, cwd=workdir
+                )
+        finally:
+            self._cleanup(model, workdir)
+        return self._finish(args, proc.returncode, proc.stdout)
+
+    # SYNSPEC is run in its own process group. If cancelled, the whole group is
+    # killed (so that a script does not leave SYNSPEC running) before the
+    # cancellation is passed on.
+    async def arun(self, model, workdir):
+        args, stdinfn = self._prepare(model, workdir)
+        stdout, stderr = self._output()
+        try:
+            with open(stdinfn) if stdinfn is not None else open(os.devnull) as stdin:
+                proc = await asyncio.create_subprocess_exec(
+                    *args,
+                    stdin=stdin,
+                    stdout=stdout,
+                    stderr=stderr,
+                    cwd=workdir,
+                    start_new_session=True,
+                )
+                try:
+                    output, _ = await proc.communicate()
+                except asyncio.CancelledError:
+                    try:
+                        os.killpg(proc.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                    await proc.wait()
+                    raise
+        finally:
+            self._cleanup(model, workdir)
+        return self._finish(args, proc.returncode, output)
+
+
+# Runs the RSynspec script with the name of the model, as done by earlier
+# versions of aeqw.
+class ScriptRunner(Runner):
+    def __init__(self, script="RSynspec", logsize=0):
+        super().__init__(logsize)
+        self.script = script
+
+    def _prepare(self, model, workdir):
+        logger.debug("   Running SYNSPEC: {0:s} {1:s}".format(self.script, model))
+        _clear16(workdir)
+        return [self.script, model], None
+
+    def _program(self):
+        return self.script
+
+
+# Runs the SYNSPEC executable directly, with the units wired up as RSynspec
+# does: the model atmosphere is linked to fort.8 and the input parameters of the
+# model are given on stdin. The link is kept in scratch directories, while in
+# any other working directory (such as the current one with JOBS=1) it is made
+# for the run and removed after it. A fort.8 there which is not that link is
+# not touched, and the run fails instead.
+class DirectRunner(Runner):
+    def __init__(self, executable="synspec", logsize=0):
+        super().__init__(logsize)
+        self.executable = executable
+        self._links = set()
+
+    def _prepare(self, model, workdir):
+        logger.debug(
+            "   Running SYNSPEC: {0:s} < {1:s}.5".format(self.executable, model)
+        )
+        _clear16(workdir)
+        if model != "fort":
+            unit8 = os.path.join(workdir, "fort.8")
+            if not os.path.islink(unit8) or os.readlink(unit8) != model + ".7":
+                if os.path.lexists(unit8):
+                    logger.error(
+                        "{0:s} is not a link to {1:s}.7, move it away to run SYNSPEC directly".format(
+                            unit8, model
+                        )
+                    )
+                    raise FileExistsError(unit8)
+                os.symlink(model + ".7", unit8)
+                self._links.add(unit8)
+        return [self.executable], os.path.join(workdir, model + ".5")
+
+    def _cleanup(self, model, workdir):
+        unit8 = os.path.join(workdir, "fort.8")
+        if unit8 in self._links:
+            self._links.discard(unit8)
+            try:
+                os.remove(unit8)
+            except FileNotFoundError:
+                pass
+
+    def scratch(self, model, workdir):
+        if model != "fort":
+            os.symlink(model + ".7", os.path.join(workdir, "fort.8"))
+
+    def _program(self):
+        return self.executable
+
+
+RUNNERS = {"rsynspec": ScriptRunner, "direct": DirectRunner}
+
+
+# Create the runner named by name, which runs the given script or executable
+# (the default of the runner if empty).
+def makerunner(name, executable="", logsize=0):
+    if executable:
+        return RUNNERS[name](executable, logsize)
+    return RUNNERS[name](logsize=logsize)
+
+
+__all__ = ["Runner", "ScriptRunner", "DirectRunner", "RUNNERS", "makerunner"]
@@ -0,0 +1,321 @@
+# solvers.py
+# -*- coding: utf-8 -*-
+# Solvers for the abundance giving a target equivalent width.
+
+import math
+import bisect
+import logging
+import numpy as np
+
+logger = logging.getLogger("aeqw.solvers")
+
+
+def Secant(x, f, y, epsilon):
+    if abs(f[-1] - f[-2]) < epsilon:
+        return -1
+    return (x[-2] * (f[-1] - y) - x[-1] * (f[-2] - y)) / (f[-1] - f[-2])
+
+
+# Abundance at which the curve of growth sampled by observations, a list of
+# (abundance, equivalent width), reaches the equivalent width target. The
+# logarithm of the abundance is fitted against that of the equivalent width by a
+# parabola through the three observations nearest to the target, or a line
+# between the two bracketing it if the parabola is not monotonic between them.
+# Returns None if the target is not within the widths observed, unless
+# extrapolate is set, in which case the line through the two nearest
+# observations is used (with a slope of 1 if there is only one).
+def CurveOfGrowthAbundance(observations, target, extrapolate=False):
+    points = {}
+    for abun, eqw in observations:
+        if eqw is not None and eqw > 0:
+            points.setdefault(math.log(eqw), math.log(abun))
+    if not points or target <= 0:
+        return None
+    x = math.log(target)
+    xs = sorted(points)
+    k = bisect.bisect_left(xs, x)
+    if k < len(xs) and xs[k] == x:
+        return math.exp(points[x])
+    if 0 < k < len(xs):
+        near = sorted(xs, key=lambda p: abs(p - x))[:3]
+        a, b = xs[k - 1], xs[k]
+        if len(near) == 3:
+            y = float(np.polyval(np.polyfit(near, [points[p] for p in near], 2), x))
+            if min(points[a], points[b]) <= y <= max(points[a], points[b]):
+                return math.exp(y)
+        return math.exp(points[a] + (points[b] - points[a]) * (x - a) / (b - a))
+    if not extrapolate:
+        return None
+    near = sorted(xs, key=lambda p: abs(p - x))[:2]
+    if len(near) == 1 or near[1] == near[0]:
+        return math.exp(points[near[0]] + x - near[0])
+    a, b = near
+    slope = (points[b] - points[a]) / (b - a)
+    return math.exp(points[a] + max(slope, 0.0) * (x - a))
+
+
+# The iterations of the solver. These are generators which start from the
+# abundance initabun, expected to be within spread dex of the answer if they
+# take a spread and it is not None (see StartSolver). They yield the abundance of the next trial, and are sent a list of (abundance, equivalent width, total
+# equivalent width) observations, of which the last is the trial asked for. The
+# equivalent width is None if SYNSPEC did not produce any output. They return
+# the result in case of an error, otherwise None with the abundance found and
+# the observation it is based on, once it is within epsilon (by default
+# EPSILON) of the target. They give up after MAXITER trials, or when the target
+# would need an abundance below NULLABUN.
+
+
+# Linear approximation of equivalent width against abundance, refined with the
+# secant method.
+def IterateLinear(conf, xeqw, initabun, epsilon=None):
+    if epsilon is None:
+        epsilon = conf.getconf("EPSILON")
+    trials = [initabun]
+    results = []
+    while not results or abs(results[-1] - xeqw) > epsilon:
+        if len(trials) > conf.getconf("MAXITER"):
+            return NotConverged(conf)
+        if trials[-1] < conf.getconf("NULLABUN"):
+            return BelowZero()
+        logger.debug(f" Running for abundance: {trials[-1]:e}, target width: {xeqw:f}")
+        observations = yield trials[-1]
+        results.append(observations[-1][1])
+        if results[-1] is None or (
+            results[-1] >= 0 and results[-1] < xeqw / 10
+        ):  # Limiting our increase by a factor of ten
+            if trials[-1] < 0.1:
+                logger.debug("Negligible width detected, multiplying abundance by 10")
+                trials.append(trials[-1] * 10)
+                continue
+            else:
+                logger.warning("No line Detected")
+                return {"result": "error", "message": "No line Detected."}, None, None
+        elif results[-1] * xeqw < 0:
+            logger.warning("eqw * xeqw < 0")
+            if trials[-1] > 0.1:
+                result = {
+                    "result": "error",
+                    "message": "Line Strength Insufficient with Emmision/Absorbtion mismatch",
+                }
+            else:
+                result = {
+                    "result": "error",
+                    "message": "Emmision/Absorption mismatch",
+                }
+            return result, None, None
+        else:
+            logger.debug(
+                f"  Guess = {trials[-1]:e}, Result = {results[-1]:f}, Target = {xeqw:f}, Diff = {xeqw - results[-1]:f}, Epsilon = {epsilon:f}"
+            )
+            if len(results) < 2 or all(
+                [not (i is None or (i >= 0 and i < xeqw / 10)) for i in results[-2:]]
+            ):  # Checking if last two runs gave a valid result
+                trials.append(xeqw * trials[-1] / results[-1])
+                logger.debug(
+                    f" Using linear approximation for new guess: {trials[-1]:e}"
+                )
+            else:
+                trials.append(Secant(trials, results, xeqw, epsilon))
+                if trials[-1] < 0:
+                    trials[-1] = xeqw * trials[-2] / results[-1]
+                    logger.debug(
+                        f" Using linear approximation for new guess: {trials[-1]:e}"
+                    )
+                else:
+                    logger.debug(f" Using secant method for new guess: {trials[-1]:e}")
+        if trials[-1] > 1.0:
+            logger.warning("Line Strength Insufficient")
+            return (
+                {
+                    "result": "error",
+                    "message": "Line Strength Insufficient. Manual Examination suggested.",
+                },
+                None,
+                None,
+            )
+    return None, trials[-1], observations[-1]
+
+
+# Root finding on the curve of growth, i.e. equivalent width against log
+# abundance. Until the target is bracketed the next trial is extrapolated along
+# the curve of growth. Afterwards inverse quadratic interpolation is used,
+# safeguarded by the secant and bisection methods as in Brent's method. All the
+# observations sent are used, not just the trials asked for. If the spread of
+# the first trial is known the second trial is at least that far from it, so
+# that it is likely to bracket the target.
+def IterateBracket(conf, xeqw, initabun, spread=None, epsilon=None):
+    if epsilon is None:
+        epsilon = conf.getconf("EPSILON")
+    sign = 1 if xeqw > 0 else -1
+    points = []  # (log abundance, sign * (eqw - xeqw)) of all the observations
+    steps = []  # Steps taken within the bracket
+    x = math.log10(initabun)
+    floor = math.log10(conf.getconf("NULLABUN"))
+    ntrials = 0
+    while True:
+        if ntrials == conf.getconf("MAXITER"):
+            return NotConverged(conf)
+        ntrials += 1
+        if x > 0:
+            logger.warning("Line Strength Insufficient")
+            return (
+                {
+                    "result": "error",
+                    "message": "Line Strength Insufficient. Manual Examination suggested.",
+                },
+                None,
+                None,
+            )
+        logger.debug(f" Running for abundance: {10 ** x:e}, target width: {xeqw:f}")
+        observations = yield 10**x
+        observations = [
+            (abun, 0.0 if eqw is None else eqw, alleqw)
+            for abun, eqw, alleqw in observations
+        ]
+        for abun, eqw, _ in observations:
+            logger.debug(
+                f"  Guess = {abun:e}, Result = {eqw:f}, Target = {xeqw:f}, Diff = {xeqw - eqw:f}, Epsilon = {epsilon:f}"
+            )
+        observation = min(observations, key=lambda o: abs(o[1] - xeqw))
+        if abs(observation[1] - xeqw) <= epsilon:
+            return None, observation[0], observation
+        abun, eqw, _ = observations[-1]
+        if sign * eqw < 0:
+            logger.warning("eqw * xeqw < 0")
+            if abun > 0.1:
+                result = {
+                    "result": "error",
+                    "message": "Line Strength Insufficient with Emmision/Absorbtion mismatch",
+                }
+            else:
+                result = {
+                    "result": "error",
+                    "message": "Emmision/Absorption mismatch",
+                }
+            return result, None, None
+        points.extend(
+            [(math.log10(abun), sign * (eqw - xeqw)) for abun, eqw, _ in observations]
+        )
+        below = [p for p in points if p[1] < 0]
+        above = [p for p in points if p[1] > 0]
+
+        nearest = min(points, key=lambda p: abs(p[1]))
+        if below and above:
+            x = NextBracketed(points, max(below), min(above), steps)
+        elif nearest[1] < abs(xeqw) / 10 - abs(xeqw):
+            x = max(points)[0]
+            if 10**x >= 0.1:
+                logger.warning("No line Detected")
+                return {"result": "error", "message": "No line Detected."}, None, None
+            logger.debug("Negligible width detected, multiplying abundance by 10")
+            x += 1
+        else:
+            step = Extrapolate(points, xeqw) - x
+            if spread is not None and len(points) == 1:
+                step = math.copysign(max(abs(step), spread), step)
+            x += step
+            # The target is not reached above the null abundance if even the
+            # lowest trial is too wide, e.g. for a blend or a bad zero
+            if x < floor:
+                if min(points)[0] <= floor:
+                    return BelowZero()
+                x = floor
+            logger.debug(f" Extrapolating curve of growth for new guess: {10 ** x:e}")
+
+
+# Results of the solvers when the target is below the width left at the null
+# abundance, and when they run out of trials.
+def BelowZero():
+    logger.warning("Target below blend/zero")
+    return (
+        {
+            "result": "error",
+            "message": "Target below blend/zero. Manual Examination suggested.",
+        },
+        None,
+        None,
+    )
+
+
+def NotConverged(conf):
+    logger.warning(f"No convergence in {conf.getconf('MAXITER')} trials")
+    return (
+        {
+            "result": "error",
+            "message": f"No convergence in {conf.getconf('MAXITER')} trials.",
+        },
+        None,
+        None,
+    )
+
+
+# Next trial along the curve of growth from the observation nearest to the
+# target. The slope of log eqw against log abundance is 1 on the linear part
+# and decreases as the line saturates; it is estimated from the two nearest
+# observations.
+def Extrapolate(points, xeqw):
+    valid = sorted([p for p in points if p[1] + abs(xeqw) > 0], key=lambda p: abs(p[1]))
+    x1, y1 = valid[0][0], math.log10(valid[0][1] + abs(xeqw))
+    slope = 1.0
+    others = [p for p in valid[1:] if p[0] != x1]
+    if others:
+        x0, y0 = others[0][0], math.log10(others[0][1] + abs(xeqw))
+        slope = min(max((y1 - y0) / (x1 - x0), 0.05), 1.0)
+    step = (math.log10(abs(xeqw)) - y1) / slope
+    return x1 + min(max(step, -2.0), 2.0)
+
+
+# Next trial within the bracket (lo, hi), interpolating through the three
+# observations nearest to the target. As in Brent's method, the step is
+# rejected in favour of bisection when it leaves the bracket or is not at least
+# half as small as the one before last.
+def NextBracketed(points, lo, hi, steps):
+    a, b = lo[0], hi[0]
+    x = None
+    nearest = sorted(points, key=lambda p: abs(p[1]))[:3]
+    if len(nearest) == 3 and len(set([p[1] for p in nearest])) == 3:
+        (x0, f0), (x1, f1), (x2, f2) = nearest
+        x = (
+            x0 * f1 * f2 / ((f0 - f1) * (f0 - f2))
+            + x1 * f0 * f2 / ((f1 - f0) * (f1 - f2))
+            + x2 * f0 * f1 / ((f2 - f0) * (f2 - f1))
+        )
+        method = "inverse quadratic interpolation"
+    if x is None or not min(a, b) < x < max(a, b):
+        x = a - lo[1] * (b - a) / (hi[1] - lo[1])
+        method = "secant method"
+    if not min(a, b) < x < max(a, b) or (
+        len(steps) > 1 and abs(x - nearest[0][0]) > steps[-2] / 2
+    ):
+        x = (a + b) / 2
+        method = "bisection"
+    steps.append(abs(x - nearest[0][0]))
+    logger.debug(f" Using {method} for new guess: {10 ** x:e}")
+    return x
+
+
+Iterate = {"linear": IterateLinear, "bracket": IterateBracket}
+
+
+# The iteration of the solver SOLVER for the target xeqw from seed, a pair of
+# the initial abundance and its spread (or None). Only the bracket solver makes
+# use of the spread; the linear solver takes its second trial from the width
+# of the first whatever the spread.
+def StartSolver(conf, xeqw, seed, epsilon=None):
+    if conf.getconf("SOLVER") == "bracket":
+        return IterateBracket(conf, xeqw, *seed, epsilon=epsilon)
+    return Iterate[conf.getconf("SOLVER")](conf, xeqw, seed[0], epsilon=epsilon)
+
+
+__all__ = [
+    "Secant",
+    "CurveOfGrowthAbundance",
+    "IterateLinear",
+    "IterateBracket",
+    "BelowZero",
+    "NotConverged",
+    "Extrapolate",
+    "NextBracketed",
+    "Iterate",
+    "StartSolver",
+]
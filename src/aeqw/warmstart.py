@@ -0,0 +1,109 @@
+# warmstart.py
+# -*- coding: utf-8 -*-
+# Database of converged abundances used to seed the first trials of the solver.
+
+import os
+import json
+import math
+import statistics
+import tempfile
+import logging
+
+logger = logging.getLogger("aeqw.warmstart")
+
+
+# Converged log abundances of line groups, stored for each model (identified by
+# the hash of its files) under the ion and the wavelengths of the lines. A group
+# is seeded from its own previous result if there is one, otherwise from the
+# median of the results of its ion, or failing that of its element. The spread
+# (in dex) is how far the answer is expected to be from the seed.
+class WarmStart(object):
+    linespread = 0.05
+    minspread = 0.05
+    maxspread = 1.0
+
+    def __init__(self, fn, model):
+        self.fn = fn
+        self.model = model
+        try:
+            with open(fn) as f:
+                self.db = json.load(f)
+            logger.debug("Read warm start database {0:s}".format(fn))
+        except FileNotFoundError:
+            self.db = {}
+        except ValueError:
+            logger.warning("Ignoring corrupt warm start database {0:s}".format(fn))
+            self.db = {}
+        self.ions = self.db.setdefault(model, {})
+
+    @staticmethod
+    def _ion(testLine):
+        return "{0:d}.{1:0>2d}".format(testLine[0].Z, testLine[0].Q)
+
+    @staticmethod
+    def _line(testLine):
+        return ",".join(["{0:.4f}".format(line.ALAM) for line in testLine])
+
+    # Returns the seed abundance and its spread, or None if nothing is known.
+    def seed(self, testLine):
+        ion = self.ions.get(self._ion(testLine), {})
+        if self._line(testLine) in ion:
+            return 10 ** ion[self._line(testLine)], self.linespread
+        logabuns = list(ion.values())
+        if not logabuns:
+            logabuns = [
+                logabun
+                for key, lines in self.ions.items()
+                if int(key.split(".")[0]) == testLine[0].Z
+                for logabun in lines.values()
+            ]
+        if not logabuns:
+            return None
+        spread = self.maxspread
+        if len(logabuns) > 1:
+            spread = min(max(statistics.stdev(logabuns), self.minspread), spread)
+        return 10 ** statistics.median(logabuns), spread
+
+    def add(self, testLine, abun):
+        self.ions.setdefault(self._ion(testLine), {})[self._line(testLine)] = (
+            math.log10(abun)
+        )
+
+    # The database is merged into the file as it is now, so that the results
+    # saved by other processes since it was read are kept, except for the
+    # groups solved here.
+    def save(self):
+        logger.debug("Writing warm start database {0:s}".format(self.fn))
+        try:
+            with open(self.fn) as f:
+                db = json.load(f)
+        except (FileNotFoundError, ValueError):
+            db = {}
+        for model, ions in self.db.items():
+            for ion, lines in ions.items():
+                db.setdefault(model, {}).setdefault(ion, {}).update(lines)
+        fd, tmpfn = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.fn)), suffix=".tmp"
+        )
+        with os.fdopen(fd, "w") as f:
+            json.dump(db, f)
+        os.replace(tmpfn, self.fn)
+
+
+# Abundances given for line groups, keyed as the groups of WarmStart, which are
+# all taken to be within spread dex of the answer. It can seed the solver in
+# place of WarmStart.
+class Seeds(dict):
+    def __init__(self, spread):
+        super().__init__()
+        self.spread = spread
+
+    def seed(self, testLine):
+        abun = self.get(WarmStart._line(testLine))
+        return None if abun is None else (abun, self.spread)
+
+    def add(self, testLine, abun):
+        self[WarmStart._line(testLine)] = abun
+
+
+__all__ = ["WarmStart", "Seeds"]
@@ -0,0 +1,158 @@
+# workqueue.py
+# -*- coding: utf-8 -*-
+# Queue of jobs served to workers over a socket.
+
+import os
+import time
+import threading
+import logging
+from multiprocessing.connection import Listener, Client
+
+logger = logging.getLogger("aeqw.workqueue")
+
+
+# Addresses are given as host:port for TCP, otherwise as the path of a Unix
+# socket.
+def parseaddress(address):
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return host, int(port)
+    return address
+
+
+# Serves jobs to the workers which connect to address, first sending each of
+# them the context. A worker is sent one job at a time and replies with its
+# result. The job of a worker which disconnects, or fails to do it, is given
+# to another worker, up to retries times. If given, callback is called with the
+# index and result of every job as soon as it is finished.
+class Coordinator(object):
+    def __init__(self, address, authkey, context, jobs, retries=2, callback=None):
+        self.address = parseaddress(address)
+        self.authkey = authkey
+        self.context = context
+        self.jobs = jobs
+        self.retries = retries
+        self.callback = callback
+        self.pending = list(range(len(jobs)))
+        self.attempts = [0] * len(jobs)
+        self.results = [None] * len(jobs)
+        self.finished = 0
+        self.closed = False
+        self.lock = threading.Condition()
+
+    # Serve the jobs till all are finished. Returns for each job ("done",
+    # result) or ("failed", message) if it could not be done.
+    def serve(self):
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+        listener = Listener(self.address, authkey=self.authkey)
+        logger.info(
+            "Serving {0:d} jobs at {1}".format(len(self.jobs), listener.address)
+        )
+        threading.Thread(target=self._accept, args=(listener,), daemon=True).start()
+        with self.lock:
+            while self.finished < len(self.jobs):
+                self.lock.wait()
+        self.closed = True
+        listener.close()
+        return self.results
+
+    def _accept(self, listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as err:  # Such as a failed authentication
+                if self.closed:
+                    return
+                logger.warning("Refused connection: {0}".format(err))
+                continue
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    # Take a pending job, waiting while others are still being done in case
+    # they have to be retried. Returns None once all are finished.
+    def _take(self):
+        with self.lock:
+            while not self.pending and self.finished < len(self.jobs):
+                self.lock.wait()
+            if not self.pending:
+                return None
+            n = self.pending.pop(0)
+            self.attempts[n] += 1
+            return n
+
+    def _finish(self, n, result):
+        with self.lock:
+            self.results[n] = result
+            self.finished += 1
+            if self.callback is not None:
+                self.callback(n, result)
+            self.lock.notify_all()
+
+    def _fail(self, n, message):
+        logger.warning("Job {0:d} failed: {1:s}".format(n, message))
+        with self.lock:
+            if self.attempts[n] > self.retries:
+                self.results[n] = ("failed", message)
+                self.finished += 1
+                if self.callback is not None:
+                    self.callback(n, self.results[n])
+            else:
+                self.pending.insert(0, n)
+            self.lock.notify_all()
+
+    def _handle(self, conn):
+        n = None
+        try:
+            name = conn.recv()
+            logger.info("Worker {0} connected".format(name))
+            conn.send(self.context)
+            while True:
+                n = self._take()
+                conn.send(None if n is None else (n, self.jobs[n]))
+                if n is None:
+                    break
+                status, value = conn.recv()
+                if status == "done":
+                    self._finish(n, (status, value))
+                else:
+                    self._fail(n, value)
+                n = None
+        except (EOFError, OSError):
+            if n is not None:
+                self._fail(n, "worker disconnected")
+        finally:
+            conn.close()
+
+
+# Connect to the coordinator at address and do jobs till there are none left.
+# setup is called with the context to give the state passed to do with each
+# job. The coordinator is waited for up to wait seconds.
+def work(address, authkey, setup, do, wait=30):
+    address = parseaddress(address)
+    for attempt in range(wait + 1):
+        try:
+            conn = Client(address, authkey=authkey)
+            break
+        except (ConnectionRefusedError, FileNotFoundError):
+            if attempt == wait:
+                raise
+            time.sleep(1)
+    with conn:
+        conn.send("{0:s}:{1:d}".format(os.uname().nodename, os.getpid()))
+        state = setup(conn.recv())
+        while True:
+            try:
+                job = conn.recv()
+            except EOFError:  # The coordinator finished without saying so
+                break
+            if job is None:
+                break
+            n, job = job
+            try:
+                conn.send(("done", do(state, job)))
+            except Exception as err:
+                logger.exception("Job {0:d} failed".format(n))
+                conn.send(("error", "{0:s}: {1}".format(type(err).__name__, err)))
+
+
+__all__ = ["parseaddress", "Coordinator", "work"]
@@ -0,0 +1,128 @@
+# writers.py
+# -*- coding: utf-8 -*-
+# Output formats written while the line groups are being solved.
+
+import csv
+import json
+import logging
+
+logger = logging.getLogger("aeqw.writers")
+
+
+# Common part of the streaming writers. testLines are the entries of the input
+# (comments as strings, line groups as (lines, target)), and the result of each
+# line group is written as soon as it is given, with its index in testLines. A
+# comment is written once everything before it in the input has been, so that
+# comments keep their order and come after the groups they follow.
+class StreamWriter(object):
+    def __init__(self, fn, header, testLines):
+        self.f = open(fn, "w", newline="")
+        self.header = header
+        self.testLines = testLines
+        self.written = [False] * len(testLines)
+        self.next = 0
+        self.writeheader()
+        self._flushcomments()
+
+    def _flushcomments(self):
+        while self.next < len(self.testLines) and (
+            self.written[self.next] or type(self.testLines[self.next]) == str
+        ):
+            if not self.written[self.next]:
+                self.writecomment(self.next, self.testLines[self.next].rstrip("\n"))
+                self.written[self.next] = True
+            self.next += 1
+        self.f.flush()
+
+    # Write the result of the line group at index i of testLines.
+    def write(self, i, abundance):
+        testLine, target = self.testLines[i]
+        self.writeline(
+            i,
+            target,
+            abundance,
+            [
+                {"wavelength": line.ALAM, "ion": f"{line.Z: >2d}.{line.Q:0>2d}"}
+                for line in testLine
+            ],
+        )
+        self.written[i] = True
+        self._flushcomments()
+
+    def close(self):
+        self.f.close()
+
+
+# One JSON record per line, the first being the header. The records of comments
+# and line groups are those of the json format, with their index in the input.
+class NDJSONWriter(StreamWriter):
+    def _record(self, record):
+        self.f.write(json.dumps(record) + "\n")
+
+    def writeheader(self):
+        self._record(dict(self.header, type="header"))
+
+    def writecomment(self, i, value):
+        self._record({"type": "comment", "index": i, "value": value})
+
+    def writeline(self, i, target, abundance, lines):
+        self._record(
+            {
+                "type": "line",
+                "index": i,
+                "target": target,
+                "abundance": abundance,
+                "lines": lines,
+            }
+        )
+
+
+# A row for every comment and line group. The wavelengths and ions of the lines
+# of a group are separated by spaces.
+class CSVWriter(StreamWriter):
+    columns = (
+        "model",
+        "temperature",
+        "logg",
+        "index",
+        "type",
+        "wavelength",
+        "ion",
+        "target",
+        "result",
+        "relabun",
+        "logabun",
+        "wingpercent",
+        "message",
+        "relabun_lo",
+        "relabun_hi",
+    )
+
+    def writeheader(self):
+        self.writer = csv.DictWriter(self.f, self.columns, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def _row(self, row):
+        self.writer.writerow(
+            dict(row, **{c: self.header.get(c) for c in self.columns[:3]})
+        )
+
+    def writecomment(self, i, value):
+        self._row({"index": i, "type": "comment", "message": value})
+
+    def writeline(self, i, target, abundance, lines):
+        self._row(
+            dict(
+                abundance,
+                index=i,
+                type="line",
+                wavelength=" ".join([f"{line['wavelength']:.4f}" for line in lines]),
+                ion=" ".join([line["ion"].strip() for line in lines]),
+                target=target,
+            )
+        )
+
+
+streamwriter = {"ndjson": NDJSONWriter, "csv": CSVWriter}
+
+__all__ = ["StreamWriter", "NDJSONWriter", "CSVWriter", "streamwriter"]
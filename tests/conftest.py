@@ -0,0 +1,51 @@
+# Inputs solved by aeqw with the fake SYNSPEC of aeqw.fakesynspec.
+
+import json
+
+import pytest
+
+from aeqw.config import Config
+from aeqw.drivers import aeqw
+from aeqw.output import outputformatter
+from aeqw.writers import streamwriter
+from aeqw.benchmark import MODEL, makeinputs
+
+
+# A function solving the inputs of the benchmark of ngroups line groups, made in
+# a scratch directory which is the current one, with the given parameters.
+# The output is written in the format OUTFMT (json by default). Returns the runs
+# of SYNSPEC and the line groups of the output if it is json or ndjson, with the
+# contents of the output under "output".
+@pytest.fixture
+def solve(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def solve(ngroups=6, outfn="aeqw.json", **params):
+        if not (tmp_path / "aeqw.in").exists():
+            makeinputs(str(tmp_path), ngroups)
+        conf = Config()
+        conf["aeqw"].update(
+            {
+                "OUTFN": outfn,
+                "OUTFMT": "json",
+                "SYNSPEC": str(tmp_path / "RSynspec"),
+                **{param: str(value) for param, value in params.items()},
+            }
+        )
+        runs, cached = aeqw(
+            conf,
+            MODEL,
+            outputformatter.get(conf.getconf("OUTFMT")),
+            streamwriter.get(conf.getconf("OUTFMT")),
+        )
+        with open(outfn) as f:
+            output = f.read()
+        rows = []
+        if conf.getconf("OUTFMT") == "json":
+            rows = [row for row in json.loads(output)[1] if row["type"] == "line"]
+        elif conf.getconf("OUTFMT") == "ndjson":
+            rows = [json.loads(record) for record in output.splitlines()]
+            rows = [row for row in rows if row["type"] == "line"]
+        return {"runs": runs, "cached": cached, "rows": rows, "output": output}
+
+    return solve
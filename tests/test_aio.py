@@ -0,0 +1,57 @@
+# Line groups solved with aeqw.aio, or by the daemon for aeqw.client, give the
+# results of aeqw.
+
+import os
+import sys
+import time
+import asyncio
+import subprocess
+
+from aeqw.aio import makeconfig, solve_groups
+from aeqw.cluster import ReadInput
+from aeqw.benchmark import MODEL
+from aeqw.client import request
+
+
+def test_solve_groups_match_aeqw(solve, tmp_path):
+    expected = solve()["rows"]
+    options = {"SYNSPEC": str(tmp_path / "RSynspec"), "JOBS": 2}
+    allLines, testLines = ReadInput(makeconfig(options))
+    groups = [tl for tl in testLines if type(tl) != str]
+    files = sorted(os.listdir(tmp_path))
+
+    async def collect():
+        return [
+            (i, result)
+            async for i, result in solve_groups(MODEL, groups, options, allLines)
+        ]
+
+    solved = dict(asyncio.run(collect()))
+    assert sorted(solved) == list(range(len(expected)))
+    for i, row in enumerate(expected):
+        solved[i].pop("stats", None)
+        assert solved[i] == row["abundance"]
+    assert sorted(os.listdir(tmp_path)) == files
+
+
+def test_daemon_matches_aeqw(solve, tmp_path):
+    expected = solve()["output"]
+    (tmp_path / "aeqw.conf").write_text(
+        f"[aeqw]\nSYNSPEC = {tmp_path / 'RSynspec'}\nOUTFMT = json\n"
+    )
+    path = str(tmp_path / "daemon.sock")
+    daemon = subprocess.Popen(
+        [sys.executable, "-m", "aeqw.daemon", "--socket", path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.1)
+        assert request([MODEL, "--outfn", "daemon.json"], path) == 0
+    finally:
+        daemon.terminate()
+        daemon.wait(10)
+    assert (tmp_path / "daemon.json").read_text() == expected
@@ -0,0 +1,71 @@
+# Zero baselines are only shared with clusters whose runs are binned alike, and
+# the runs of clusters are binned as the baselines so that they are shared.
+
+import numpy as np
+import pytest
+from aeqw.fakesynspec import Line, synthesize
+from aeqw.eqw import boxsums
+from aeqw.config import Config
+from aeqw.cluster import SameGrid, SnapWindow
+from aeqw.benchmark import runbenchmark
+
+WIDTHS = (0.3, 10.0)  # BROAD and RANGE
+TARGET = Line(500.0, 26, 0.0, 1.0)
+BLEND = Line(500.03, 8, 0.5, 1.0)  # Straddling the edge of the box of TARGET
+
+
+# The bins of a null run of the element of TARGET over (alam0, alam1).
+def null(alam0, alam1):
+    return np.array(
+        synthesize([TARGET, BLEND], {26: 1e-30}, 10000.0, alam0, alam1, 0.01, 2.0)
+    )
+
+
+def zero(bins):
+    box = (TARGET.ALAM * 10 - WIDTHS[0], TARGET.ALAM * 10 + WIDTHS[0])
+    return boxsums(bins, [box])[0]
+
+
+def test_offset_baseline_is_not_shared():
+    own = null(4990.0, 5010.0)
+    baseline = null(4985.5, 5030.0)
+    assert zero(baseline) != pytest.approx(zero(own), abs=1e-3)
+    assert not SameGrid([[TARGET]], baseline, own, WIDTHS)
+
+
+def test_aligned_baseline_is_shared():
+    own = null(4990.0, 5010.0)
+    baseline = null(4980.0, 5030.0)
+    assert zero(baseline) == pytest.approx(zero(own), abs=1e-6)
+    assert SameGrid([[TARGET]], baseline, own, WIDTHS)
+
+
+def test_snapped_window_shares_baseline():
+    baseline = null(4985.5, 5030.0)
+    own = null(*SnapWindow(baseline, 4990.0, 5010.0))
+    assert zero(baseline) == pytest.approx(zero(own), abs=1e-6)
+    assert SameGrid([[TARGET]], baseline, own, WIDTHS)
+
+
+# The benchmark (with the fake SYNSPEC) solved with the given parameters.
+def bench(**params):
+    conf = Config()
+    conf["aeqw"].update(
+        {
+            "OUTFN": "bench.json",
+            "OUTFMT": "json",
+            "MANIFEST": "",
+            "CACHE": "False",
+            "SOLVER": "bracket",
+            **params,
+        }
+    )
+    return runbenchmark(conf, 10)
+
+
+def test_baselines_save_runs():
+    own = bench()
+    shared = bench(BASELINEWIDTH="2000")
+    assert shared["failures"] == own["failures"] == 0
+    assert shared["runs"] < own["runs"]
+    assert shared["maxerror"] < 0.001
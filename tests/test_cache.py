@@ -0,0 +1,12 @@
+# Solving the same input again with CACHE takes every run from the cache.
+
+
+def test_rerun_from_cache(solve, tmp_path):
+    first = solve(CACHE=True, CACHEDIR=tmp_path / "cache")
+    assert first["runs"] > 0
+    assert first["cached"] == 0
+    # SYNSPEC cannot be run any more, without changing the key of the runs
+    (tmp_path / "RSynspec").chmod(0o644)
+    again = solve(CACHE=True, CACHEDIR=tmp_path / "cache")
+    assert again["cached"] == again["runs"] == first["runs"]
+    assert again["output"] == first["output"]
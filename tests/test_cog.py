@@ -0,0 +1,39 @@
+# Line groups solved from the curves of growth agree with those solved directly.
+
+import aeqw.cog
+
+
+def test_wing_from_run(solve):
+    direct = solve()
+    first = solve(COGTABLE="cog.npz")
+    again = solve(COGTABLE="cog.npz")
+    assert first["runs"] > direct["runs"]
+    assert again["runs"] < direct["runs"]
+    for rows in (first["rows"], again["rows"]):
+        for row, expected in zip(rows, direct["rows"]):
+            assert row["abundance"]["result"] == "success"
+            assert (
+                abs(row["abundance"]["logabun"] - expected["abundance"]["logabun"])
+                < 0.01
+            )
+            assert (
+                abs(
+                    row["abundance"]["wingpercent"]
+                    - expected["abundance"]["wingpercent"]
+                )
+                < 0.5
+            )
+
+
+def test_miss_reported(solve, monkeypatch):
+    solve(COGTABLE="cog.npz")
+    interpolate = aeqw.cog.CurveOfGrowthAbundance
+    monkeypatch.setattr(
+        aeqw.cog,
+        "CurveOfGrowthAbundance",
+        lambda *args: None if interpolate(*args) is None else interpolate(*args) * 1.2,
+    )
+    missed = solve(COGTABLE="cog.npz", COGVERIFY=False)
+    assert all([row["abundance"]["result"] == "error" for row in missed["rows"]])
+    solved = solve(COGTABLE="cog.npz")
+    assert all([row["abundance"]["result"] == "success" for row in solved["rows"]])
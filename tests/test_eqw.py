@@ -0,0 +1,27 @@
+# fort.16 is read whatever notation SYNSPEC writes its numbers in.
+
+import numpy as np
+
+from aeqw.eqw import readbins
+
+
+def test_plain(tmp_path):
+    fn = tmp_path / "fort.16"
+    fn.write_text(" 5000.00  5000.05  1.25E-03  0.9\n 5000.05  5000.10  0.5  0.8\n")
+    assert np.allclose(
+        readbins(str(fn)), [[5000.0, 5000.05, 1.25e-3], [5000.05, 5000.1, 0.5]]
+    )
+
+
+def test_fortran_exponents(tmp_path):
+    fn = tmp_path / "fort.16"
+    fn.write_text(" 5000.00  5000.05  1.25D-03  0.9\n 5000.05  5000.10  2.5-04  0.8\n")
+    assert np.allclose(
+        readbins(str(fn)), [[5000.0, 5000.05, 1.25e-3], [5000.05, 5000.1, 2.5e-4]]
+    )
+
+
+def test_empty(tmp_path):
+    fn = tmp_path / "fort.16"
+    fn.write_text("\n")
+    assert readbins(str(fn)).shape == (0, 3)
@@ -0,0 +1,29 @@
+# Every model of a grid gets the results of the model solved alone.
+
+import json
+import shutil
+
+from aeqw.config import Config
+from aeqw.grid import aeqwgrid
+from aeqw.output import outputjson
+from aeqw.benchmark import MODEL
+
+
+def test_grid_matches_single_model(solve, tmp_path):
+    expected = solve()["rows"]
+    for ext in (".5", ".7"):
+        shutil.copy(tmp_path / (MODEL + ext), tmp_path / ("copy" + ext))
+    conf = Config()
+    conf["aeqw"].update(
+        {"OUTFN": "grid.json", "SYNSPEC": str(tmp_path / "RSynspec"), "JOBS": "2"}
+    )
+    aeqwgrid(conf, [MODEL, "copy"], outputjson)
+    with open("grid.json") as f:
+        header, entries = json.load(f)
+    assert [model["model"] for model in header["models"]] == [MODEL, "copy"]
+    rows = [entry for entry in entries if entry["type"] == "line"]
+    assert len(rows) == len(expected)
+    for row, single in zip(rows, expected):
+        for abundance in row["abundances"]:
+            assert abundance["result"] == "success"
+            assert abs(abundance["logabun"] - single["abundance"]["logabun"]) < 0.01
@@ -0,0 +1,51 @@
+# Line lists are parsed once and memory mapped from their sidecar afterwards,
+# as long as the list is not changed.
+
+import os
+
+import pytest
+
+import aeqw.linelist
+from aeqw.linelist import readlinelist
+from aeqw.config import Config
+from aeqw.cluster import ReadInput
+from aeqw.benchmark import makeline
+
+
+@pytest.fixture
+def linelist(tmp_path, monkeypatch):
+    monkeypatch.setattr(aeqw.linelist, "_stores", {})
+    rows = [makeline(alam, 26, 2, -1.0, 1000.0)[1] for alam in (500.2, 500.1, 500.3)]
+    fn = tmp_path / "lines.19"
+    fn.write_text("# Iron\n\n" + "".join([row + "\n" for row in rows]))
+    return str(fn), sorted(rows)
+
+
+def test_sidecar_reused(linelist, monkeypatch):
+    fn, rows = linelist
+    store = readlinelist(fn)
+    assert [str(line) for line in store] == rows
+    assert os.path.exists(fn + ".npy") and os.path.exists(fn + ".npy.key")
+
+    def parseline(row):
+        raise AssertionError("parsed again")
+
+    monkeypatch.setattr(aeqw.linelist, "parseline", parseline)
+    monkeypatch.setattr(aeqw.linelist, "_stores", {})
+    assert [str(line) for line in readlinelist(fn)] == rows
+
+
+def test_sidecar_replaced_when_changed(linelist):
+    fn, rows = linelist
+    readlinelist(fn)
+    extra = makeline(499.0, 8, 2, 0.0, 0.0)[1]
+    with open(fn, "a") as f:
+        f.write(extra + "\n")
+    assert [str(line) for line in readlinelist(fn)] == [extra] + rows
+
+
+def test_lines_of_input_written_once(solve, tmp_path):
+    expected = solve()["output"]
+    allLines, _ = ReadInput(Config())
+    (tmp_path / "lines.19").write_text("".join([f"{line}\n" for line in allLines]))
+    assert solve(LINELISTFN=tmp_path / "lines.19")["output"] == expected
@@ -0,0 +1,17 @@
+# Results recorded in the manifest are resumed only for the same parameters.
+
+
+def test_resume_skips_solved(solve):
+    first = solve(MANIFEST="manifest.db")
+    resumed = solve(MANIFEST="manifest.db", RESUME=True)
+    assert first["runs"] > 0
+    assert resumed["runs"] == 0
+    assert resumed["rows"] == first["rows"]
+
+
+def test_failures_not_resumed_with_more_trials(solve):
+    failed = solve(MANIFEST="manifest.db", MAXITER=1)
+    assert all([row["abundance"]["result"] == "error" for row in failed["rows"]])
+    solved = solve(MANIFEST="manifest.db", RESUME=True, MAXITER=50)
+    assert solved["runs"] > 0
+    assert all([row["abundance"]["result"] == "success" for row in solved["rows"]])
@@ -0,0 +1,23 @@
+# Formatting of the abundances in the text output.
+
+from aeqw.output import AbunTxt
+
+
+def test_wing_below_zero():
+    for wingpercent in (-0.0, -0.3, -1e-12):
+        txt = AbunTxt(
+            {
+                "result": "success",
+                "relabun": 1.0,
+                "logabun": 7.5,
+                "wingpercent": wingpercent,
+            }
+        )
+        assert txt.endswith("   0%")
+
+
+def test_wing_rounding():
+    txt = AbunTxt(
+        {"result": "success", "relabun": 1.0, "logabun": 7.5, "wingpercent": -2.6}
+    )
+    assert txt.endswith("  -3%")
@@ -0,0 +1,39 @@
+# Line groups solved in worker processes, by remote workers, or in clusters give
+# the output of the groups solved one by one.
+
+import threading
+
+from aeqw.config import Config
+from aeqw.parallel import aeqwworker
+
+
+def test_jobs_match_serial(solve):
+    serial = solve()
+    parallel = solve(JOBS=2)
+    assert parallel["runs"] == serial["runs"]
+    assert parallel["output"] == serial["output"]
+
+
+def test_remote_workers_match_serial(solve, tmp_path):
+    serial = solve()
+    address = str(tmp_path / "aeqw.sock")
+    conf = Config()
+    conf["aeqw"].update({"SYNSPEC": str(tmp_path / "RSynspec"), "AUTHKEY": "test"})
+    worker = threading.Thread(target=aeqwworker, args=(conf, address))
+    worker.start()
+    remote = solve(SERVE=address, AUTHKEY="test")
+    worker.join(60)
+    assert not worker.is_alive()
+    assert remote["runs"] == serial["runs"]
+    assert remote["output"] == serial["output"]
+
+
+def test_clusters_within_epsilon(solve):
+    single = solve(ngroups=12)
+    clustered = solve(ngroups=12, CLUSTERWIDTH=100.0, JOINT=True)
+    assert clustered["runs"] < single["runs"]
+    for row, expected in zip(clustered["rows"], single["rows"]):
+        assert row["abundance"]["result"] == "success"
+        assert (
+            abs(row["abundance"]["logabun"] - expected["abundance"]["logabun"]) < 0.01
+        )
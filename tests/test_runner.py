@@ -0,0 +1,52 @@
+# The direct runner links the model to fort.8 without touching the user's files.
+
+import os
+import stat
+
+import pytest
+
+from aeqw.isynspec import makescratch
+from aeqw.runner import DirectRunner
+
+
+# A SYNSPEC which copies fort.8 to fort.16, so that a run shows what it read.
+@pytest.fixture
+def runner(tmp_path):
+    executable = tmp_path / "synspec"
+    executable.write_text("#!/bin/sh\ncat fort.8 > fort.16\n")
+    executable.chmod(executable.stat().st_mode | stat.S_IXUSR)
+    return DirectRunner(str(executable))
+
+
+@pytest.fixture
+def srcdir(tmp_path):
+    srcdir = tmp_path / "src"
+    srcdir.mkdir()
+    (srcdir / "model.5").write_text("33000. 4.0\n")
+    (srcdir / "model.7").write_text("atmosphere\n")
+    for fn in ("fort.55", "fort.56"):
+        (srcdir / fn).write_text("")
+    return srcdir
+
+
+def test_link_removed(runner, srcdir):
+    assert runner("model", str(srcdir)) == 0
+    assert (srcdir / "fort.16").read_text() == "atmosphere\n"
+    assert not os.path.lexists(srcdir / "fort.8")
+
+
+def test_fort8_kept(runner, srcdir):
+    (srcdir / "fort.8").write_text("another atmosphere\n")
+    with pytest.raises(FileExistsError):
+        runner("model", str(srcdir))
+    assert (srcdir / "fort.8").read_text() == "another atmosphere\n"
+
+
+def test_scratch_link(runner, srcdir, tmp_path):
+    workdir = tmp_path / "scratch"
+    workdir.mkdir()
+    makescratch(str(workdir), "model", str(srcdir), runner)
+    assert runner("model", str(workdir)) == 0
+    assert (workdir / "fort.16").read_text() == "atmosphere\n"
+    assert os.readlink(workdir / "fort.8") == "model.7"
+    assert not os.path.lexists(srcdir / "fort.8")
@@ -0,0 +1,58 @@
+# The solvers give up on targets they cannot reach.
+
+from aeqw.config import Config
+from aeqw.solvers import IterateBracket, IterateLinear
+
+
+# Run the solver against a curve of growth eqw(abundance) till it returns.
+def solve(iterate, conf, curve, xeqw, initabun=1e-4):
+    iteration = iterate(conf, xeqw, initabun)
+    trial = next(iteration)
+    trials = 1
+    try:
+        while True:
+            trial = iteration.send([(trial, curve(trial), curve(trial))])
+            trials += 1
+    except StopIteration as stop:
+        return stop.value, trials
+
+
+# A blend of 50 mA which is never nulled, below a line of the element.
+def blended(abun):
+    return 50.0 + 1e6 * abun
+
+
+def test_bracket_target_below_blend():
+    (result, abun, _), trials = solve(IterateBracket, Config(), blended, 20.0)
+    assert result["result"] == "error"
+    assert "below blend/zero" in result["message"]
+    assert trials < Config().getconf("MAXITER")
+
+
+def test_linear_target_below_blend():
+    (result, abun, _), _ = solve(IterateLinear, Config(), blended, 20.0)
+    assert result["result"] == "error"
+    assert "below blend/zero" in result["message"]
+
+
+# A curve of growth which jumps across the target, so it is never within EPSILON.
+def jump(abun):
+    return 100.0 if abun > 1e-5 else 10.0
+
+
+def test_bracket_maxiter():
+    conf = Config()
+    conf["aeqw"]["MAXITER"] = "12"
+    (result, abun, _), trials = solve(IterateBracket, conf, jump, 50.0)
+    assert result["result"] == "error"
+    assert "12 trials" in result["message"]
+    assert trials == 12
+
+
+def test_linear_maxiter():
+    conf = Config()
+    conf["aeqw"]["MAXITER"] = "12"
+    (result, abun, _), trials = solve(IterateLinear, conf, jump, 50.0)
+    assert result["result"] == "error"
+    assert "12 trials" in result["message"]
+    assert trials == 12
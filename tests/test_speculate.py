@@ -0,0 +1,19 @@
+# Extra abundances are run with the trials of the bracket solver only.
+
+import pytest
+
+
+def test_speculate_needs_bracket(solve):
+    with pytest.raises(ValueError):
+        solve(SPECULATE=2, SOLVER="linear")
+
+
+def test_speculate_within_epsilon(solve):
+    plain = solve(SOLVER="bracket")
+    speculated = solve(SOLVER="bracket", SPECULATE=2)
+    assert speculated["runs"] > plain["runs"]
+    for row, expected in zip(speculated["rows"], plain["rows"]):
+        assert row["abundance"]["result"] == expected["abundance"]["result"]
+        assert (
+            abs(row["abundance"]["logabun"] - expected["abundance"]["logabun"]) < 0.01
+        )
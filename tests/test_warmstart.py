@@ -0,0 +1,28 @@
+# The warm start database keeps the results saved by other processes.
+
+import collections
+
+from aeqw.warmstart import WarmStart
+
+Line = collections.namedtuple("Line", ("ALAM", "Z", "Q"))
+GROUP = [Line(500.0, 26, 2)]
+OTHER = [Line(510.0, 26, 2)]
+
+
+def test_merged(tmp_path):
+    fn = str(tmp_path / "warmstart.json")
+    first, second = WarmStart(fn, "model"), WarmStart(fn, "model")
+    first.add(GROUP, 1e-4)
+    first.save()
+    second.add(OTHER, 1e-5)
+    second.save()
+    merged = WarmStart(fn, "model")
+    assert merged.seed(GROUP)[0] == 1e-4
+    assert merged.seed(OTHER)[0] == 1e-5
+
+
+def test_seeded_run(solve):
+    cold = solve(SOLVER="bracket")
+    solve(SOLVER="bracket", WARMSTART="warmstart.json")
+    warm = solve(SOLVER="bracket", WARMSTART="warmstart.json")
+    assert warm["runs"] < cold["runs"]
@@ -0,0 +1,61 @@
+# The streaming writers give the results and comments of the json output, with
+# comments kept after the groups they follow whatever order groups finish in.
+
+import io
+import csv
+import json
+import collections
+
+from aeqw.writers import NDJSONWriter
+
+Line = collections.namedtuple("Line", ("ALAM", "Z", "Q"))
+
+
+def test_ndjson_round_trip(solve):
+    expected = json.loads(solve()["output"])
+    output = solve(OUTFMT="ndjson", outfn="aeqw.ndjson")["output"]
+    records = [json.loads(record) for record in output.splitlines()]
+    assert records[0] == dict(expected[0], type="header")
+    assert [record.pop("index") for record in records[1:]] == list(
+        range(len(expected[1]))
+    )
+    assert records[1:] == expected[1]
+
+
+def test_csv_round_trip(solve):
+    expected = json.loads(solve()["output"])
+    output = solve(OUTFMT="csv", outfn="aeqw.csv")["output"]
+    rows = list(csv.DictReader(io.StringIO(output)))
+    assert len(rows) == len(expected[1])
+    for row, entry in zip(rows, expected[1]):
+        assert row["model"] == expected[0]["model"]
+        assert row["type"] == entry["type"]
+        if entry["type"] == "comment":
+            assert row["message"] == entry["value"]
+            continue
+        assert float(row["target"]) == entry["target"]
+        assert row["wavelength"].split() == [
+            f"{line['wavelength']:.4f}" for line in entry["lines"]
+        ]
+        assert row["result"] == entry["abundance"]["result"]
+        for column in ("relabun", "logabun", "wingpercent"):
+            assert float(row[column]) == entry["abundance"][column]
+
+
+def test_comments_follow_their_groups(tmp_path):
+    group = ([Line(500.0, 26, 2)], 10.0)
+    testLines = ["C first\n", group, "C second\n", group, "C third\n"]
+    writer = NDJSONWriter(str(tmp_path / "out.ndjson"), {}, testLines)
+    writer.write(3, {"result": "success"})
+    writer.write(1, {"result": "success"})
+    writer.close()
+    with open(tmp_path / "out.ndjson") as f:
+        records = [json.loads(record) for record in f]
+    assert [(record["type"], record.get("index")) for record in records] == [
+        ("header", None),
+        ("comment", 0),
+        ("line", 3),
+        ("line", 1),
+        ("comment", 2),
+        ("comment", 4),
+    ]